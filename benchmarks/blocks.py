@@ -0,0 +1,48 @@
+"""Block types used by the benchmarks that run real nodes.
+
+Events carry the wall clock time they were sent at, so these are only meaningful when every node
+runs on the same machine.
+"""
+import asyncio
+import time
+
+from idiotic import block
+
+
+class Emitter(block.Block):
+    """Sends the current time `rate` times a second"""
+
+    def __init__(self, name, rate=100, **kwargs):
+        super().__init__(name, **kwargs)
+        self.rate = rate
+
+    async def run(self, *args, **kwargs):
+        start = time.monotonic()
+        sent = 0
+
+        while True:
+            await asyncio.sleep(.01)
+            due = int((time.monotonic() - start) * self.rate)
+            for _ in range(due - sent):
+                await self.output(time.time())
+            sent = due
+
+
+class Recorder(block.Block):
+    """Appends the time each event on its ``record`` input was sent, and how long it took to
+    arrive, to a file"""
+
+    def __init__(self, name, path, **kwargs):
+        super().__init__(name, **kwargs)
+        self.path = path
+        self._pending = []
+
+    async def record(self, sent):
+        self._pending.append((sent, time.time() - sent))
+
+    async def run(self, *args, **kwargs):
+        while True:
+            await asyncio.sleep(.5)
+            pending, self._pending = self._pending, []
+            with open(self.path, 'a') as f:
+                f.writelines("{!r} {!r}\n".format(sent, latency) for sent, latency in pending)
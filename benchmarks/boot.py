@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Measures how long a cluster takes to boot from nothing until all of its blocks are running.
+
+Each run starts `nodes` fresh node processes on loopback ports, as in ``benchmarks.cluster``,
+with `floating` emitter and recorder pairs that may run anywhere and no saved raft state. The time
+is taken from starting the processes until every block is owned and running, and each node's own
+account of its startup phases is collected from ``/debug/blocks``.
+
+    python -m benchmarks.boot [-N NODES] [-f FLOATING] [-r RUNS] [-j] [-o FILE]
+"""
+import asyncio
+import json
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import aiohttp
+import yaml
+
+from benchmarks import cluster
+
+
+async def boot(conf, path, directory, timeout):
+    urls = {name: "http://127.0.0.1:{}/".format(node["rpc_port"]) for name, node in conf["nodes"].items()}
+    start = time.monotonic()
+    processes = {name: cluster.start_node(name, path, directory) for name in conf["nodes"]}
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            async def all_running():
+                for name, process in processes.items():
+                    if process.poll() is not None:
+                        raise RuntimeError("Node {} exited with status {}; see its log in {}".format(
+                            name, process.returncode, directory))
+
+                states = await cluster.block_states(session, urls)
+                return len(states) == len(conf["blocks"]) and all(running for _, running in states.values())
+
+            done = await cluster.wait_for(all_running, timeout, interval=.05)
+            seconds = None if done is None else time.monotonic() - start
+
+            phases = {}
+            for name, url in urls.items():
+                status = await cluster.fetch(session, url + "debug/blocks")
+                if status is not None:
+                    phases[name] = status["startup"]
+    finally:
+        for process in processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in processes.values():
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    return seconds, phases
+
+
+def run(options):
+    runs = []
+    for i in range(options.runs):
+        directory = tempfile.mkdtemp(prefix="idiotic-boot-")
+        conf = cluster.make_config(options.nodes, options.base_port, 1, options.floating, directory, journal=False)
+        path = os.path.join(directory, "conf.yaml")
+        with open(path, "w") as f:
+            yaml.safe_dump(conf, f)
+
+        seconds, phases = asyncio.get_event_loop().run_until_complete(boot(conf, path, directory, options.timeout))
+        runs.append({"seconds": seconds, "phases": phases})
+
+        if options.keep:
+            runs[-1]["directory"] = directory
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    booted = [run["seconds"] for run in runs if run["seconds"] is not None]
+
+    # The slowest node in each run, phase by phase
+    slowest = {}
+    for run in runs:
+        for node_phases in run["phases"].values():
+            for phase, seconds in node_phases.items():
+                slowest.setdefault(phase, []).append(seconds)
+
+    return {
+        "runs": runs,
+        "failed": len(runs) - len(booted),
+        "median_seconds": sorted(booted)[len(booted) // 2] if booted else None,
+        "min_seconds": min(booted) if booted else None,
+        "phases_mean": {phase: sum(values) / len(values) for phase, values in slowest.items()},
+    }
+
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-N", "--nodes", dest="nodes", type="int", default=3, help="number of nodes")
+    parser.add_option("-f", "--floating", dest="floating", type="int", default=50,
+                      help="emitter and recorder pairs that may run on any node")
+    parser.add_option("-r", "--runs", dest="runs", type="int", default=3, help="times to boot the cluster")
+    parser.add_option("-p", "--base-port", dest="base_port", type="int", default=29500,
+                      help="first of the loopback ports to use")
+    parser.add_option("-t", "--timeout", dest="timeout", type="float", default=60,
+                      help="seconds to wait for the cluster to boot")
+    parser.add_option("-k", "--keep", dest="keep", action="store_true", help="keep the config and logs")
+    parser.add_option("-j", "--json", dest="json", action="store_true", help="print results as JSON")
+    parser.add_option("-o", "--output", dest="output", metavar="FILE", help="also write the JSON results to FILE")
+    (options, args) = parser.parse_args()
+
+    results = dict(
+        python=platform.python_version(),
+        nodes=options.nodes,
+        floating=options.floating,
+        **run(options)
+    )
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print("boot:      {} of {} runs booted, median {}s, best {}s".format(
+            options.runs - results["failed"], options.runs,
+            cluster.format_ms(results["median_seconds"]), cluster.format_ms(results["min_seconds"])))
+        for phase, seconds in results["phases_mean"].items():
+            print("  {:<18} {:.3f}s".format(phase, seconds))
+
+
+if __name__ == "__main__":
+    main()
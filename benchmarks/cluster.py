@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""Runs a cluster of real nodes on this machine, and measures how it performs.
+
+Each node is a separate process listening on loopback ports, replicating the cluster state with
+raft and sending events to the others over HTTP, just as it would on separate machines. Every
+node runs an emitter sending `rate` events a second to a recorder pinned to the next node, so that
+all events cross between nodes. There are also `floating` emitter and recorder pairs that may run
+anywhere.
+
+Once everything is running, the harness measures for `duration` seconds and reports:
+
+* the end-to-end latency of events between nodes, and how many arrived
+* how long the cluster took to commit each kind of change to its shared state
+* after killing the node with the most floating blocks, how long it took until all of them were
+  owned and running on the nodes left, which is at least the `node_timeout` the leader waits
+  before giving up on a node. The benchmark fails if they don't move within ``--failover-timeout``.
+* after starting the killed node again, how long it took to become ready, from the raft
+  snapshot and journal it left behind unless ``--no-journal`` is given, and to have all of its
+  blocks running again
+
+    python -m benchmarks.cluster [-N NODES] [-r RATE] [-d DURATION] [--node-timeout SECONDS] [-j] [-o FILE]
+"""
+import asyncio
+import json
+import optparse
+import os
+import platform
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import yaml
+
+_BUCKET = re.compile(r'^(\w+)_bucket\{(?:operation="(\w+)",)?le="([^"]+)"\} (\S+)$')
+
+
+def make_config(nodes, base_port, rate, floating, directory, journal=True, node_timeout=5):
+    names = ["n{}".format(i) for i in range(nodes)]
+    blocks = {}
+
+    for i, name in enumerate(names):
+        receiver = names[(i + 1) % len(names)]
+        blocks["emit_{}".format(name)] = {
+            "type": "benchmarks.blocks.emitter", "rate": rate, "optional": True,
+            "require": [{"host.node_name": name}],
+        }
+        blocks["record_{}".format(name)] = {
+            "type": "benchmarks.blocks.recorder", "optional": True,
+            "path": os.path.join(directory, "record_{}.log".format(name)),
+            "inputs": {"record": "emit_{}".format(name)},
+            "require": [{"host.node_name": receiver}],
+        }
+
+    for i in range(floating):
+        blocks["float_emit_{}".format(i)] = {"type": "benchmarks.blocks.emitter", "rate": 1}
+        blocks["float_record_{}".format(i)] = {
+            "type": "benchmarks.blocks.recorder",
+            "path": os.path.join(directory, "float_record_{}.log".format(i)),
+            "inputs": {"record": "float_emit_{}".format(i)},
+        }
+
+    cluster = {"listen": "127.0.0.1", "port": base_port, "rpc_port": base_port + 1, "node_timeout": node_timeout}
+    if journal:
+        cluster["data_dir"] = os.path.join(directory, "raft")
+
+    return {
+        "version": 1,
+        "cluster": cluster,
+        "nodes": {
+            name: {
+                "host": "127.0.0.1",
+                "port": base_port + 10 * i,
+                "rpc_port": base_port + 10 * i + 1,
+                "stream_port": base_port + 10 * i + 2,
+            } for i, name in enumerate(names)
+        },
+        "blocks": blocks,
+        "profiling": {"enabled": False},
+    }
+
+
+def start_node(name, path, directory, verbose=False):
+    log = open(os.path.join(directory, "{}.log".format(name)), "a")
+    return subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.cluster", "--node", name, "--config", path] + (["-v"] if verbose else []),
+        stdout=log, stderr=subprocess.STDOUT,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+
+
+def run_node(name, path, verbose=False):
+    """Runs one node of the cluster in this process"""
+    from idiotic import __main__ as idiotic_main
+
+    sys.argv = ["idiotic", "-v" if verbose else "-q", "-c", path, name]
+    idiotic_main.main()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def histogram_quantile(buckets, fraction):
+    """Returns the upper bound of the bucket holding the given fraction of cumulative counts"""
+    total = buckets[-1][1] if buckets else 0
+    for bound, count in buckets:
+        if count >= total * fraction:
+            return bound
+
+
+def parse_histogram(texts, name):
+    """Adds up the buckets of a histogram from the metrics of several nodes, by operation"""
+    operations = {}
+    for text in texts:
+        for line in text.splitlines():
+            match = _BUCKET.match(line)
+            if match and match.group(1) == name:
+                buckets = operations.setdefault(match.group(2), {})
+                bound = float(match.group(3))
+                buckets[bound] = buckets.get(bound, 0) + float(match.group(4))
+    return {operation: sorted(buckets.items()) for operation, buckets in operations.items()}
+
+
+def read_latencies(directory, start, end):
+    latencies = []
+    for filename in os.listdir(directory):
+        if filename.startswith("record_") and filename.endswith(".log"):
+            with open(os.path.join(directory, filename)) as f:
+                for line in f:
+                    sent, latency = map(float, line.split())
+                    if start <= sent < end:
+                        latencies.append(latency)
+    return latencies
+
+
+async def fetch(session, url, kind="json"):
+    try:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=2)) as response:
+            response.raise_for_status()
+            return await (response.json() if kind == "json" else response.text())
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        return None
+
+
+async def block_states(session, urls):
+    """Returns a map of block name to [owner, running] as seen by the nodes in `urls`"""
+    states = {}
+    for name, url in urls.items():
+        status = await fetch(session, url + "debug/blocks")
+        if status is None:
+            continue
+        for blk, state in status["blocks"].items():
+            entry = states.setdefault(blk, [state["owner"], False])
+            if state["owner"] == name and state["running"]:
+                entry[1] = True
+    return states
+
+
+async def wait_for(condition, timeout, interval=.1):
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if await condition():
+            return time.monotonic() - start
+        await asyncio.sleep(interval)
+
+
+async def measure(conf, processes, directory, options):
+    urls = {name: "http://127.0.0.1:{}/".format(node["rpc_port"]) for name, node in conf["nodes"].items()}
+    results = {}
+
+    async with aiohttp.ClientSession() as session:
+        async def all_running():
+            for name, process in processes.items():
+                if process.poll() is not None:
+                    raise RuntimeError("Node {} exited with status {}; see its log in {}".format(
+                        name, process.returncode, directory))
+
+            states = await block_states(session, urls)
+            return len(states) == len(conf["blocks"]) and all(running for _, running in states.values())
+
+        # Measure anyway if some blocks never start, so that the results show it
+        results["startup_seconds"] = await wait_for(all_running, options.timeout, interval=.5)
+        results["not_running"] = sorted(blk for blk, (_, running) in (await block_states(session, urls)).items()
+                                        if not running)
+
+        start = time.time()
+        await asyncio.sleep(options.duration)
+        end = time.time()
+        # Give the recorders time to write out what has arrived
+        await asyncio.sleep(1)
+
+        latencies = read_latencies(directory, start, end)
+        offered = options.rate * len(conf["nodes"]) * (end - start)
+        results["events"] = {
+            "offered": int(offered),
+            "delivered": len(latencies),
+            "delivered_per_sec": len(latencies) / (end - start),
+            "p50_ms": percentile(latencies, .5) * 1e3 if latencies else None,
+            "p99_ms": percentile(latencies, .99) * 1e3 if latencies else None,
+        }
+
+        texts = [await fetch(session, url + "metrics", kind="text") for url in urls.values()]
+        results["commits"] = {
+            operation: {
+                "count": int(buckets[-1][1]),
+                "p50_ms_le": histogram_quantile(buckets, .5) * 1e3,
+                "p99_ms_le": histogram_quantile(buckets, .99) * 1e3,
+            } for operation, buckets in parse_histogram(filter(None, texts), "idiotic_raft_commit_seconds").items()
+        }
+
+        if options.failover:
+            states = await block_states(session, urls)
+            floating = [blk for blk in conf["blocks"] if blk.startswith("float_")]
+            owners = [states[blk][0] for blk in floating]
+            victim = max(set(owners), key=owners.count)
+            moving = [blk for blk, owner in zip(floating, owners) if owner == victim]
+
+            processes[victim].send_signal(signal.SIGKILL)
+            processes[victim].wait()
+            killed = time.monotonic()
+            survivors = {name: url for name, url in urls.items() if name != victim}
+
+            async def moved():
+                states = await block_states(session, survivors)
+                return all(states.get(blk, (victim, False))[0] in survivors and states[blk][1] for blk in moving)
+
+            done = await wait_for(moved, options.failover_timeout)
+            results["failover"] = {
+                "killed": victim,
+                "blocks": len(moving),
+                "seconds": None if done is None else time.monotonic() - killed,
+            }
+
+            processes[victim] = start_node(victim, options.config_path, directory, options.verbose)
+            started = time.monotonic()
+
+            async def ready():
+                status = await fetch(session, urls[victim] + "debug/blocks")
+                return status is not None and status["ready"]
+
+            async def running():
+                states = await block_states(session, urls)
+                return all(running for owner, running in states.values() if owner == victim)
+
+            ready_seconds = await wait_for(ready, options.timeout)
+            running_seconds = await wait_for(running, options.timeout) if ready_seconds is not None else None
+            results["restart"] = {
+                "journal": options.journal,
+                "ready_seconds": ready_seconds,
+                "running_seconds": None if running_seconds is None else time.monotonic() - started,
+            }
+
+    return results
+
+
+def run(options):
+    directory = tempfile.mkdtemp(prefix="idiotic-bench-")
+    conf = make_config(options.nodes, options.base_port, options.rate, options.floating, directory, options.journal,
+                       options.node_timeout)
+    path = options.config_path = os.path.join(directory, "conf.yaml")
+    with open(path, "w") as f:
+        yaml.safe_dump(conf, f)
+
+    processes = {name: start_node(name, path, directory, options.verbose) for name in conf["nodes"]}
+    try:
+        results = asyncio.get_event_loop().run_until_complete(measure(conf, processes, directory, options))
+    finally:
+        for process in processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in processes.values():
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    if options.keep:
+        results["directory"] = directory
+    else:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return results
+
+
+def format_ms(value):
+    return "-" if value is None else "{:.3f}".format(value)
+
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-N", "--nodes", dest="nodes", type="int", default=3, help="number of nodes")
+    parser.add_option("-r", "--rate", dest="rate", type="float", default=100,
+                      help="events per second sent from each node")
+    parser.add_option("-f", "--floating", dest="floating", type="int", default=5,
+                      help="emitter and recorder pairs that may run on any node")
+    parser.add_option("-d", "--duration", dest="duration", type="float", default=10, help="seconds to measure for")
+    parser.add_option("-p", "--base-port", dest="base_port", type="int", default=29000,
+                      help="first of the loopback ports to use")
+    parser.add_option("-t", "--timeout", dest="timeout", type="float", default=30,
+                      help="seconds to wait for the cluster to start")
+    parser.add_option("--failover-timeout", dest="failover_timeout", type="float", default=30,
+                      help="seconds to wait for blocks to move off a killed node")
+    parser.add_option("--node-timeout", dest="node_timeout", type="float", default=5,
+                      help="seconds before the leader moves blocks off a node it has lost")
+    parser.add_option("--no-failover", dest="failover", action="store_false", default=True,
+                      help="don't kill and restart a node at the end")
+    parser.add_option("--no-journal", dest="journal", action="store_false", default=True,
+                      help="don't keep the raft state on disk, so a restarted node starts from nothing")
+    parser.add_option("-k", "--keep", dest="keep", action="store_true", help="keep the config and logs")
+    parser.add_option("-v", "--verbose", dest="verbose", action="store_true", help="log everything the nodes do")
+    parser.add_option("-j", "--json", dest="json", action="store_true", help="print results as JSON")
+    parser.add_option("-o", "--output", dest="output", metavar="FILE", help="also write the JSON results to FILE")
+    parser.add_option("--node", dest="node", help=optparse.SUPPRESS_HELP)
+    parser.add_option("--config", dest="config", help=optparse.SUPPRESS_HELP)
+    (options, args) = parser.parse_args()
+
+    if options.node:
+        run_node(options.node, options.config, options.verbose)
+        return
+
+    results = dict(
+        python=platform.python_version(),
+        nodes=options.nodes,
+        rate=options.rate,
+        duration=options.duration,
+        **run(options)
+    )
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        events = results["events"]
+        if results["startup_seconds"] is None:
+            print("startup:   not running after {:.0f}s: {}".format(options.timeout, ", ".join(results["not_running"])))
+        else:
+            print("startup:   {:.1f}s until all blocks were running".format(results["startup_seconds"]))
+        print("events:    {} of {} delivered, {:.0f}/s, p50 {} ms, p99 {} ms".format(
+            events["delivered"], events["offered"], events["delivered_per_sec"],
+            format_ms(events["p50_ms"]), format_ms(events["p99_ms"])))
+        for operation, commit in sorted(results["commits"].items()):
+            print("commits:   {} {}, p50 <= {} ms, p99 <= {} ms".format(
+                commit["count"], operation, format_ms(commit["p50_ms_le"]), format_ms(commit["p99_ms_le"])))
+        if "failover" in results:
+            failover = results["failover"]
+            print("failover:  {} blocks on {}: {}".format(
+                failover["blocks"], failover["killed"],
+                "did not move within {:.0f}s".format(options.failover_timeout) if failover["seconds"] is None
+                else "{:.2f}s until moved and running".format(failover["seconds"])))
+        if "restart" in results:
+            restart = results["restart"]
+            print("restart:   {} ready after {}, all blocks running after {}{}".format(
+                results["failover"]["killed"],
+                "-" if restart["ready_seconds"] is None else "{:.2f}s".format(restart["ready_seconds"]),
+                "-" if restart["running_seconds"] is None else "{:.2f}s".format(restart["running_seconds"]),
+                "" if restart["journal"] else " (no journal)"))
+
+    if "failover" in results and results["failover"]["seconds"] is None:
+        sys.exit("Blocks on the killed node did not move within {}s".format(options.failover_timeout))
+
+
+if __name__ == "__main__":
+    main()
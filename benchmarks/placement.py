@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Compares placing blocks with the placement solver against choosing each one's owner alone.
+
+A synthetic cluster of `nodes` nodes is given random capacities and weights, and `blocks` blocks
+are placed on it. A third of the blocks have no requirements, a third can only run on a few
+nodes, and the rest have a random fitness on every node. Before the solver, each block simply
+went to the node where its fitness was highest.
+
+For each method, the benchmark reports how long placing every block took, and:
+
+* ``imbalance``: the highest load for its weight on any node, over the mean
+* ``over_capacity``: how much load was placed beyond the capacity of the nodes
+* ``fitness``: the mean fitness of each block's owner, relative to the best it could have had
+* ``unplaced``: blocks left without an owner
+
+    python -m benchmarks.placement [-b BLOCKS] [-N NODES] [-s SEED] [-j] [-o FILE]
+"""
+import json
+import optparse
+import platform
+import random
+import time
+
+from idiotic import placement
+
+
+def make_cluster(blocks, nodes, seed, headroom):
+    rng = random.Random(seed)
+    names = ["n{}".format(i) for i in range(nodes)]
+    weights = {node: rng.choice([1, 1, 2, 4]) for node in names}
+
+    fitnesses = {}
+    block_loads = {}
+    for i in range(blocks):
+        name = "block_{}".format(i)
+        kind = i % 3
+        if kind == 0:
+            fitnesses[name] = {node: 1 for node in names}
+        elif kind == 1:
+            allowed = set(rng.sample(names, rng.randint(1, 3)))
+            fitnesses[name] = {node: 1 if node in allowed else False for node in names}
+        else:
+            fitnesses[name] = {node: round(rng.random(), 2) for node in names}
+        block_loads[name] = rng.choice([1, 1, 1, 2, 5])
+
+    # Enough room for everything, shared out by weight
+    total = sum(block_loads.values()) * headroom
+    capacities = {node: int(total * weights[node] / sum(weights.values())) + 1 for node in names}
+
+    return fitnesses, names, block_loads, capacities, weights
+
+
+def greedy(fitnesses, nodes, **kwargs):
+    owners = {}
+    unassignable = []
+    for name, node_fits in fitnesses.items():
+        eligible = sorted([(fit, node) for node, fit in node_fits.items() if fit is not False])
+        if eligible:
+            owners[name] = eligible[-1][1]
+        else:
+            unassignable.append(name)
+    return placement.Placement(owners, unassignable, [])
+
+
+def evaluate(result, fitnesses, nodes, block_loads, capacities, weights):
+    loads = {node: 0 for node in nodes}
+    for name, node in result.owners.items():
+        loads[node] += block_loads[name]
+
+    relative = [loads[node] / weights[node] for node in nodes]
+    mean = sum(relative) / len(relative)
+
+    scores = []
+    for name, node in result.owners.items():
+        best = max(fit for fit in fitnesses[name].values() if fit is not False)
+        scores.append(fitnesses[name][node] / best if best else 1)
+
+    return {
+        "imbalance": max(relative) / mean if mean else None,
+        "over_capacity": sum(max(0, loads[node] - capacities[node]) for node in nodes),
+        "fitness": sum(scores) / len(scores) if scores else None,
+        "unplaced": len(fitnesses) - len(result.owners),
+    }
+
+
+def run(options):
+    fitnesses, nodes, block_loads, capacities, weights = make_cluster(
+        options.blocks, options.nodes, options.seed, options.headroom)
+
+    results = {}
+    for method, func in (("greedy", greedy), ("solver", placement.place)):
+        times = []
+        for _ in range(options.repeat):
+            start = time.perf_counter()
+            result = func(fitnesses, nodes, block_loads=block_loads, capacities=capacities,
+                          weights=weights, tolerance=options.tolerance)
+            times.append(time.perf_counter() - start)
+
+        results[method] = dict(
+            ms=min(times) * 1e3,
+            **evaluate(result, fitnesses, nodes, block_loads, capacities, weights)
+        )
+
+    return results
+
+
+def format_value(value, spec="{:.3f}"):
+    return "-" if value is None else spec.format(value)
+
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-b", "--blocks", dest="blocks", type="int", default=2000, help="blocks to place")
+    parser.add_option("-N", "--nodes", dest="nodes", type="int", default=10, help="nodes in the cluster")
+    parser.add_option("-s", "--seed", dest="seed", type="int", default=0, help="seed for the random cluster")
+    parser.add_option("--headroom", dest="headroom", type="float", default=1.25,
+                      help="total capacity, as a multiple of the total block load")
+    parser.add_option("--tolerance", dest="tolerance", type="float", default=0,
+                      help="fitness difference treated as equal by the solver")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=5,
+                      help="times to place the blocks, keeping the fastest")
+    parser.add_option("-j", "--json", dest="json", action="store_true", help="print results as JSON")
+    parser.add_option("-o", "--output", dest="output", metavar="FILE", help="also write the JSON results to FILE")
+    (options, args) = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "blocks": options.blocks,
+        "nodes": options.nodes,
+        "seed": options.seed,
+        "methods": run(options),
+    }
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print("{:<8} {:>10} {:>10} {:>14} {:>8} {:>9}".format(
+            "method", "ms", "imbalance", "over_capacity", "fitness", "unplaced"))
+        for method, result in results["methods"].items():
+            print("{:<8} {:>10} {:>10} {:>14} {:>8} {:>9}".format(
+                method, format_value(result["ms"]), format_value(result["imbalance"], "{:.2f}"),
+                result["over_capacity"], format_value(result["fitness"], "{:.3f}"), result["unplaced"]))
+
+
+if __name__ == "__main__":
+    main()
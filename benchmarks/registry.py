@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""Compares loading block and resource types on demand against importing every one up front.
+
+Each run starts a fresh interpreter that either looks up only the block types a config uses,
+through the registry (``lazy``), or imports every module under ``idiotic.util`` first, as nodes
+used to at startup (``eager``). Resource types are loaded along with the blocks that require them.
+
+For each method, the benchmark reports the time taken to load the types, not counting the modules
+every node imports anyway, the peak RSS of the process, the number of modules imported, and any
+types or modules that couldn't be loaded, usually because an optional dependency isn't installed.
+
+The block types to look up are given with ``-t``, or taken from a config with ``-c``.
+
+    python -m benchmarks.registry [-c CONFIG] [-t TYPE ...] [-r RUNS] [-j] [-o FILE]
+"""
+import json
+import optparse
+import platform
+import subprocess
+import sys
+
+from idiotic import config
+
+#: Looked up when no config or types are given: some of the types in ``contrib/conf.yaml``, and
+#: the blocks used by the other benchmarks
+DEFAULT_TYPES = ["value.float", "logic.not_equal", "math.average", "random.float", "http.http",
+                 "benchmarks.blocks.emitter", "benchmarks.blocks.recorder"]
+
+
+def config_types(path):
+    conf = config.Config.load(path)
+    return sorted({block.get("type", "Block") for block in (conf.blocks or {}).values()})
+
+
+def load(method, types):
+    """Runs in the child process; returns what it measured"""
+    import importlib
+    import pkgutil
+    import resource
+    import time
+
+    # Every node imports these whichever types it runs
+    from idiotic import cluster  # noqa: F401
+    from idiotic.block import Block
+
+    start = time.perf_counter()
+
+    failed = {}
+    if method == "eager":
+        import idiotic.util
+        for _, name, _ in pkgutil.walk_packages(idiotic.util.__path__, "idiotic.util."):
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                failed[name] = str(e)
+
+    for block_type in types:
+        try:
+            Block.REGISTRY[block_type]
+        except KeyError:
+            failed[block_type] = "unknown type"
+        except ImportError as e:
+            failed[block_type] = str(e)
+
+    seconds = time.perf_counter() - start
+
+    return {
+        "seconds": seconds,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "modules": len(sys.modules),
+        "failed": failed,
+    }
+
+
+def measure(method, types):
+    output = subprocess.check_output([sys.executable, "-m", "benchmarks.registry", "--child", method] + types)
+    return json.loads(output.decode())
+
+
+def run(options, types):
+    results = {}
+    for method in ("eager", "lazy"):
+        runs = [measure(method, types) for _ in range(options.runs)]
+        results[method] = {
+            "ms": min(run["seconds"] for run in runs) * 1e3,
+            "max_rss_kb": min(run["max_rss_kb"] for run in runs),
+            "modules": runs[-1]["modules"],
+            "failed": runs[-1]["failed"],
+        }
+    return results
+
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-c", "--config", dest="config", metavar="FILE",
+                      help="load the block types to look up from FILE")
+    parser.add_option("-t", "--type", dest="types", action="append", metavar="TYPE",
+                      help="look up TYPE instead of the types in the config; may be given more than once")
+    parser.add_option("-r", "--runs", dest="runs", type="int", default=5,
+                      help="processes to start for each method, keeping the best")
+    parser.add_option("--child", dest="child", help=optparse.SUPPRESS_HELP)
+    parser.add_option("-j", "--json", dest="json", action="store_true", help="print results as JSON")
+    parser.add_option("-o", "--output", dest="output", metavar="FILE", help="also write the JSON results to FILE")
+    (options, args) = parser.parse_args()
+
+    if options.child:
+        print(json.dumps(load(options.child, args)))
+        return
+
+    if options.types:
+        types = options.types
+    elif options.config:
+        types = config_types(options.config)
+    else:
+        types = DEFAULT_TYPES
+
+    results = {
+        "python": platform.python_version(),
+        "types": types,
+        "methods": run(options, types),
+    }
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print("{:<8} {:>10} {:>12} {:>8} {:>7}".format("method", "ms", "max_rss_kb", "modules", "failed"))
+        for method, result in results["methods"].items():
+            print("{:<8} {:>10.1f} {:>12} {:>8} {:>7}".format(
+                method, result["ms"], result["max_rss_kb"], result["modules"], len(result["failed"])))
+            for name, error in sorted(result["failed"].items()):
+                print("  {}: {}".format(name, error))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""Measures how fast events get through a graph of blocks on a single node.
+
+The graph starts with one source block, followed by `depth` layers of relay blocks which pass on
+every input they get. Each block subscribes to `fan_in` blocks in the layer before it, and each
+layer has `fan_out` times as many blocks as the one before divided by `fan_in`, up to `width`.
+The last layer records when every event has arrived, by every path through the graph.
+
+Events are sent in three ways:
+
+* ``event_received``: as if they came from another node, queued in the blocks' mailboxes
+* ``dispatch``: queued by ``Node.dispatch``, and delivered by ``run_dispatch`` to this node
+* ``output``: by the source block itself, handled inline where the mailboxes allow it
+
+For each, a burst of events gives the throughput, and events sent one at a time give the
+latency until the last block has handled each one.
+
+    python -m benchmarks.routing [-n EVENTS] [-l SAMPLES] [-j] [-o FILE]
+    python -m benchmarks.routing --depth 10 --fan-in 2 --fan-out 4 --width 100
+"""
+import asyncio
+import json
+import math
+import optparse
+import platform
+import time
+
+import idiotic
+from idiotic import block
+from idiotic import cluster
+from idiotic import config
+from idiotic import profiling
+
+#: Graphs run when none is given on the command line
+SUITE = {
+    "chain": dict(depth=20, fan_in=1, fan_out=1, width=1),
+    "fan_out": dict(depth=2, fan_in=1, fan_out=20, width=400),
+    "fan_in": dict(depth=2, fan_in=10, fan_out=10, width=10),
+    "mesh": dict(depth=5, fan_in=2, fan_out=4, width=64),
+}
+
+METHODS = ("event_received", "dispatch", "output")
+
+
+class Relay(block.Block):
+    """Sends on every input it gets. Inputs may have any name starting with ``input_``."""
+
+    def __getattr__(self, name):
+        if name.startswith('input_'):
+            return self.relay
+        raise AttributeError(name)
+
+    async def relay(self, value):
+        await self.output(value)
+
+
+class Sink(Relay):
+    probe = None
+
+    async def relay(self, value):
+        self.probe.arrived(value)
+
+
+class Probe:
+    """Tracks events until they have reached the end of the graph by every path"""
+
+    def __init__(self, expected):
+        #: Number of times each event arrives at the last layer
+        self.expected = expected
+
+        self.sent = {}
+        self.latencies = []
+        self._remaining = {}
+        self._done = {}
+
+    def send(self, value):
+        self._remaining[value] = self.expected
+        self._done[value] = asyncio.get_event_loop().create_future()
+        self.sent[value] = time.perf_counter()
+
+    def arrived(self, value):
+        self._remaining[value] -= 1
+        if not self._remaining[value]:
+            del self._remaining[value]
+            self.latencies.append(time.perf_counter() - self.sent.pop(value))
+            self._done.pop(value).set_result(None)
+
+    async def wait(self, value):
+        future = self._done.get(value)
+        if future is not None:
+            await future
+
+    async def wait_all(self):
+        await asyncio.gather(*self._done.values())
+
+
+def build_graph(depth, fan_in, fan_out, width):
+    """Returns block settings for the graph, how many times an event reaches the last layer, and
+    how many inputs are handled in all for each event"""
+    blocks = {"src": {"type": "Block"}}
+    layer = ["src"]
+    paths = {"src": 1}
+
+    for level in range(1, depth + 1):
+        parents = min(fan_in, len(layer))
+        size = max(1, min(width, math.ceil(len(layer) * fan_out / parents)))
+        kind = "benchmarks.sink" if level == depth else "benchmarks.relay"
+
+        new_layer = []
+        for i in range(size):
+            name = "b_{}_{}".format(level, i)
+            # Spread the subscriptions so that every parent ends up with about fan_out children
+            inputs = {"input_{}".format(k): layer[(i * parents + k) % len(layer)] for k in range(parents)}
+            blocks[name] = {"type": kind, "inputs": inputs}
+            paths[name] = sum(paths[source] for source in inputs.values())
+            new_layer.append(name)
+
+        layer = new_layer
+
+    return blocks, sum(paths[name] for name in layer), sum(paths.values()) - 1
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def make_node(blocks):
+    conf = config.Config(
+        version=1,
+        cluster={"listen": "127.0.0.1", "port": 28300, "rpc_port": 28301},
+        nodes={"bench": {"host": "127.0.0.1"}},
+        blocks=blocks,
+    )
+    conf._node_name = "bench"
+    config.config = conf
+
+    node = cluster.Node("bench", cluster.Cluster(conf), conf)
+    idiotic.set_node(node)
+    await node.initialize_blocks()
+    return node
+
+
+async def measure(node, probe, method, events, samples):
+    source = node.blocks["src"]
+
+    async def send(value):
+        probe.send(value)
+        if method == "event_received":
+            await node.event_received({"data": value, "source": "src.src"})
+        elif method == "dispatch":
+            node.dispatch({"data": value, "source": "src.src"})
+        else:
+            await source.output(value)
+
+    tasks = [asyncio.ensure_future(task) for task in (
+        node.run_mailboxes(), node.run_dispatch(), node.run_messaging())]
+
+    try:
+        start = time.perf_counter()
+        for value in range(events):
+            await send(value)
+        await probe.wait_all()
+        elapsed = time.perf_counter() - start
+
+        probe.latencies = []
+        for value in range(events, events + samples):
+            await send(value)
+            await probe.wait(value)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return {
+        "events_per_sec": events / elapsed,
+        "p50_ms": percentile(probe.latencies, .5) * 1e3,
+        "p99_ms": percentile(probe.latencies, .99) * 1e3,
+    }
+
+
+async def run_graph(graph, events, samples):
+    blocks, expected, deliveries = build_graph(**graph)
+
+    results = {
+        "blocks": len(blocks),
+        "arrivals_per_event": expected,
+        "deliveries_per_event": deliveries,
+    }
+
+    for method in METHODS:
+        # Blocks are consumed by create(), so each method gets a fresh copy of the graph
+        node = await make_node(json.loads(json.dumps(blocks)))
+        # Events received by the node, or passed on by the relays' handlers, are dropped rather
+        # than waiting when a mailbox is full, so make room for every event sent at once
+        for blk in node.blocks.values():
+            blk.mailbox.size = max(blk.mailbox.size, events + samples)
+
+        Sink.probe = Probe(expected)
+        results[method] = await measure(node, Sink.probe, method, events, samples)
+        results[method]["deliveries_per_sec"] = results[method]["events_per_sec"] * deliveries
+
+    return results
+
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-n", "--events", dest="events", type="int", default=2000, help="events per burst")
+    parser.add_option("-l", "--latency-samples", dest="samples", type="int", default=500,
+                      help="events sent one at a time to measure latency")
+    parser.add_option("--depth", dest="depth", type="int", help="layers of blocks after the source")
+    parser.add_option("--fan-in", dest="fan_in", type="int", default=1, help="inputs of each block")
+    parser.add_option("--fan-out", dest="fan_out", type="int", default=1, help="subscribers of each block")
+    parser.add_option("--width", dest="width", type="int", default=100, help="most blocks in a layer")
+    parser.add_option("--no-profiling", dest="profiling", action="store_false", default=True,
+                      help="turn off the block profiler")
+    parser.add_option("--profile-sample", dest="profile_sample", type="float",
+                      help="fraction of calls to profile, instead of the default")
+    parser.add_option("-j", "--json", dest="json", action="store_true", help="print results as JSON")
+    parser.add_option("-o", "--output", dest="output", metavar="FILE", help="also write the JSON results to FILE")
+    (options, args) = parser.parse_args()
+
+    block.Block.REGISTRY.update({
+        "Block": block.Block,
+        "benchmarks.relay": Relay,
+        "benchmarks.sink": Sink,
+    })
+    profiling.PROFILER.configure(enabled=options.profiling, sample=options.profile_sample)
+
+    if options.depth:
+        graphs = {"custom": dict(depth=options.depth, fan_in=options.fan_in,
+                                 fan_out=options.fan_out, width=options.width)}
+    else:
+        graphs = SUITE
+
+    loop = asyncio.get_event_loop()
+    results = {
+        "python": platform.python_version(),
+        "events": options.events,
+        "latency_samples": options.samples,
+        "profiling": options.profiling,
+        "profile_sample": profiling.PROFILER.sample,
+        "graphs": {name: dict(graph, **loop.run_until_complete(run_graph(graph, options.events, options.samples)))
+                   for name, graph in graphs.items()},
+    }
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print("{:<10} {:>7} {:<15} {:>12} {:>14} {:>9} {:>9}".format(
+            "graph", "blocks", "method", "events/s", "deliveries/s", "p50 ms", "p99 ms"))
+        for name, graph in results["graphs"].items():
+            for method in METHODS:
+                res = graph[method]
+                print("{:<10} {:>7} {:<15} {:>12.0f} {:>14.0f} {:>9.3f} {:>9.3f}".format(
+                    name, graph["blocks"], method, res["events_per_sec"], res["deliveries_per_sec"],
+                    res["p50_ms"], res["p99_ms"]))
+
+
+if __name__ == "__main__":
+    main()
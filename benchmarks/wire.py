@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Compares the cost of encoding and decoding events with JSON and with the binary wire format.
+
+    python -m benchmarks.wire [-n EVENTS] [-b BATCH] [-s SOURCES]
+"""
+import json
+import optparse
+import random
+import time
+
+from idiotic import wire
+
+
+def make_events(count, sources):
+    names = ["sensor_{}.{}".format(i, random.choice(("temperature", "humidity", "motion", "state")))
+             for i in range(sources)]
+    values = (
+        lambda: random.random() * 100,
+        lambda: bool(random.getrandbits(1)),
+        lambda: random.randint(0, 1000),
+        lambda: random.choice(("on", "off", "Rainbow", "Strobey")),
+        lambda: (random.random() * 100, random.random() * 100),
+    )
+    return [{"data": random.choice(values)(), "source": random.choice(names)} for _ in range(count)]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    res = func(*args)
+    return time.perf_counter() - start, res
+
+
+def run(events, batch):
+    batches = [events[i:i + batch] for i in range(0, len(events), batch)]
+    results = {}
+
+    # What /rpc does: one JSON document per event
+    enc, encoded = timed(lambda: [json.dumps(e).encode('utf-8') for e in events])
+    dec, _ = timed(lambda: [json.loads(e.decode('utf-8')) for e in encoded])
+    results['json_single'] = (enc, dec, sum(map(len, encoded)))
+
+    # What /rpc/batch does with JSON
+    enc, encoded = timed(lambda: [json.dumps(b).encode('utf-8') for b in batches])
+    dec, _ = timed(lambda: [json.loads(b.decode('utf-8')) for b in encoded])
+    results['json_batch'] = (enc, dec, sum(map(len, encoded)))
+
+    # What /rpc/batch does with the binary format; each batch has its own source table
+    enc, encoded = timed(lambda: [wire.Encoder().encode(b) for b in batches])
+    dec, decoded = timed(lambda: [wire.Decoder().decode(b) for b in encoded])
+    results['binary_batch'] = (enc, dec, sum(map(len, encoded)))
+
+    # What a stream connection does: one source table for the whole connection
+    encoder, decoder = wire.Encoder(), wire.Decoder()
+    enc, encoded = timed(lambda: [encoder.encode(b) for b in batches])
+    dec, _ = timed(lambda: [decoder.decode(b) for b in encoded])
+    results['binary_stream'] = (enc, dec, sum(map(len, encoded)))
+
+    return {
+        name: {
+            "encode_us_per_event": enc / len(events) * 1e6,
+            "decode_us_per_event": dec / len(events) * 1e6,
+            "bytes_per_event": size / len(events),
+        } for name, (enc, dec, size) in results.items()
+    }
+
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-n", "--events", dest="events", type="int", default=100000, help="number of events")
+    parser.add_option("-b", "--batch", dest="batch", type="int", default=100, help="events per batch")
+    parser.add_option("-s", "--sources", dest="sources", type="int", default=50, help="number of distinct sources")
+    parser.add_option("-j", "--json", dest="json", action="store_true", help="print results as JSON")
+    (options, args) = parser.parse_args()
+
+    random.seed(0)
+    results = run(make_events(options.events, options.sources), options.batch)
+
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print("{:<15} {:>12} {:>12} {:>12}".format("format", "encode us", "decode us", "bytes"))
+        for name, res in results.items():
+            print("{:<15} {:>12.3f} {:>12.3f} {:>12.1f}".format(
+                name, res["encode_us_per_event"], res["decode_us_per_event"], res["bytes_per_event"]))
+
+
+if __name__ == "__main__":
+    main()
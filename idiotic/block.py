@@ -2,18 +2,30 @@ import logging
 from typing import Set
 from idiotic import resource
 from idiotic import config as global_config
+from idiotic import profiling
+from idiotic import registry
 import idiotic
 import asyncio
+import collections
+import contextvars
+import time
 
 log = logging.getLogger(__name__)
 
+#: How many blocks deep the current chain of inline deliveries is
+_inline_depth = contextvars.ContextVar('inline_depth', default=0)
+
+#: Whether the current task is handling an input, and so holding some mailbox's lock
+_handling = contextvars.ContextVar('handling', default=False)
+
 
 if False:
     from idiotic.cluster import Cluster
 
 
 class Block:
-    REGISTRY = {}
+    #: Every type of block, by the key used for it in the config
+    REGISTRY = registry.Registry('blocks')
 
     running = False
 
@@ -23,6 +35,18 @@ class Block:
     resources = []
     config = {}
 
+    #: Whether a waiting output may be replaced by a newer one from the same source, for blocks
+    #: whose outputs are samples of a state rather than discrete events
+    coalesce = False
+
+    #: Whether inputs may be handled directly by the block that produced them, rather than by the
+    #: mailbox's task. Blocks whose inputs wait on the network or a device should turn this off,
+    #: so that they don't hold up the block sending to them.
+    inline_inputs = True
+
+    #: How much of a node's capacity the block takes up, relative to other blocks
+    load = 1
+
     def __init__(self, name, inputs=None, resources=None, optional=False, **config):
         #: A globally unique identifier for the block
         self.name = name
@@ -41,48 +65,227 @@ class Block:
         await asyncio.sleep(3600)
 
     async def run_while_ok(self, cluster: 'Cluster'):
+        """Runs the block for as long as it is owned by this node and its resources are available.
+        Returns True if it stopped by itself rather than being moved, in which case it has been
+        reassigned, away from this node if its resources were unavailable here."""
         if self.running:
-            return
+            return False
 
         self.running = True
+        unavailable = False
+
+        # The block only runs as long as its owner hasn't changed since it started. If it moves,
+        # even back to this node, whoever moved it will start it again.
+        epoch = cluster.block_epoch(self.name)
+        superseded = asyncio.ensure_future(cluster.wait_superseded(self.name, epoch))
         try:
             if idiotic.node.own_block(self.name):
                 await self.init_resources()
 
-            while idiotic.node.own_block(self.name) and (await self.check_resources()):
-                await self.run()
+            while not superseded.done() and idiotic.node.own_block(self.name):
+                if not await self.check_resources():
+                    unavailable = True
+                    break
+
+                task = asyncio.ensure_future(profiling.PROFILER.wrap(self.name, 'run', self.run()))
+                await asyncio.wait([task, superseded], return_when=asyncio.FIRST_COMPLETED)
+
+                if not task.done():
+                    log.info("Block %s was assigned to %s, stopping it here", self.name, cluster.block_owner(self.name))
+                    task.cancel()
+                    await asyncio.wait([task])
+                    break
+
+                task.result()
 
         except KeyboardInterrupt:
             raise
         except:
             log.exception("While running block %s", self.name)
+        finally:
+            superseded.cancel()
         self.running = False
 
-        if idiotic.node.own_block(self.name):
-            idiotic.node.cluster.reassign_block(self)
+        if idiotic.node.own_block(self.name) and cluster.block_epoch(self.name) == epoch:
+            cluster.reassign_block(self, epoch, avoid=idiotic.node.name if unavailable else None)
+            return True
+
+        return False
 
     async def init_resources(self):
-        while not all((r.running for r in self.resources)):
-            await asyncio.sleep(.1)
+        await asyncio.gather(*(r.wait_running() for r in self.resources))
 
     def require(self, *resources: resource.Resource):
+        """Adds resources that the block needs. Once the block is on a node, any with the same
+        description as one already there are replaced by that one, so that each is only run and
+        checked once."""
         self.resources.extend(resources)
 
-    async def run_resources(self):
-        await asyncio.gather(*[asyncio.ensure_future(r.run()) for r in self.resources])
+    async def run_resources(self, scheduler: resource.Scheduler):
+        await asyncio.gather(*[asyncio.ensure_future(scheduler.start(r)) for r in self.resources])
 
     async def check_resources(self) -> bool:
+        """Returns whether all of the block's resources are available, as last checked. Resources
+        that have never been checked, or were unavailable and have gone stale, are checked now,
+        all at once."""
+        unchecked = []
         for res in self.resources:
-            if not await res.available():
+            available = res.cached_available()
+            if available is None or (not available and res.stale()):
+                # Don't stop the block over an old failure without checking again
+                unchecked.append(res)
+            elif not available:
                 return False
 
+        if unchecked:
+            return all(await asyncio.gather(*(res.refresh() for res in unchecked)))
+
         return True
 
     async def output(self, data, *args):
         if not args:
           args = [self.name,]
         for source in args:
-            idiotic.node.dispatch({"data": data, "source": self.name+"."+source})
+            source = self.name + "." + source
+
+            # Nobody is listening, so don't bother sending it anywhere
+            if not idiotic.node.cluster.has_subscribers(source):
+                continue
+
+            await idiotic.node.output({"data": data, "source": source}, self.coalesce)
+
+
+class Mailbox:
+    """Holds the inputs waiting to be handled by a block. Inputs are handled in order, one at a
+    time, by the mailbox's own task, so a slow block only holds up its own inputs.
+
+    When the mailbox is full, the `overflow` policy decides what happens to a new input:
+
+    * ``block``: wait until there is room. Only inputs sent by blocks on this node from outside
+      of any handler wait. Inputs from other nodes are all received by one task, which can't wait
+      for any one block, and a handler waiting could wait on its own mailbox through a loop of
+      blocks, so for those the oldest waiting input is discarded instead.
+    * ``drop_oldest``: discard the oldest waiting input
+    * ``latest``: keep only the newest waiting value for each input, and otherwise drop the oldest
+
+    With `inline` set, an input sent by a block on this node is handled straight away by the
+    sender's task whenever the mailbox is idle, instead of waiting for the mailbox's task. Chains of
+    inline deliveries are limited to `MAX_INLINE_DEPTH` blocks; past that, inputs are queued.
+    """
+
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    LATEST = 'latest'
+
+    MAX_INLINE_DEPTH = 16
+
+    def __init__(self, name, size=100, overflow=BLOCK, inline=True):
+        if overflow not in (self.BLOCK, self.DROP_OLDEST, self.LATEST):
+            raise ValueError("Invalid mailbox overflow policy for {}: {}".format(name, overflow))
+
+        self.name = name
+        self.size = size
+        self.overflow = overflow
+        self.inline = inline
+
+        #: Number of inputs discarded because the mailbox was full
+        self.dropped = 0
+
+        #: Number of inputs replaced by a newer value under the ``latest`` policy
+        self.replaced = 0
+
+        #: Histogram to record how long each input takes to handle, if any
+        self.duration = None
+
+        self._items = collections.deque()
+        self._latest = {}
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+
+        # Held while an input is being handled, whether by our task or inline
+        self._busy = asyncio.Lock()
+
+    @property
+    def depth(self):
+        return len(self._items)
+
+    def _popleft(self):
+        item = self._items.popleft()
+        if self._latest.get(item[0]) is item:
+            del self._latest[item[0]]
+        self._not_full.set()
+        return item
+
+    async def put(self, key, handler, data, sent=None, latency=None):
+        """Queues an input, waiting for room under the ``block`` policy unless called while
+        handling another input. If `latency` is given, the time from `sent` until the input has
+        been handled is recorded in it."""
+        if self.overflow == self.BLOCK and not _handling.get():
+            while len(self._items) >= self.size:
+                self._not_full.clear()
+                await self._not_full.wait()
+
+        self.put_nowait(key, handler, data, sent, latency)
+
+    def put_nowait(self, key, handler, data, sent=None, latency=None):
+        """Queues an input without waiting. If the mailbox is full, the oldest input is discarded,
+        whatever the policy."""
+        if self.overflow == self.LATEST and key in self._latest:
+            self._latest[key][2:] = data, sent, latency
+            self.replaced += 1
+            return
+
+        while len(self._items) >= self.size:
+            self._popleft()
+            self.dropped += 1
+
+        item = [key, handler, data, sent, latency]
+        self._items.append(item)
+        if self.overflow == self.LATEST:
+            self._latest[key] = item
+        self._not_empty.set()
+
+    async def deliver(self, key, handler, data, sent=None, latency=None):
+        """Handles an input right away if possible, or queues it otherwise"""
+        depth = _inline_depth.get()
+
+        if not self.inline or self._items or self._busy.locked() or depth >= self.MAX_INLINE_DEPTH:
+            await self.put(key, handler, data, sent, latency)
+            return
+
+        async with self._busy:
+            token = _inline_depth.set(depth + 1)
+            try:
+                await self._handle(key, handler, data, sent, latency)
+            finally:
+                _inline_depth.reset(token)
+
+    async def _handle(self, key, handler, data, sent, latency):
+        start = time.monotonic()
+        token = _handling.set(True)
+        try:
+            await profiling.PROFILER.wrap(self.name, 'input', handler(data))
+        except Exception:
+            log.exception("While handling input %s", key)
+        finally:
+            _handling.reset(token)
+        end = time.monotonic()
+
+        if self.duration is not None:
+            self.duration.observe(end - start)
+        if latency is not None:
+            latency.observe(end - sent)
+
+    async def run(self):
+        while True:
+            if not self._items:
+                self._not_empty.clear()
+                await self._not_empty.wait()
+                continue
+
+            key, handler, data, sent, latency = self._popleft()
+            async with self._busy:
+                await self._handle(key, handler, data, sent, latency)
 
 
 class InlineBlock(Block):
@@ -130,6 +333,9 @@ class ParameterBlock:
         return self.__param_dict.get(key)
 
 
+Block.REGISTRY['Block'] = Block
+
+
 def create(name, block_config):
     block_type = block_config.get("type", "Block")
 
@@ -142,7 +348,13 @@ def create(name, block_config):
 
     requires = block_config.get("require", [])
 
-    for attr in ("type", "inputs", "require"):
+    mailbox = block_config.get("mailbox", {})
+
+    coalesce = block_config.get("coalesce", False)
+
+    load = block_config.get("load")
+
+    for attr in ("type", "inputs", "require", "mailbox", "coalesce", "load"):
         if attr in block_config:
             del block_config[attr]
 
@@ -151,6 +363,10 @@ def create(name, block_config):
     res = block_cls(name=name, **block_config)
     res.inputs = inputs
     res.input_to = input_to
+    res.mailbox = Mailbox(name, **dict({"inline": res.inline_inputs}, **mailbox))
+    res.coalesce = coalesce
+    if load is not None:
+        res.load = load
 
     for req in requires:
         res.require(resource.create(req))
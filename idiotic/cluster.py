@@ -2,14 +2,24 @@ import asyncio
 import functools
 import json
 import logging
+import os
+import time
 
 import aiohttp
 from aiohttp import web
-from pysyncobj import SyncObj, replicated
-import collections
+from pysyncobj import SyncObj, SyncObjConf, SyncObjConsumer, replicated, FAIL_REASON
+import collections.abc
 
 from idiotic import block
 from idiotic import config
+from idiotic import fitness
+from idiotic import metrics
+from idiotic import peer
+from idiotic import placement
+from idiotic import profiling
+from idiotic import resource
+from idiotic import watchdog
+from idiotic import wire
 
 log = logging.getLogger(__name__)
 
@@ -18,7 +28,13 @@ class UnassignableBlock(Exception):
     pass
 
 
-class FrozenDict(collections.Mapping):
+def source_keys(name):
+    """Returns the event sources that an input connected to `name` will receive. An input
+    may name either a specific output, or a block whose default output is `name.name`."""
+    return name, "{0}.{0}".format(name)
+
+
+class FrozenDict(collections.abc.Mapping):
     def __init__(self, data):
         self._data = data
 
@@ -32,126 +48,470 @@ class FrozenDict(collections.Mapping):
         return iter(self._data)
 
 
-class KVStorage(SyncObj):
-    __owners = {}
-    __resources = {}
+class SharedState(SyncObjConsumer):
+    """The state replicated across the cluster: the owner and ownership epoch of every block, and
+    the fitness of every resource on every node.
 
-    def __init__(self, self_address, partner_addrs):
-        super(KVStorage, self).__init__(self_address, partner_addrs)
+    Every change is passed to each of `listeners` as it is applied, as ``(kind, changes)``, where
+    `kind` is ``'owners'`` with a map of block names to ``(owner, epoch)``, ``'fitness'`` with a
+    map of ``(resource, node)`` to fitness, or ``'reset'`` with a copy of the whole state, as
+    ``(owners, fitness)`` in those same forms, when it has been replaced. They are called from the
+    replication thread.
+    """
+    def __init__(self):
+        self.listeners = []
 
-    @replicated
-    def set_block_owner(self, block_id, owner):
-        self.__owners[block_id] = owner
+        # Everything set after this is replicated
+        super().__init__()
 
-    def find_block_owner(self, block_id):
-        return self.__owners.get(block_id, None)
+        self.owners = {}
+        self.epochs = {}
+        self.fitness = fitness.FitnessMatrix()
 
-    @property
-    def block_owners(self):
-        return FrozenDict(self.__owners)
+    def _notify(self, kind, changes):
+        for listener in self.listeners:
+            try:
+                listener(kind, changes)
+            except:
+                log.exception("While notifying of %s changes", kind)
 
     @replicated
-    def set_resource_fitness(self, resource, node, result):
-        self.__resources[(resource, node)] = result
+    def compare_and_set_block_owners(self, owners, epochs):
+        """Sets the owner of each block in `owners` whose epoch is still the one given for it in
+        `epochs`, and moves it to the next epoch. Returns the new epochs of the blocks changed."""
+        changed = {}
+        for block_id, owner in owners.items():
+            epoch = self.epochs.get(block_id, 0)
+            if epochs.get(block_id) == epoch:
+                self.owners[block_id] = owner
+                self.epochs[block_id] = epoch + 1
+                changed[block_id] = (owner, epoch + 1)
+
+        if changed:
+            self._notify('owners', changed)
+        return {block_id: epoch for block_id, (_, epoch) in changed.items()}
 
-    def resource_fitness(self, resource, node):
-        return self.__resources.get((resource, node), 0)
-
-    @property
-    def resources(self):
-        return FrozenDict(self.__resources)
+    @replicated
+    def set_resource_fitness(self, resource, node, result):
+        self.fitness.set(resource, node, result)
+        self._notify('fitness', {(resource, node): result})
 
+    @replicated
+    def set_resource_fitnesses(self, node, results):
+        for resource, result in results.items():
+            self.fitness.set(resource, node, result)
+        self._notify('fitness', {(resource, node): result for resource, result in results.items()})
 
-class LocalKVStorage:
-    __owners = {}
-    __resources = {}
+    def _deserialize(self, data):
+        super()._deserialize(data)
+        # Copied here, since changes made after the snapshot are applied to it from this thread
+        # while the listeners are still catching up
+        owners = {name: (self.owners.get(name), epoch) for name, epoch in self.epochs.items()}
+        self._notify('reset', (owners, dict(self.fitness.items())))
 
-    def __init__(self):
-        pass
 
-    def set_block_owner(self, block_id, owner):
-        self.__owners[block_id] = owner
+class KVStorage(SyncObj):
+    """Replicates the shared state with the other nodes using raft"""
+    def __init__(self, self_address, partner_addrs, state, conf=None):
+        self.state = state
+        super(KVStorage, self).__init__(self_address, partner_addrs, conf=conf, consumers=[state])
 
-    def find_block_owner(self, block_id):
-        return self.__owners.get(block_id, None)
+    def apply(self, operation, *args, callback=None):
+        getattr(self.state, operation)(*args, callback=callback)
 
-    @property
-    def block_owners(self):
-        return FrozenDict(self.__owners)
 
-    def set_resource_fitness(self, resource, node, result):
-        self.__resources[(resource, node)] = result
+class LocalKVStorage:
+    """Applies changes to the shared state directly, for a cluster of one node"""
+    def __init__(self, state):
+        self.state = state
 
-    def resource_fitness(self, resource, node):
-        return self.__resources.get((resource, node), 0)
+    def apply(self, operation, *args, callback=None):
+        result = getattr(self.state, operation)(*args, _doApply=True)
 
-    @property
-    def resources(self):
-        return FrozenDict(self.__resources)
+        if callback is not None:
+            callback(result, FAIL_REASON.SUCCESS)
 
 
 class Cluster:
     def __init__(self, configuration: config.Config):
+        self.loop = asyncio.get_event_loop()
+
+        #: The replicated state, which is only read from and changed on the replication thread.
+        #: The event loop uses the copies of it below, kept up to date by its listeners.
+        self.state = SharedState()
+        self.state.listeners.append(self._state_changed)
+
         if len(configuration.nodes) == 1:
-            self.shared_data = LocalKVStorage()
+            self.shared_data = LocalKVStorage(self.state)
             self.single_node = True
         else:
             self.single_node = False
             self.shared_data = KVStorage(
                 '{}:{}'.format(configuration.cluster_host, configuration.cluster_port),
                 ['{}:{}'.format(h, p) for h, p in configuration.connect_hosts()],
+                self.state,
+                self.raft_conf(configuration),
             )
         log.info("Listening for cluster on %s:%s", configuration.cluster_host, configuration.cluster_port)
         log.debug("Connecting to %s", list(configuration.connect_hosts()))
 
         self.config = configuration
 
+        #: Every block in the cluster, by name
+        self.blocks = {}
+
+        #: Maps each event source to the names of all blocks in the cluster subscribed to it
+        self.subscribers = {}
+
+        #: The owner of every assigned block, and the epoch of every block, as last applied here.
+        #: Unlike the state, these are only changed on the event loop.
+        self.owners = {}
+        self.epochs = {}
+
+        #: The fitness of every resource on every node, as last applied here
+        self.fitness = fitness.FitnessMatrix()
+
+        #: The blocks owned by this node
+        self.owned = set()
+
+        #: Incremented every time any block's owner is changed
+        self.owners_version = 0
+
+        #: Called on the event loop with (kind, changes) after every change to the shared state is
+        #: applied, as for SharedState.listeners, ('leader', state) when this node's raft state
+        #: changes, or ('lost', nodes) when the set of lost nodes changes
+        self.listeners = []
+
+        #: The other nodes that this node hasn't been connected to for node_timeout seconds. The
+        #: leader doesn't place blocks on them, and moves their blocks elsewhere.
+        self.lost = frozenset()
+
+        # When each other node was first seen to be disconnected, while it still is
+        self._disconnected_since = {}
+
+        # Node names by the address they replicate the cluster state on
+        self._raft_names = {'{}:{}'.format(*configuration.cluster_address(name)): name
+                            for name in configuration.nodes}
+
+        self._destinations = {}
+        self._sources = {}
+        self._epoch_waiters = {}
+
+        self._ready = asyncio.Event()
+        if self.single_node:
+            self._ready.set()
+
+        # (condition, future) for everything waiting for the state to reach some condition
+        self._conditions = []
+
+        #: Histogram to record the time taken to commit changes in, by operation, if any. It is
+        #: updated from the replication thread.
+        self.commit_latency = None
+
+        # Blocks which have been placed, but whose new owner hasn't been committed yet
+        self._placing = set()
+
+    def raft_conf(self, configuration):
+        """Returns the raft settings from the cluster config. With a data_dir, the raft log is
+        journaled there and snapshots of the state are written there every compaction_interval
+        seconds, or every compaction_entries changes, so that a restarted node starts from
+        those and only has to catch up on what it missed."""
+        options = dict(
+            onReady=lambda: self._state_changed('ready', None),
+            onStateChanged=lambda old, new: self._state_changed('leader', new),
+            # How soon a node that has come back is reconnected to
+            connectionRetryTime=configuration.cluster.get('reconnect_interval', 1),
+        )
+
+        data_dir = configuration.cluster.get('data_dir')
+        if data_dir:
+            os.makedirs(data_dir, exist_ok=True)
+            path = os.path.join(data_dir, configuration.nodename)
+            options.update(
+                fullDumpFile=path + '.dump',
+                journalFile=path + '.journal',
+                logCompactionMinEntries=configuration.cluster.get('compaction_entries', 5000),
+                logCompactionMinTime=configuration.cluster.get('compaction_interval', 300),
+            )
+            log.info("Keeping the cluster state in %s", data_dir)
+
+        return SyncObjConf(**options)
+
+    def set_blocks(self, blocks):
+        """Records every block in the cluster, and the subscribers of every event source from their
+        inputs."""
+        self.blocks = blocks
+
+        subscribers = {}
+        sources = {}
+        for blk in blocks.values():
+            for output in blk.inputs.values():
+                for source in source_keys(output):
+                    subscribers.setdefault(source, set()).add(blk.name)
+                    sources.setdefault(blk.name, []).append(source)
+
+        self.subscribers = subscribers
+        self._sources = sources
+        self._destinations = {}
+
+    def _state_changed(self, kind, changes):
+        if self.single_node:
+            # Changes are applied on the event loop already
+            self._apply_change(kind, changes)
+        else:
+            self.loop.call_soon_threadsafe(self._apply_change, kind, changes)
+
+    def _apply_change(self, kind, changes):
+        if kind == 'reset':
+            owners, fitnesses = changes
+            self.fitness = fitness.FitnessMatrix()
+            self._apply_fitness(fitnesses)
+
+            changes = {name: (owner, epoch) for name, (owner, epoch) in owners.items()
+                       if self.epochs.get(name) != epoch}
+            kind = 'owners'
+
+        elif kind == 'fitness':
+            self._apply_fitness(changes)
+
+        if kind == 'owners':
+            for name, (owner, epoch) in changes.items():
+                if owner is None:
+                    self.owners.pop(name, None)
+                else:
+                    self.owners[name] = owner
+                self.epochs[name] = epoch
+
+                if owner == self.config.nodename:
+                    self.owned.add(name)
+                else:
+                    self.owned.discard(name)
+
+                for source in self._sources.get(name, ()):
+                    self._destinations.pop(source, None)
+
+                for waiter in self._epoch_waiters.pop(name, ()):
+                    if not waiter.done():
+                        waiter.set_result(epoch)
+
+            self.owners_version += 1
+
+        elif kind == 'ready':
+            self._ready.set()
+
+        elif kind == 'lost':
+            self.lost = changes
+
+        for listener in self.listeners:
+            try:
+                listener(kind, changes)
+            except:
+                log.exception("While handling %s changes", kind)
+
+        if self._conditions:
+            waiting = []
+            for condition, waiter in self._conditions:
+                if waiter.done():
+                    continue
+                try:
+                    if condition():
+                        waiter.set_result(None)
+                        continue
+                except Exception as e:
+                    waiter.set_exception(e)
+                    continue
+                waiting.append((condition, waiter))
+            self._conditions = waiting
+
+    def _apply_fitness(self, changes):
+        for (description, node), result in changes.items():
+            self.fitness.set(description, node, result)
+
+    def disconnected_nodes(self):
+        """Returns the other nodes that this node isn't connected to for replication right now"""
+        if self.single_node:
+            return set()
+
+        storage = self.shared_data
+        return {self._raft_names[node.id] for node in storage.otherNodes
+                if node.id in self._raft_names and not storage.isNodeConnected(node)}
+
+    async def run_node_monitor(self):
+        """Keeps `lost` up to date, checking which nodes are connected node_timeout / 5 times a
+        second"""
+        if self.single_node:
+            return
+
+        timeout = self.config.cluster.get('node_timeout', 5)
+        while True:
+            await asyncio.sleep(timeout / 5)
+
+            now = time.monotonic()
+            disconnected = self.disconnected_nodes()
+            self._disconnected_since = {name: self._disconnected_since.get(name, now) for name in disconnected}
+
+            lost = frozenset(name for name, since in self._disconnected_since.items() if now - since >= timeout)
+            if lost != self.lost:
+                if lost - self.lost:
+                    log.warning("Lost contact with %s", ", ".join(sorted(lost - self.lost)))
+                if self.lost - lost:
+                    log.info("%s back in contact", ", ".join(sorted(self.lost - lost)))
+                self._apply_change('lost', lost)
+
+    async def wait_ready(self):
+        """Returns once this node has caught up with the cluster state"""
+        if not self.ready():
+            await self._ready.wait()
+
+    async def wait_until(self, condition):
+        """Returns once `condition()` is true, checking it every time the cluster state changes"""
+        if condition():
+            return
+
+        waiter = self.loop.create_future()
+        self._conditions.append((condition, waiter))
+        await waiter
+
+    async def wait_checked_all(self, resources):
+        """Returns once every node has reported its fitness for all of `resources`"""
+        await self.wait_until(lambda: all(self.resource_checked_all(res) for res in resources))
+
+    def has_subscribers(self, source):
+        return source in self.subscribers
+
     async def find_destinations(self, event):
-        return self.config.nodes.keys()
+        """Returns the nodes which own at least one block subscribed to the event's source"""
+        source = event['source']
+        if source not in self._destinations:
+            owners = (self.block_owner(name) for name in self.subscribers.get(source, ()))
+            self._destinations[source] = frozenset(owner for owner in owners if owner is not None)
+
+        return self._destinations[source]
 
     @property
     def block_owners(self):
-        return self.shared_data.block_owners
+        return FrozenDict(self.owners)
 
     def block_owner(self, name):
-        return self.shared_data.find_block_owner(name)
+        return self.owners.get(name)
 
-    def set_block_owner(self, name, owner):
-        self.shared_data.set_block_owner(name, owner)
+    def block_epoch(self, name):
+        """Incremented every time the block's owner is changed"""
+        return self.epochs.get(name, 0)
 
-    def _assign_block(self, name, fitnesses):
-        if not self.ready():
+    async def wait_superseded(self, name, epoch):
+        """Returns once the block has moved on from `epoch`"""
+        if self.block_epoch(name) != epoch:
             return
 
-        # FIXME there is a race condition here
-        if self.block_owner(name):
-            log.debug("Block %s is already assigned to %s", name, self.block_owner(name))
+        waiter = self.loop.create_future()
+        self._epoch_waiters.setdefault(name, []).append(waiter)
+        try:
+            await waiter
+        finally:
+            waiters = self._epoch_waiters.get(name, [])
+            if waiter in waiters:
+                waiters.remove(waiter)
+
+    def _replicate(self, operation, *args, done=None):
+        """Calls a replicated method of the shared data, recording how long it takes to commit.
+        `done` is called from the replication thread with the result once it has been committed,
+        or None if it failed."""
+        if self.commit_latency is None and done is None:
+            self.shared_data.apply(operation, *args)
             return
 
-        eligible = sorted([(fit, node) for node, fit in fitnesses.items() if fit is not False])
+        start = time.monotonic()
+        histogram = self.commit_latency.labels(operation) if self.commit_latency is not None else None
+
+        def committed(result, error):
+            if error == FAIL_REASON.SUCCESS:
+                if histogram is not None:
+                    histogram.observe(time.monotonic() - start)
+            else:
+                log.warning("Could not commit %s: error %s", operation, error)
+                result = None
+
+            if done is not None:
+                done(result)
+
+        self.shared_data.apply(operation, *args, callback=committed)
+
+    def set_block_owners(self, owners, epochs=None, done=None):
+        """Sets the owners of many blocks in one change. Each block is only changed if its epoch is
+        still the one in `epochs`, or the one seen here now, when the change is committed, so that
+        owners chosen from out of date state never overwrite newer ones."""
+        if epochs is None:
+            epochs = {name: self.block_epoch(name) for name in owners}
+
+        def committed(changed):
+            if changed is not None and len(changed) < len(owners):
+                log.debug("Owners of %s changed before they could be set",
+                          ", ".join(sorted(name for name in owners if name not in changed)))
+            if done is not None:
+                done(changed)
+
+        self._replicate('compare_and_set_block_owners', owners, epochs, done=committed)
+
+    def set_block_owner(self, name, owner, epoch=None):
+        self.set_block_owners({name: owner}, None if epoch is None else {name: epoch})
+
+    def is_leader(self):
+        return self.single_node or self.shared_data._isLeader()
+
+    def node_loads(self, exclude=()):
+        """Returns the total load of the blocks owned by each node"""
+        loads = {}
+        for name, blk in self.blocks.items():
+            owner = self.block_owner(name)
+            if owner is not None and name not in exclude:
+                loads[owner] = loads.get(owner, 0) + blk.load
+        return loads
+
+    def _place(self, fitnesses, exclude=()):
+        nodes = self.config.nodes
+        result = placement.place(
+            fitnesses, [name for name in nodes if name not in self.lost],
+            block_loads={name: self.blocks[name].load for name in fitnesses if name in self.blocks},
+            node_loads=self.node_loads(exclude),
+            capacities={name: node.get('capacity') for name, node in nodes.items()},
+            weights={name: node.get('weight', 1) for name, node in nodes.items()},
+            tolerance=self.config.cluster.get('placement_tolerance', 0),
+        )
 
-        if len(eligible):
-            node = eligible[-1][1]
-            self.set_block_owner(name, node)
-            log.info("Assigned %s to %s", name, node)
-        else:
-            raise UnassignableBlock(name)
+        for name in result.no_room:
+            log.warning("Block %s can't be placed: every node it can run on is full", name)
+
+        return result
+
+    def _commit_placement(self, owners, epochs=None):
+        self._placing.update(owners)
+        self.set_block_owners(owners, epochs, done=lambda changed: self._placing.difference_update(owners))
 
     @property
     def resources(self):
-        return self.shared_data.resources
+        return FrozenDict(dict(self.fitness.items()))
 
     def set_resource_fitness(self, resource, fitness):
-        log.debug('Setting fitness for {} on node {}: {}'.format(resource.describe(), self.config.nodename, fitness))
-        self.shared_data.set_resource_fitness(resource.describe(), self.config.nodename, fitness)
+        log.debug('Setting fitness for {} on node {}: {}'.format(resource.description, self.config.nodename, fitness))
+        self._replicate('set_resource_fitness', resource.description, self.config.nodename, fitness)
+
+    def set_resource_fitnesses(self, fitnesses):
+        """Reports the fitness of many resources on this node in one change. `fitnesses` maps
+        resource descriptions to fitness values."""
+        log.debug('Setting fitness for {} resources on node {}'.format(len(fitnesses), self.config.nodename))
+        self._replicate('set_resource_fitnesses', self.config.nodename, fitnesses)
 
     def resource_checked_here(self, resource):
-        return (resource.describe(), self.config.nodename) in self.resources
+        return self.fitness.is_checked(resource.description, self.config.nodename)
 
     def resource_checked_all(self, resource):
+        description = resource.description
+        matrix = self.fitness
+
         for node in self.config.nodes.keys():
-            checked = (resource.describe(), node) in self.resources
-            log.debug("Resource {} checked on node {}: {}".format(resource.describe(), node, checked))
+            checked = matrix.is_checked(description, node)
+            log.debug("Resource {} checked on node {}: {}".format(description, node, checked))
 
             if not checked:
                 return False
@@ -159,80 +519,100 @@ class Cluster:
         return True
 
     def resource_fitnesses(self, resource):
-        resources = self.shared_data.resources
-        return {node: resources.get((resource.describe(), node), 0) for node in self.config.nodes.keys()}
+        description = resource.description
+        return {node: self.fitness.get(description, node) for node in self.config.nodes.keys()}
 
     def resource_targets(self, resource):
-        return {k: v for k, v in self.resource_fitnesses(resource.describe()).items() if v}
+        return {k: v for k, v in self.resource_fitnesses(resource).items() if v}
 
     def block_resource_fitnesses(self, block: block.Block):
-        """Returns a map of nodename to average fitness value for this block.
+        """Returns a map of nodename to the sum of the block's resource fitnesses on that node, each
+        rescaled between the worst and best node, or False where any resource is unavailable.
         Assumes that required resources have been checked on all nodes."""
+        return self.blocks_resource_fitnesses([block])[block.name]
 
-        # Short-circuit! My algorithm is terrible, so it doesn't work well for the edge case where
-        # the block has no requirements
-        if not block.resources:
-            return {n: 1 for n in self.config.nodes.keys()}
+    def blocks_resource_fitnesses(self, blocks):
+        """Returns block_resource_fitnesses for many blocks at once, by block name"""
+        if not self.config.nodes:
+            raise UnassignableBlock(', '.join(blk.name for blk in blocks))
 
-        node_fitnesses = {}
+        scores = self.fitness.scores(
+            [[resource.description for resource in blk.resources] for blk in blocks], self.config.nodes.keys())
+        return {blk.name: score for blk, score in zip(blocks, scores)}
 
-        for resource in block.resources:
-            resource_fitnesses = self.resource_fitnesses(resource)
+    def ready(self):
+        return self.single_node or self.shared_data._isReady()
 
-            if not resource_fitnesses:
-                raise UnassignableBlock(block.name)
+    def unassign_block(self, name, epoch=None):
+        """Leaves the block without an owner, unless it has moved on from `epoch`"""
+        self.set_block_owner(name, None, epoch)
 
-            max_fit = max(resource_fitnesses.values())
-            min_fit = min(resource_fitnesses.values())
+    def reassign_block(self, block: block.Block, epoch=None, avoid=None):
+        """Moves a block to the best node for it now, in one change, unless it has moved on from
+        `epoch`. It isn't put on the node `avoid`, if given, e.g. because its resources have just
+        failed there. Only the leader places blocks, so anywhere else the block is just unassigned,
+        for the leader to place."""
+        if epoch is None:
+            epoch = self.block_epoch(block.name)
 
-            for node, fitness in resource_fitnesses.items():
-                if node not in node_fitnesses:
-                    node_fitnesses[node] = {}
+        if not self.is_leader():
+            self.unassign_block(block.name, epoch)
+            return
 
-                if not fitness:
-                    # Since we're rescaling, 0 is now an OK value...
-                    # We will check for `is False` after this
-                    node_fitnesses[node][resource.describe()] = False
-                else:
-                    if max_fit - min_fit:
-                        node_fitnesses[node][resource.describe()] = (fitness - min_fit) / (max_fit - min_fit)
-                    else:
-                        # All the values are the same, default to 1
-                        node_fitnesses[node][resource.describe()] = 1.0
+        fitnesses = self.block_resource_fitnesses(block)
+        if avoid is not None:
+            fitnesses = dict(fitnesses)
+            fitnesses[avoid] = False
 
-        res = {}
+        result = self._place({block.name: fitnesses}, exclude=(block.name,))
+        if block.name not in result.owners:
+            self.unassign_block(block.name, epoch)
+            # With a node to avoid, it may still be able to go back there later
+            if result.unassignable and avoid is None:
+                raise UnassignableBlock(block.name)
+            return
 
-        for node, res_fits in node_fitnesses.items():
-            fit_sum = 0
-            for res_desc, fit in res_fits.items():
-                if fit is False:
-                    fit_sum = False
-                    break
+        self._commit_placement(result.owners, {block.name: epoch})
+        log.info("Reassigned %s to %s", block.name, result.owners[block.name])
 
-                fit_sum += fit
+    def move_from_lost_nodes(self):
+        """Moves every block owned by a lost node to the best node left for it, in one change. Only
+        the leader moves blocks. Blocks that can't run anywhere else are left where they are, to
+        start again once their node is back."""
+        if not self.lost or not self.ready() or not self.is_leader():
+            return
 
-            if fit_sum is False:
-                # Skip this node entirely
-                res[node] = False
-                continue
+        moving = [blk for name, blk in self.blocks.items()
+                  if self.block_owner(name) in self.lost and name not in self._placing]
+        if not moving:
+            return
 
-            res[node] = fit_sum
+        result = self._place(self.blocks_resource_fitnesses(moving), exclude={blk.name for blk in moving})
 
-        return res
+        if result.owners:
+            self._commit_placement(result.owners)
+            log.info("Moved %d blocks from lost nodes: %s", len(result.owners),
+                     ", ".join("{} to {}".format(name, node) for name, node in sorted(result.owners.items())))
 
-    def ready(self):
-        return self.single_node or self.shared_data._isReady()
+    def assign_blocks(self, blocks):
+        """Places every block that doesn't have an owner yet in one pass, and commits them all in
+        one change. Only the leader places blocks. Returns the blocks that could not be assigned
+        anywhere."""
+        if not self.ready() or not self.is_leader():
+            return []
+
+        blocks = [blk for blk in blocks if not self.block_owner(blk.name) and blk.name not in self._placing]
+        if not blocks:
+            return []
 
-    def unassign_block(self, name):
-        self.set_block_owner(name, None)
+        result = self._place(self.blocks_resource_fitnesses(blocks))
 
-    def reassign_block(self, block: block.Block):
-        self.unassign_block(block.name)
-        self.assign_block(block)
+        if result.owners:
+            self._commit_placement(result.owners)
+            log.info("Assigned %d blocks: %s", len(result.owners),
+                     ", ".join("{} to {}".format(name, node) for name, node in sorted(result.owners.items())))
 
-    def assign_block(self, block: block.Block):
-        log.debug("Assigning block %s", block.name)
-        self._assign_block(block.name, self.block_resource_fitnesses(block))
+        return [blk for blk in blocks if blk.name in result.unassignable]
 
 
 class Node:
@@ -243,22 +623,189 @@ class Node:
 
         self.blocks = {}
 
+        #: Seconds taken by each phase of starting up, in order
+        self.startup = {}
+        self._phase_start = time.monotonic()
+
+        #: (event, coalesce, remote_only) for every event waiting to be dispatched
         self.events_out = asyncio.Queue()
+
+        #: (event, time received) for every event received from another node
         self.events_in = asyncio.Queue()
 
+        #: Events in events_out that may still be replaced by a newer value, by source
+        self._coalescable = {}
+
+        #: Number of events replaced by a newer value before being dispatched
+        self.coalesced = 0
+
+        #: Outgoing connections to other nodes, by node name
+        self.peers = {}
+
+        #: Maps each event source to a list of (block name, handler, description) for every
+        #: locally owned block subscribed to it
+        self.routes = {}
+        self._routed = set()
+
+        #: Set whenever the cluster state changes, to wake up the block supervisor
+        self._supervise = asyncio.Event()
+
+        #: The task running each block on this node, by name
+        self._block_tasks = {}
+        self._resources_started = set()
+
+        #: Blocks that stopped by themselves are only started again after restart_delay seconds,
+        #: doubling every time they stop again soon after, up to max_restart_delay
+        self.restart_delay = self.config.cluster.get('restart_delay', 1)
+        self.max_restart_delay = self.config.cluster.get('max_restart_delay', 60)
+
+        #: (times stopped in a row, when it may be started again) for such blocks, by name
+        self._restarts = {}
+
+        #: Blocks found to have nowhere to run by the supervisor
+        self._unassignable = set()
+
         self._was_ready = False
 
+        #: Runs and checks every resource needed by the blocks on this node
+        self.scheduler = resource.Scheduler()
+        self.scheduler.configure(**self.config.get('health', {}))
+
+        profiling.PROFILER.configure(**self.config.get('profiling', {}))
+        self.watchdog = watchdog.Watchdog(**self.config.get('watchdog', {}))
+
+        self.metrics = metrics.Registry()
+        self.events_emitted = self.metrics.counter(
+            'idiotic_events_emitted_total', 'Events sent by blocks on this node', ['source'])
+        self.events_received = self.metrics.counter(
+            'idiotic_events_received_total', 'Events delivered to blocks on this node', ['source'])
+        self.delivery_latency = self.metrics.histogram(
+            'idiotic_event_delivery_seconds',
+            'Time from an event being sent on this node, or received from another, until it was handled',
+            ['origin'])
+        self._local_latency = self.delivery_latency.labels('local')
+        self._remote_latency = self.delivery_latency.labels('remote')
+        self.handler_duration = self.metrics.histogram(
+            'idiotic_handler_duration_seconds', 'Time taken by blocks to handle an input', ['block'])
+        self.metrics.gauge(
+            'idiotic_queue_depth', 'Events waiting in the node\'s queues',
+            lambda: {('events_in',): self.events_in.qsize(), ('events_out',): self.events_out.qsize()}, ['queue'])
+        self.metrics.gauge(
+            'idiotic_mailbox_depth', 'Inputs waiting to be handled by each block',
+            lambda: {(name,): blk.mailbox.depth for name, blk in self.blocks.items()}, ['block'])
+        self.rpc_latency = self.metrics.histogram(
+            'idiotic_rpc_send_seconds', 'Time taken to send a batch of events to another node', ['peer'])
+        self.rpc_failures = self.metrics.counter(
+            'idiotic_rpc_failures_total', 'Failed attempts to send events to another node', ['peer'])
+        self.metrics.gauge(
+            'idiotic_cluster_ready', 'Whether the cluster state is ready', lambda: int(self.cluster.ready()))
+        self.metrics.gauge(
+            'idiotic_owned_blocks', 'Blocks owned by this node',
+            lambda: sum(1 for name in self.blocks if self.own_block(name)))
+        self.cluster.commit_latency = self.metrics.histogram(
+            'idiotic_raft_commit_seconds', 'Time taken for the cluster to commit a change to its shared state',
+            ['operation'])
+        self.watchdog.lag = self.metrics.histogram(
+            'idiotic_event_loop_lag_seconds', 'How late the event loop was to run a scheduled callback')
+        self.metrics.gauge(
+            'idiotic_event_loop_stalls', 'Recent times the event loop was blocked, up to the history size',
+            lambda: len(self.watchdog.stalls))
+
+        self.cluster.listeners.append(self._cluster_changed)
+
+        # Changes in fitness found by the health checks, waiting to be published together
+        self._fitness_changes = {}
+        self._fitness_publish = None
+        self.scheduler.listeners.append(self._fitness_changed)
+
     def own_block(self, name):
-        return self.cluster.block_owner(name) == self.name
+        return name in self.cluster.owned
+
+    def phase(self, name, since=None):
+        """Records that a phase of starting up has finished, which started at `since`, or when
+        the last one finished"""
+        now = time.monotonic()
+        self.startup[name] = now - (self._phase_start if since is None else since)
+        self._phase_start = now
+        log.info("Startup: %s took %.3fs", name, self.startup[name])
+
+    def _fitness_changed(self, description, fitness):
+        self._fitness_changes[description] = fitness
+        if self._fitness_publish is None:
+            # Give the other checks running at the same time a moment to finish, and publish them
+            # all in one change
+            self._fitness_publish = asyncio.get_event_loop().call_later(.5, self._publish_fitnesses)
+
+    def _publish_fitnesses(self):
+        changes, self._fitness_changes = self._fitness_changes, {}
+        self._fitness_publish = None
+        log.info("Fitness changed for %s", ", ".join(sorted(changes)))
+        self.cluster.set_resource_fitnesses(changes)
+
+    def _cluster_changed(self, kind, changes):
+        if kind == 'owners':
+            for name in changes:
+                if name not in self.blocks:
+                    continue
+
+                if self.own_block(name) and name not in self._routed:
+                    self.route_block(name)
+                elif not self.own_block(name) and name in self._routed:
+                    self.unroute_block(name)
+
+        self._supervise.set()
+
+    def _block_routes(self, blk):
+        for target, output in blk.inputs.items():
+            if target is None:
+                handler = blk
+                destname = blk.name
+            else:
+                try:
+                    handler = getattr(blk, target)
+                except Exception:
+                    log.exception("Block %s has no input %s", blk.name, target)
+                    continue
+                destname = "{}.{}".format(blk.name, target)
+
+            for source in source_keys(output):
+                yield source, (blk.name, handler, destname)
+
+    def route_block(self, name):
+        for source, route in self._block_routes(self.blocks[name]):
+            # Replace rather than append, so that a delivery in progress isn't affected
+            self.routes[source] = self.routes.get(source, []) + [route]
+        self._routed.add(name)
+
+    def unroute_block(self, name):
+        for source, _ in self._block_routes(self.blocks[name]):
+            routes = [r for r in self.routes.get(source, ()) if r[0] != name]
+            if routes:
+                self.routes[source] = routes
+            else:
+                self.routes.pop(source, None)
+        self._routed.discard(name)
+
+    def update_routes(self):
+        """Brings the routing index up to date with block ownership. After this, it is kept up to
+        date as owners change."""
+        owned = {name for name in self.blocks if self.own_block(name)}
+
+        for name in self._routed - owned:
+            self.unroute_block(name)
+
+        for name in owned - self._routed:
+            self.route_block(name)
 
     async def initialize_blocks(self):
         log.debug("Initializing blocks...")
         try:
             for name, settings in self.config.blocks.items():
                 blk = block.create(name, settings)
+                blk.mailbox.duration = self.handler_duration.labels(name)
+                blk.resources = [self.scheduler.intern(res) for res in blk.resources]
                 self.blocks[name] = blk
-
-            blk_inits = []
+            self.phase('create blocks')
 
             for name, blk in self.blocks.items():
                 # Check that all input blocks exist
@@ -288,122 +835,389 @@ class Node:
 
                 log.debug("Block %s mostly initialized", name)
 
-                async def wait_for_resource(node, res):
-                    log.debug("Waiting for resource %s...", res.describe())
-
-                    if not node.cluster.resource_checked_here(res):
-                        log.debug("Checking resource %s", res.describe())
-                        try:
-                            fitness = await res.fitness()
-                        except:
-                            log.exception("Checking resource %s failed with exception", res.describe())
-                            fitness = 0
-                        node.cluster.set_resource_fitness(res, fitness)
-
-                        log.debug("Resource %s checked with fitness=%s", res.describe(), fitness)
-
-                    while not node.cluster.resource_checked_all(res):
-                        log.debug("Waiting for resource " + res.describe())
-                        await asyncio.sleep(5)
+            self.cluster.set_blocks(self.blocks)
+
+            # Check every resource that hasn't been checked here yet, and report them all at once
+            unchecked = {}
+            for blk in self.blocks.values():
+                for res in blk.resources:
+                    if not self.cluster.resource_checked_here(res):
+                        unchecked.setdefault(res.description, res)
+
+            async def check_resource(res):
+                log.debug("Checking resource %s", res.description)
+                fitness = await self.scheduler.measure(res)
+                log.debug("Resource %s checked with fitness=%s", res.description, fitness)
+                return fitness
+
+            if unchecked:
+                fitnesses = dict(zip(unchecked, await asyncio.gather(*(check_resource(res) for res in unchecked.values()))))
+                self.scheduler.published.update(fitnesses)
+                self.cluster.set_resource_fitnesses(fitnesses)
+            self.phase('check resources')
+
+            # Owners applied before the blocks existed were ignored by _cluster_changed, so route
+            # those first, whether or not anything else can be assigned
+            self.update_routes()
+
+            # Blocks whose resources haven't been checked everywhere yet are assigned by the
+            # supervisor once they have
+            try:
+                self.assign_ready_blocks()
+            except UnassignableBlock as e:
+                log.error("Block %s can't run on any node", e)
+                self._unassignable.add(str(e))
+            self.phase('assign blocks')
+        except:
+            log.exception("While initializing blocks...")
 
-                async def blk_init(node, blk_):
-                    res_inits = []
-                    for resource in blk_.resources:
-                        res_inits.append(wait_for_resource(node, resource))
+    def assign_ready_blocks(self):
+        """Assigns every block without an owner whose resources have been checked on every node"""
+        ready = [blk for name, blk in self.blocks.items() if self.cluster.block_owner(name) is None and
+                 all(self.cluster.resource_checked_all(res) for res in blk.resources)]
+        if ready:
+            self.assign_blocks(ready)
+
+    def blocks_started(self):
+        """Whether every block that must run has an owner, and every block owned here is running.
+        Optional blocks that no node can run don't count."""
+        for name, blk in self.blocks.items():
+            if name in self.cluster.owned:
+                task = self._block_tasks.get(name)
+                if task is None or task.done():
+                    return False
+            elif self.cluster.block_owner(name) is None and not blk.optional:
+                return False
+        return True
 
-                    await asyncio.gather(*res_inits)
-                    node.cluster.assign_block(blk_)
+    def assign_blocks(self, blocks):
+        for blk in self.cluster.assign_blocks(blocks):
+            if blk.optional:
+                log.warning("Block left unassigned: %s", blk.name)
+            else:
+                raise UnassignableBlock(blk.name)
+
+    def dispatch(self, event, coalesce=False, remote_only=False):
+        """Queues an event to be sent to its subscribers. If `coalesce` is set and an event from
+        the same source is still waiting, only its value is updated. With `remote_only`, the event
+        has already been delivered on this node and is only sent to others."""
+        if coalesce:
+            queued = self._coalescable.get(event['source'])
+            if queued is not None:
+                queued['data'] = event['data']
+                self.coalesced += 1
+                return
+
+            self._coalescable[event['source']] = event
+
+        self.events_out.put_nowait((event, coalesce, remote_only))
+
+    async def output(self, event, coalesce=False):
+        """Sends an event from a block on this node. Subscribers on this node get it directly,
+        and it is only queued if some other node needs it too."""
+        sent = time.monotonic()
+        self.events_emitted.labels(event['source']).inc()
+
+        destinations = await self.cluster.find_destinations(event)
+        local = self.name in destinations
+
+        if len(destinations) > local:
+            self.dispatch(event, coalesce, remote_only=local)
+
+        if local:
+            await self.deliver_local(event, sent, self._local_latency)
+
+    async def deliver_local(self, event, sent, latency):
+        routes = self.routes.get(event['source'])
+        if not routes:
+            return
 
-                blk_inits.append(blk_init(self, blk))
-            await asyncio.gather(*blk_inits)
-        except:
-            log.exception("While initializing blocks...")
+        self.events_received.labels(event['source']).inc()
 
-    def dispatch(self, event):
-        self.events_out.put_nowait(event)
+        for name, handler, destname in routes:
+            await self.blocks[name].mailbox.deliver(destname, handler, event['data'], sent, latency)
 
-    async def event_received(self, event):
-        dests = []
-        destnames = []
-        for block in self.blocks.values():
-            if not self.own_block(block.name):
-                continue
+    async def event_received(self, event, received=None):
+        routes = self.routes.get(event['source'], ())
 
-            if not block.inputs:
-                continue
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(" * %s(%s)", event['source'], event['data'])
+            for _, _, destname in routes:
+                log.debug(" |--> %s", destname)
 
-            for target, output in block.inputs.items():
-                if event['source'] == output or event['source'] == "{0}.{0}".format(output):
-                    if target is None:
-                        dests.append(block)
-                        destnames.append(block.name)
-                    else:
-                        dests.append(getattr(block, target))
-                        destnames.append("{}.{}".format(block.name, target))
+        if routes:
+            self.events_received.labels(event['source']).inc()
 
-        log.debug(" * %s(%s)", event['source'], event['data'])
-        for dest in destnames:
-            log.debug(" |--> %s", dest)
+        if received is None:
+            received = time.monotonic()
 
-        for dest in dests:
-            await dest(event['data'])
+        # Never wait here for a full mailbox, which would hold up every other block's inputs too
+        for name, handler, destname in routes:
+            self.blocks[name].mailbox.put_nowait(destname, handler, event['data'], received, self._remote_latency)
 
     async def run(self):
         await asyncio.gather(
             self.run_dispatch(),
             self.run_rpc(),
+            self.run_stream(),
             self.run_messaging(),
+            self.run_mailboxes(),
             self.run_blocks(),
+            self.run_startup(),
+            self.cluster.run_node_monitor(),
+            self.scheduler.run(),
+            self.watchdog.run(),
         )
 
+    async def run_startup(self):
+        """Times how long it takes for every node to report its resources"""
+        await self.cluster.wait_checked_all({res for blk in self.blocks.values() for res in blk.resources})
+        self.phase('fitness reported')
+
+    async def run_mailboxes(self):
+        await asyncio.gather(*(blk.mailbox.run() for blk in self.blocks.values()))
+
+    def _block_stopped(self, name, started, task):
+        """Called when a block's task has finished, to hold off starting it again if it stopped by
+        itself rather than being moved"""
+        if task.cancelled():
+            return
+
+        if task.exception() is not None:
+            log.error("Block %s stopped", name, exc_info=task.exception())
+        elif not task.result():
+            self._supervise.set()
+            return
+
+        now = time.monotonic()
+        failures, _ = self._restarts.get(name, (0, 0))
+        if now - started >= self.max_restart_delay:
+            # It ran for a good while, so this isn't the same failure over and over
+            failures = 0
+
+        delay = min(self.max_restart_delay, self.restart_delay * 2 ** failures)
+        self._restarts[name] = (failures + 1, now + delay)
+        log.info("Block %s stopped, not starting it here again for %.1fs", name, delay)
+
+        asyncio.get_event_loop().call_later(delay, self._supervise.set)
+        self._supervise.set()
+
     async def run_blocks(self):
+        """Starts blocks as they are assigned to this node, and if this node is the leader, assigns
+        blocks without an owner and moves blocks off lost nodes. This happens whenever the cluster
+        state changes or a block stops, and at least every supervise_interval seconds. Blocks moved
+        away stop by themselves once their epoch is superseded, and blocks that stop by themselves
+        are restarted with backoff."""
+        interval = self.config.cluster.get('supervise_interval', 5)
+
         while True:
-            tasks = []
-            for name, blk in self.blocks.items():
-                if self.cluster.block_owner(name) is None:
-                    try:
-                        self.cluster.assign_block(blk)
-                    except UnassignableBlock as e:
-                        if blk.optional:
-                            log.warning("Block left unassigned: %s", name)
-                        else:
-                            raise
+            self._supervise.clear()
+            self.cluster.move_from_lost_nodes()
+            try:
+                self.assign_ready_blocks()
+            except UnassignableBlock as e:
+                # It stays unassigned until some node can run it, without stopping every other block
+                if str(e) not in self._unassignable:
+                    log.error("Block %s can't run on any node", e)
+                    self._unassignable.add(str(e))
+
+            for name in self.cluster.owned:
+                blk = self.blocks.get(name)
+                if blk is None:
+                    continue
+
+                if name not in self._resources_started:
+                    self._resources_started.add(name)
+                    asyncio.ensure_future(blk.run_resources(self.scheduler))
+
+                task = self._block_tasks.get(name)
+                if task is None or task.done():
+                    _, not_before = self._restarts.get(name, (0, 0))
+                    if time.monotonic() < not_before:
+                        continue
 
-                if self.own_block(name) and not blk.running:
-                    tasks.append(blk.run_resources)
-                    tasks.append(functools.partial(blk.run_while_ok, self.cluster))
+                    task = self._block_tasks[name] = asyncio.ensure_future(blk.run_while_ok(self.cluster))
+                    task.add_done_callback(functools.partial(self._block_stopped, name, time.monotonic()))
 
-            await asyncio.gather(*(asyncio.ensure_future(task()) for task in tasks))
+            if 'blocks started' not in self.startup and self.blocks_started():
+                self.phase('blocks started')
+                log.info("Started up in %.3fs", sum(self.startup.values()))
+
+            try:
+                await asyncio.wait_for(self._supervise.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
 
     async def run_messaging(self):
         while True:
             try:
-                event = await self.events_in.get()
-                await self.event_received(event)
+                event, received = await self.events_in.get()
+                await self.event_received(event, received)
+            except asyncio.CancelledError:
+                raise
             except:
                 log.exception("While running messaging")
 
+    def peer(self, name):
+        if name not in self.peers:
+            cluster_config = self.config.cluster
+            options = dict(
+                batch_size=cluster_config.get('batch_size', 100),
+                batch_delay=cluster_config.get('batch_delay', .005),
+                binary=cluster_config.get('wire', 'json') == 'binary',
+                max_pending=cluster_config.get('max_pending', 10000),
+                drop_policy=cluster_config.get('drop_policy', peer.Peer.DROP_OLDEST),
+                ttl=cluster_config.get('event_ttl', 60),
+                max_backoff=cluster_config.get('max_backoff', 30),
+                breaker_threshold=cluster_config.get('breaker_threshold', 5),
+                breaker_timeout=cluster_config.get('breaker_timeout', 30),
+            )
+
+            if self.config.transport == 'stream':
+                host, port = self.config.get_stream_address(name)
+                self.peers[name] = peer.StreamPeer(name, host, port, self.name,
+                                                   ack_timeout=cluster_config.get('ack_timeout', 10), **options)
+            else:
+                self.peers[name] = peer.Peer(name, self.config.get_rpc_url(name, 'rpc/batch'),
+                                             fallback_url=self.config.get_rpc_url(name, 'rpc'), **options)
+
+            self.peers[name].send_latency = self.rpc_latency.labels(name)
+            self.peers[name].send_failures = self.rpc_failures.labels(name)
+
+            asyncio.ensure_future(self.peers[name].run())
+
+        return self.peers[name]
+
     async def run_dispatch(self):
         while True:
-            event = await self.events_out.get()
+            event, coalesce, remote_only = await self.events_out.get()
+
+            if coalesce and self._coalescable.get(event['source']) is event:
+                del self._coalescable[event['source']]
 
             for dest in await self.cluster.find_destinations(event):
                 if dest == self.name:
-                    self.events_in.put_nowait(event)
+                    if not remote_only:
+                        self.events_in.put_nowait((event, time.monotonic()))
                 else:
-                    url = self.config.get_rpc_url(dest)
-                    # Screw you aiohttp, I do what I want!
-                    try:
-                        async with aiohttp.ClientSession() as client:
-                            async with client.post(url, data=json.dumps(event), headers={'Content-Type': 'application/json'}) as request:
-                                log.debug(await request.json())
-                    except:
-                        log.exception("Exception occurred in run_dispatch()")
-                        self.events_out.put_nowait(event)
+                    self.peer(dest).send(event, coalesce)
+
+    @staticmethod
+    async def read_json(request: aiohttp.web.Request):
+        """Returns the body parsed as JSON, whatever its content type, since senders such as curl
+        don't always give one, or raises a 415 error if it isn't JSON"""
+        try:
+            return await request.json()
+        except ValueError:
+            raise web.HTTPUnsupportedMediaType(
+                text="Expected JSON or {}, not {}".format(wire.CONTENT_TYPE, request.content_type),
+                headers={wire.HEADER: wire.VERSION})
 
     async def rpc_endpoint(self, request: aiohttp.web.Request):
-        self.events_in.put_nowait(await request.json())
-        return web.Response(text='{"Success": true}', content_type='application/json')
+        if request.content_type == wire.CONTENT_TYPE:
+            return await self.rpc_batch_endpoint(request)
+
+        self.events_in.put_nowait((await self.read_json(request), time.monotonic()))
+        return web.Response(text='{"Success": true}', content_type='application/json', headers={wire.HEADER: wire.VERSION})
+
+    async def rpc_batch_endpoint(self, request: aiohttp.web.Request):
+        if request.content_type == wire.CONTENT_TYPE:
+            # Binary senders don't read the reply, so don't bother with one
+            received = time.monotonic()
+            for event in wire.Decoder().decode(await request.read()):
+                self.events_in.put_nowait((event, received))
+            return web.Response(status=204, headers={wire.HEADER: wire.VERSION})
+
+        events = await self.read_json(request)
+        received = time.monotonic()
+        for event in events:
+            self.events_in.put_nowait((event, received))
+        return web.Response(text=json.dumps({"Success": True, "Received": len(events)}), content_type='application/json',
+                            headers={wire.HEADER: wire.VERSION})
+
+    async def stream_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        decoder = wire.Decoder()
+        received = 0
+        peer_name = writer.get_extra_info('peername')
+
+        try:
+            while True:
+                payload = await wire.read_frame(reader)
+                kind = payload[0]
+
+                if kind == wire.SYNC:
+                    writer.write(wire.ack(received))
+                    await writer.drain()
+                elif kind == wire.HELLO:
+                    peer_name = payload[1:].decode('utf-8')
+                    log.info("Stream connection from %s", peer_name)
+                else:
+                    event = decoder.decode_frame(payload)
+                    if event is not None:
+                        self.events_in.put_nowait((event, time.monotonic()))
+                        received += 1
+        except asyncio.IncompleteReadError:
+            log.info("Stream connection from %s closed", peer_name)
+        except Exception:
+            log.exception("Error on stream connection from %s", peer_name)
+        finally:
+            writer.close()
+
+    async def run_stream(self):
+        if self.config.transport != 'stream':
+            return
+
+        _, port = self.config.get_stream_address(self.name)
+        await asyncio.start_server(self.stream_connection, self.config.cluster['listen'], port)
+
+    async def metrics_endpoint(self, request: aiohttp.web.Request):
+        return web.Response(text=self.metrics.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def debug_profile(self, request: aiohttp.web.Request):
+        """Shows the blocks and resources using the most time. POST to change profiling settings,
+        e.g. ``/debug/profile?enabled=0`` or ``?sample=0.1&slow_threshold=0.05``, or to ``?reset=1``."""
+        if request.method == 'POST':
+            settings = {k: request.query[k] for k in ('sample', 'slow_threshold', 'slow_log_size') if k in request.query}
+            if 'enabled' in request.query:
+                settings['enabled'] = request.query['enabled'].lower() in ('1', 'true', 'yes', 'on')
+            profiling.PROFILER.configure(**settings)
+
+            if request.query.get('reset'):
+                profiling.PROFILER.reset()
+
+        profiler = profiling.PROFILER
+        return web.json_response({
+            "enabled": profiler.enabled,
+            "sample": profiler.sample,
+            "slow_threshold": profiler.slow_threshold,
+            "top": profiler.top(int(request.query.get('top', 10)), request.query.get('sort', 'busy')),
+            "slow_calls": list(profiler.slow_calls),
+        })
+
+    async def debug_blocks(self, request: aiohttp.web.Request):
+        """Shows the owner of every block, and whether the blocks on this node are running"""
+        return web.json_response({
+            "node": self.name,
+            "ready": self.cluster.ready(),
+            "owners_version": self.cluster.owners_version,
+            "startup": self.startup,
+            "blocks": {
+                name: {
+                    "owner": self.cluster.block_owner(name),
+                    "epoch": self.cluster.block_epoch(name),
+                    "running": self.own_block(name) and blk.running,
+                } for name, blk in self.blocks.items()
+            },
+        })
+
+    async def debug_stalls(self, request: aiohttp.web.Request):
+        """Shows the recent times the event loop was blocked, and what was blocking it"""
+        return web.json_response({
+            "threshold": self.watchdog.threshold,
+            "max_lag": self.watchdog.max_lag,
+            "stalls": list(reversed(self.watchdog.stalls)),
+        })
 
     async def cluster_status(self, request: aiohttp.web.Request):
         res = """
@@ -413,11 +1227,13 @@ class Node:
         <body>
         <h1>Allocated Blocks</h1>
         <table>
-        <thead><tr><th>Block</th><th>Owner</th><th>Resources</th></tr></thead>
+        <thead><tr><th>Block</th><th>Owner</th><th>Resources</th><th>Queued</th><th>Dropped</th></tr></thead>
         <tbody>"""
 
         for blk, owner in sorted(self.cluster.block_owners.items()):
-            res += "<tr><td>{}</td><td>{}</td><td>{}</td></tr>".format(blk, owner, len(self.blocks[blk].resources))
+            mailbox = self.blocks[blk].mailbox
+            res += "<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>".format(
+                blk, owner, len(self.blocks[blk].resources), mailbox.depth, mailbox.dropped + mailbox.replaced)
         res += "</tbody></table>"
 
         res += "<h1>Unallocated Blocks</h1>"
@@ -427,6 +1243,16 @@ class Node:
         for blk in sorted(unallocated):
             res += "<li>{}</li>".format(blk)
         res += "</ul>"
+
+        res += "<h1>Peers</h1>"
+        res += "<table>"
+        res += "<thead><tr><th>Node</th><th>State</th><th>Pending</th><th>Sent</th><th>Dropped</th><th>Expired</th><th>Coalesced</th><th>Failures</th></tr></thead>"
+        res += "<tbody>"
+        for name, node in sorted(self.peers.items()):
+            res += "<tr><td>{}</td><td>{state}</td><td>{pending}</td><td>{sent}</td><td>{dropped}</td><td>{expired}</td><td>{coalesced}</td><td>{failures}</td></tr>".format(
+                name, **node.stats)
+        res += "</tbody></table>"
+        res += "<p>Coalesced before dispatch: {}</p>".format(self.coalesced)
         res += "</body></html>"
 
         return web.Response(text=res, content_type='text/html')
@@ -434,6 +1260,12 @@ class Node:
     async def run_rpc(self):
         app = web.Application()
         app.router.add_route('POST', '/rpc', self.rpc_endpoint, name='rpc')
+        app.router.add_route('POST', '/rpc/batch', self.rpc_batch_endpoint, name='rpc_batch')
         app.router.add_route('GET', '/status', self.cluster_status, name='status')
+        app.router.add_route('GET', '/metrics', self.metrics_endpoint, name='metrics')
+        app.router.add_route('GET', '/debug/profile', self.debug_profile, name='debug_profile')
+        app.router.add_route('POST', '/debug/profile', self.debug_profile)
+        app.router.add_route('GET', '/debug/stalls', self.debug_stalls, name='debug_stalls')
+        app.router.add_route('GET', '/debug/blocks', self.debug_blocks, name='debug_blocks')
         handler = app.make_handler()
-        await asyncio.get_event_loop().create_server(handler, self.config.cluster['listen'], self.config.cluster['rpc_port'])
+        await asyncio.get_event_loop().create_server(handler, self.config.cluster['listen'], self.config.get_rpc_port(self.name))
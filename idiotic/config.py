@@ -16,17 +16,32 @@ class Config(dict):
         super(Config, self).__init__(*args, **kwargs)
         self.__dict__ = self
 
-    def get_rpc_url(self, node):
-        return "http://{}:{}/rpc".format(self.nodes.get(node, {}).get('host', node), self.nodes.get(node, {}).get('rpc_port', self.cluster["rpc_port"]))
+    def get_rpc_port(self, node):
+        return self.nodes.get(node, {}).get('rpc_port', self.cluster["rpc_port"])
+
+    def get_rpc_url(self, node, endpoint='rpc'):
+        return "http://{}:{}/{}".format(self.nodes.get(node, {}).get('host', node), self.get_rpc_port(node), endpoint)
+
+    def get_stream_address(self, node):
+        settings = self.nodes.get(node, {})
+        return settings.get('host', node), settings.get('stream_port', self.cluster.get('stream_port', self.get_rpc_port(node) + 1))
+
+    @property
+    def transport(self):
+        return self.cluster.get('transport', 'http')
+
+    def cluster_address(self, node):
+        """Returns the (host, port) that the node replicates the cluster state on"""
+        default = dict(self.cluster)
+        default.update(self.nodes.get(node, {}))
+        return default.get('host', node), default['port']
 
     def connect_hosts(self):
-        for name, node in self.nodes.items():
+        for name in self.nodes:
             if name == self.nodename:
                 continue
 
-            default = dict(self.cluster)
-            default.update(node)
-            yield (default.get('host', name), default['port'])
+            yield self.cluster_address(name)
 
     @property
     def nodename(self):
@@ -55,10 +70,10 @@ class Config(dict):
                 try:
                     import jinja2
                     jstream = jinja2.Template(f.read()).render(zip=zip)
-                    return cls(**yaml.load(jstream))
+                    return cls(**yaml.safe_load(jstream))
                 except ImportError:
                     log.info("jinja2 not found, not templating config file")
-                    return cls(**yaml.load(f))
+                    return cls(**yaml.safe_load(f))
         except (IOError, OSError):
             log.exception("Exception while opening config file %s", path)
             raise
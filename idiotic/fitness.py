@@ -0,0 +1,133 @@
+"""Resource fitness on every node, kept as a dense resource-by-node matrix.
+
+Resources and nodes are given a row and a column the first time a fitness is set for them, and
+the matrix is updated in place from then on. Scoring blocks only takes a few array operations over
+the rows of their resources, and many blocks can be scored at once.
+"""
+import numpy
+
+
+class FitnessMatrix:
+    def __init__(self, resources=16, nodes=4):
+        #: Maps resource descriptions to rows
+        self.resource_ids = {}
+
+        #: Maps node names to columns
+        self.node_ids = {}
+
+        self.values = numpy.zeros((resources, nodes))
+        self.checked = numpy.zeros((resources, nodes), dtype=bool)
+
+        #: Incremented every time a fitness is set
+        self.version = 0
+
+        self._cache_key = None
+        self._cache = None
+
+    def _grow(self, axis):
+        shape = list(self.values.shape)
+        shape[axis] *= 2
+
+        values = numpy.zeros(shape)
+        checked = numpy.zeros(shape, dtype=bool)
+        rows, cols = self.values.shape
+        values[:rows, :cols] = self.values
+        checked[:rows, :cols] = self.checked
+
+        self.values, self.checked = values, checked
+
+    def _intern(self, ids, key, axis):
+        index = ids.get(key)
+        if index is None:
+            index = len(ids)
+            if index >= self.values.shape[axis]:
+                self._grow(axis)
+            ids[key] = index
+        return index
+
+    def set(self, resource, node, fitness):
+        row = self._intern(self.resource_ids, resource, 0)
+        col = self._intern(self.node_ids, node, 1)
+
+        self.values[row, col] = fitness or 0
+        self.checked[row, col] = True
+        self.version += 1
+
+    def get(self, resource, node):
+        row = self.resource_ids.get(resource)
+        col = self.node_ids.get(node)
+        if row is None or col is None:
+            return 0
+        return float(self.values[row, col])
+
+    def items(self):
+        """Yields ((resource, node), fitness) for every fitness that has been set"""
+        for resource, row in self.resource_ids.items():
+            for node, col in self.node_ids.items():
+                if self.checked[row, col]:
+                    yield (resource, node), float(self.values[row, col])
+
+    def is_checked(self, resource, node):
+        row = self.resource_ids.get(resource)
+        col = self.node_ids.get(node)
+        return row is not None and col is not None and bool(self.checked[row, col])
+
+    def _rescaled(self, nodes):
+        """Returns each resource's fitness on each of `nodes`, rescaled between the worst and the
+        best of them, and whether it is available at all"""
+        key = (self.version, nodes)
+        if self._cache_key == key:
+            return self._cache
+
+        cols = numpy.array([self.node_ids.get(node, -1) for node in nodes], dtype=int)
+        known = cols >= 0
+
+        count = len(self.resource_ids)
+        fits = numpy.zeros((count, len(cols)))
+        fits[:, known] = self.values[:count, cols[known]]
+
+        low = fits.min(axis=1, keepdims=True)
+        span = fits.max(axis=1, keepdims=True) - low
+        # Where every node has the same fitness, they all get 1
+        rescaled = numpy.where(span != 0, (fits - low) / numpy.where(span != 0, span, 1), 1.0)
+
+        self._cache_key = key
+        self._cache = rescaled, fits == 0
+        return self._cache
+
+    def scores(self, resource_lists, nodes):
+        """Returns, for each list of resources that a block needs, a map of each of `nodes` to how
+        well it can run the block: the sum of each resource's rescaled fitness, or False if any of
+        the resources is unavailable on it."""
+        nodes = tuple(nodes)
+        rescaled, unavailable = self._rescaled(nodes)
+
+        res = [None] * len(resource_lists)
+        rows = []
+        starts = []
+        scored = []
+
+        for i, resources in enumerate(resource_lists):
+            if not resources:
+                # Any node will do
+                res[i] = {node: 1 for node in nodes}
+                continue
+
+            block_rows = [self.resource_ids.get(resource) for resource in set(resources)]
+            if any(row is None or row >= len(rescaled) for row in block_rows):
+                # Nobody has a fitness for one of them
+                res[i] = {node: False for node in nodes}
+                continue
+
+            starts.append(len(rows))
+            rows.extend(block_rows)
+            scored.append(i)
+
+        if rows:
+            totals = numpy.add.reduceat(rescaled[rows], starts, axis=0).tolist()
+            usable = (~numpy.logical_or.reduceat(unavailable[rows], starts, axis=0)).tolist()
+
+            for i, block_totals, block_usable in zip(scored, totals, usable):
+                res[i] = {node: total if ok else False for node, total, ok in zip(nodes, block_totals, block_usable)}
+
+        return res
@@ -0,0 +1,175 @@
+"""Counters and histograms exposed in the Prometheus text format.
+
+Recording a value is meant to be cheap enough to leave on all the time: a labelled child is
+looked up once and kept, counters are plain integers, and histograms have fixed buckets. All of
+the formatting work happens when the metrics are scraped.
+"""
+import bisect
+
+DEFAULT_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(k, _escape(v)) for k, v in zip(names, values)]
+    if extra:
+        pairs.append('{}="{}"'.format(*extra))
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    TYPE = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children = {}
+
+        if not self.label_names:
+            self._default = self._new_child()
+            self._children[()] = self._default
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def labels(self, *values):
+        """Returns the child for these label values, creating it the first time. Callers on a hot
+        path should keep the child rather than calling this for every event."""
+        try:
+            return self._children[values]
+        except KeyError:
+            child = self._children[values] = self._new_child()
+            return child
+
+    def remove(self, *values):
+        self._children.pop(values, None)
+
+    def samples(self):
+        raise NotImplementedError()
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} {}".format(self.name, self.TYPE),
+        ]
+
+        for name, labels, value in self.samples():
+            lines.append("{}{} {}".format(name, labels, _format_number(value)))
+
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.value += amount
+
+    def samples(self):
+        for values, child in sorted(self._children.items()):
+            yield self.name, _format_labels(self.label_names, values), child.value
+
+
+class Gauge(Metric):
+    """A value that is computed when the metrics are scraped, so it costs nothing until then"""
+    TYPE = 'gauge'
+
+    def __init__(self, name, help, function, labels=()):
+        #: Returns the value, or with labels, a map of label value tuples to values
+        self.function = function
+        super().__init__(name, help, labels)
+
+    def _new_child(self):
+        return None
+
+    def samples(self):
+        if self.label_names:
+            for values, value in sorted(self.function().items()):
+                yield self.name, _format_labels(self.label_names, values), value
+        else:
+            yield self.name, '', self.function()
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def samples(self):
+        for values, child in sorted(self._children.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                total += count
+                yield self.name + '_bucket', _format_labels(self.label_names, values, ('le', _format_number(bound))), total
+
+            labels = _format_labels(self.label_names, values)
+            yield self.name + '_sum', labels, child.sum
+            yield self.name + '_count', labels, total
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,425 @@
+import asyncio
+import collections
+import json
+import logging
+import random
+import time
+
+import aiohttp
+
+from idiotic import wire
+
+log = logging.getLogger(__name__)
+
+
+class Peer:
+    """Delivers events to one remote node. Events are queued and sent in batches over a single
+    keep-alive session, so that a burst of events costs one request instead of one per event.
+
+    The queue is bounded, and events older than `ttl` seconds are discarded instead of sent. After
+    a failure the peer waits with exponential backoff, and after `breaker_threshold` failures in a
+    row the circuit breaker opens: nothing is sent for `breaker_timeout` seconds, and then a single
+    batch is tried to see whether the node is back.
+
+    Nodes too old to take batches answer 404; events are then sent to them one per request, to
+    `fallback_url`, for `UNBATCHED_TIME` seconds before batches are tried again."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+
+    UNBATCHED_TIME = 60
+
+    def __init__(self, name, url, fallback_url=None, batch_size=100, batch_delay=.005, retry_delay=.1, max_backoff=30, binary=False,
+                 max_pending=10000, drop_policy=DROP_OLDEST, ttl=60, breaker_threshold=5, breaker_timeout=30):
+        if drop_policy not in (self.DROP_OLDEST, self.DROP_NEWEST):
+            raise ValueError("Invalid drop policy: {}".format(drop_policy))
+
+        self.name = name
+        self.url = url
+
+        #: Where to send single events, to nodes that don't take batches
+        self.fallback_url = fallback_url
+        self._unbatched_until = 0
+
+        #: Whether to use the binary wire format, once the other node has said it supports it
+        self.binary = binary
+        self._peer_binary = False
+
+        #: Send as soon as this many events are waiting
+        self.batch_size = batch_size
+
+        #: Otherwise, send after the first event has waited this many seconds
+        self.batch_delay = batch_delay
+
+        self.retry_delay = retry_delay
+        self.max_backoff = max_backoff
+
+        self.max_pending = max_pending
+        self.drop_policy = drop_policy
+        self.ttl = ttl
+
+        self.breaker_threshold = breaker_threshold
+        self.breaker_timeout = breaker_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+
+        #: [time queued, event] for every event waiting to be sent
+        self.pending = collections.deque()
+
+        #: Entries in pending that may still be replaced by a newer value, by source
+        self._coalescable = {}
+
+        self.sent = 0
+        self.dropped = 0
+        self.expired = 0
+        self.coalesced = 0
+
+        #: Histogram and counter to record send times and failures in, if any
+        self.send_latency = None
+        self.send_failures = None
+
+        self._waiting = asyncio.Event()
+        self._full = asyncio.Event()
+        self._session = None
+
+    @property
+    def stats(self):
+        return {
+            "state": self.state,
+            "pending": len(self.pending),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "expired": self.expired,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+        }
+
+    def _forget(self, entry):
+        source = entry[1]['source']
+        if self._coalescable.get(source) is entry:
+            del self._coalescable[source]
+
+    def _trim(self):
+        while len(self.pending) > self.max_pending:
+            if self.drop_policy == self.DROP_OLDEST:
+                self._forget(self.pending.popleft())
+            else:
+                self._forget(self.pending.pop())
+            self.dropped += 1
+
+    def _update_events(self):
+        if self.pending:
+            self._waiting.set()
+        else:
+            self._waiting.clear()
+
+        if len(self.pending) >= self.batch_size:
+            self._full.set()
+        else:
+            self._full.clear()
+
+    def send(self, event, coalesce=False):
+        """Queues an event to be sent. If `coalesce` is set and an event from the same source is
+        still waiting, it is replaced by this one instead."""
+        if coalesce:
+            queued = self._coalescable.get(event['source'])
+            if queued is not None:
+                queued[0] = time.monotonic()
+                queued[1] = event
+                self.coalesced += 1
+                return
+
+        if len(self.pending) >= self.max_pending and self.drop_policy == self.DROP_NEWEST:
+            self.dropped += 1
+            return
+
+        entry = [time.monotonic(), event]
+        self.pending.append(entry)
+        if coalesce:
+            self._coalescable[event['source']] = entry
+
+        self._trim()
+        self._update_events()
+
+    def requeue(self, entries):
+        """Puts events that could not be sent back where they were, ahead of anything newer"""
+        self.pending.extendleft(reversed(entries))
+        self._trim()
+        self._update_events()
+
+    def failed(self, batch):
+        self.requeue(batch)
+
+    def _take_batch(self):
+        batch = []
+        oldest = time.monotonic() - self.ttl
+
+        while self.pending and len(batch) < self.batch_size:
+            entry = self.pending.popleft()
+            self._forget(entry)
+
+            if entry[0] < oldest:
+                self.expired += 1
+            else:
+                batch.append(entry)
+
+        self._update_events()
+        return batch
+
+    async def next_batch(self):
+        await self._waiting.wait()
+
+        if not self._full.is_set():
+            try:
+                await asyncio.wait_for(self._full.wait(), self.batch_delay)
+            except asyncio.TimeoutError:
+                pass
+
+        return self._take_batch()
+
+    async def open(self):
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=1))
+
+    async def close(self):
+        await self._session.close()
+
+    async def deliver(self, batch):
+        if self.fallback_url is not None and time.monotonic() < self._unbatched_until:
+            await self.deliver_each(batch)
+            return
+
+        binary = self.binary and self._peer_binary
+        if binary:
+            data = wire.Encoder().encode(batch)
+            headers = {'Content-Type': wire.CONTENT_TYPE, wire.HEADER: wire.VERSION}
+        else:
+            data = json.dumps(batch)
+            headers = {'Content-Type': 'application/json', wire.HEADER: wire.VERSION}
+
+        async with self._session.post(self.url, data=data, headers=headers) as response:
+            # Error responses count too, so that a node downgraded to before the binary format
+            # is noticed by the first request it fails
+            self._peer_binary = response.headers.get(wire.HEADER) == wire.VERSION
+
+            if response.status == 404 and self.fallback_url is not None:
+                # The other node is from before batching, e.g. during a rolling upgrade
+                log.info("%s doesn't take batches of events, sending them one at a time for %ds",
+                         self.name, self.UNBATCHED_TIME)
+                self._unbatched_until = time.monotonic() + self.UNBATCHED_TIME
+                retry = self.deliver_each
+            elif binary and response.status >= 400 and (response.status == 415 or not self._peer_binary):
+                log.info("%s no longer accepts the binary wire format", self.name)
+                self._peer_binary = False
+                retry = self.deliver
+            else:
+                response.raise_for_status()
+                return
+
+        await retry(batch)
+
+    async def deliver_each(self, batch):
+        """Sends the events one per request, as nodes did before batching"""
+        for event in batch:
+            async with self._session.post(self.fallback_url, data=json.dumps(event),
+                                          headers={'Content-Type': 'application/json'}) as response:
+                response.raise_for_status()
+
+    def succeeded(self):
+        if self.state != self.CLOSED:
+            log.info("%s is reachable again", self.name)
+        self.state = self.CLOSED
+        self.failures = 0
+
+    async def _backoff(self):
+        self.failures += 1
+
+        if self.state == self.HALF_OPEN or self.failures >= self.breaker_threshold:
+            if self.state != self.OPEN:
+                log.warning("%s is unreachable, not sending to it for %ds", self.name, self.breaker_timeout)
+            self.state = self.OPEN
+            await asyncio.sleep(self.breaker_timeout)
+            self.state = self.HALF_OPEN
+        else:
+            # Full jitter, so that nodes don't all retry at the same moment
+            await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.retry_delay * 2 ** self.failures)))
+
+    async def run(self):
+        await self.open()
+
+        try:
+            while True:
+                batch = await self.next_batch()
+                if not batch:
+                    continue
+
+                start = time.monotonic()
+                try:
+                    await self.deliver([event for _, event in batch])
+                except Exception as e:
+                    log.warning("Could not send %d events to %s: %s", len(batch), self.name, e)
+                    if self.send_failures is not None:
+                        self.send_failures.inc()
+                    self.failed(batch)
+                    await self._backoff()
+                else:
+                    log.debug("Sent %d events to %s", len(batch), self.name)
+                    if self.send_latency is not None:
+                        self.send_latency.observe(time.monotonic() - start)
+                    self.sent += len(batch)
+                    self.succeeded()
+        finally:
+            await self.close()
+
+
+class StreamPeer(Peer):
+    """Delivers events to one remote node over a long-lived stream connection. Each batch is
+    followed by a SYNC frame, which the other node answers with a cumulative ACK. Events that
+    have not been acknowledged when the connection drops are sent again after reconnecting.
+
+    A node that goes away without closing the connection, e.g. by losing power, never sends
+    anything again. So if connecting, or the next ACK while events are outstanding, takes longer
+    than `ack_timeout` seconds, the connection is dropped and made again after backing off, as
+    for any other failure."""
+
+    def __init__(self, name, host, port, node_name, window=None, ack_timeout=10, **kwargs):
+        super().__init__(name, None, **kwargs)
+
+        self.host = host
+        self.port = port
+
+        #: Our own name, sent to the other node when connecting
+        self.node_name = node_name
+
+        #: Wait for acknowledgements once this many events are outstanding
+        self.window = window or 10 * self.batch_size
+
+        self.ack_timeout = ack_timeout
+
+        self.unacked = collections.deque()
+
+        self._writer = None
+        self._encoder = None
+        self._acked = 0
+        self._read_task = None
+        self._ack_timer = None
+        self._ack_failed = False
+        self._window_open = asyncio.Event()
+        self._window_open.set()
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        self._disconnect()
+
+    async def _connect(self):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.ack_timeout)
+
+        log.info("Connected to %s at %s:%s", self.name, self.host, self.port)
+        self._writer = writer
+        self._encoder = wire.Encoder()
+        self._acked = 0
+
+        writer.write(wire.hello(self.node_name))
+        self._read_task = asyncio.ensure_future(self._read_acks(reader))
+
+    def _disconnect(self):
+        self._stop_ack_timer()
+
+        if self._read_task:
+            self._read_task.cancel()
+            self._read_task = None
+
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+        # Anything that wasn't acknowledged has to be sent again
+        unacked = list(self.unacked)
+        self.unacked.clear()
+        self.requeue(unacked)
+        self._window_open.set()
+
+    def _stop_ack_timer(self):
+        if self._ack_timer is not None:
+            self._ack_timer.cancel()
+            self._ack_timer = None
+
+    def _ack_overdue(self):
+        self._ack_timer = None
+        if self.unacked:
+            log.warning("No acknowledgement from %s for %ss, reconnecting", self.name, self.ack_timeout)
+            self._ack_failed = True
+            self._disconnect()
+
+    def succeeded(self):
+        # Writes succeed even if nobody is there any more; only an ACK shows that the other node is
+        pass
+
+    def failed(self, batch):
+        # The batch is already in unacked, so it will be requeued along with the rest
+        self._disconnect()
+
+    async def _read_acks(self, reader):
+        try:
+            while True:
+                payload = await wire.read_frame(reader)
+
+                if payload[0] != wire.ACK:
+                    raise wire.WireError("Expected ACK, got frame type {}".format(payload[0]))
+
+                count = wire.decode_ack(payload)
+                for _ in range(count - self._acked):
+                    self.unacked.popleft()
+                self._acked = count
+                super().succeeded()
+
+                # Give whatever is still outstanding its own time to be acknowledged
+                self._stop_ack_timer()
+                if self.unacked:
+                    self._ack_timer = asyncio.get_event_loop().call_later(self.ack_timeout, self._ack_overdue)
+
+                if len(self.unacked) < self.window:
+                    self._window_open.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("Lost connection to %s: %s", self.name, e)
+            self._read_task = None
+            self._disconnect()
+
+    async def deliver(self, batch):
+        if self._ack_failed:
+            # Back off before connecting again, as if this batch had failed too
+            self._ack_failed = False
+            raise wire.WireError("Events were not acknowledged in time")
+
+        if not self.connected:
+            await self._connect()
+
+        self._writer.write(self._encoder.encode(batch) + wire.sync())
+        if self._ack_timer is None:
+            self._ack_timer = asyncio.get_event_loop().call_later(self.ack_timeout, self._ack_overdue)
+        await self._writer.drain()
+
+    async def next_batch(self):
+        await self._window_open.wait()
+        return await super().next_batch()
+
+    def _take_batch(self):
+        # Unlike HTTP, events are kept until they are acknowledged, rather than until they are sent
+        batch = super()._take_batch()
+
+        self.unacked.extend(batch)
+        if len(self.unacked) >= self.window:
+            self._window_open.clear()
+
+        return batch
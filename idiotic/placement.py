@@ -0,0 +1,68 @@
+"""Chooses owners for many blocks in one pass.
+
+Each block can only go to a node where its fitness isn't False. Of those, it goes to the node with
+the best fitness, but nodes within `tolerance` of the best count as equally good, and among
+equally good nodes the one with the least load for its weight wins. Blocks with no requirements
+score the same everywhere, so they are spread over the cluster by weight.
+
+A node's load is the sum of the ``load`` of the blocks it owns, and is never allowed to go over its
+capacity. Blocks that can go to the fewest nodes, and then the heaviest, are placed first, so that
+they get their pick before the room left for them is taken by blocks that could go anywhere.
+"""
+
+
+class Placement:
+    def __init__(self, owners, unassignable, no_room):
+        #: Maps block names to their new owner
+        self.owners = owners
+
+        #: Blocks that can't run on any node
+        self.unassignable = unassignable
+
+        #: Blocks that could run somewhere, but every such node is full
+        self.no_room = no_room
+
+
+def place(fitnesses, nodes, block_loads=None, node_loads=None, capacities=None, weights=None, tolerance=0):
+    """Returns a Placement for the blocks in `fitnesses`, which maps block names to their fitness on
+    each node, or False where they can't run.
+
+    `block_loads` gives the load of each block, 1 by default. `node_loads` is the load already on
+    each node, `capacities` the most load each node may take, or None for no limit, and `weights`
+    how much of the load each node should get relative to the others, 1 by default.
+    """
+    block_loads = block_loads or {}
+    capacities = capacities or {}
+    weights = weights or {}
+    loads = {node: (node_loads or {}).get(node, 0) for node in nodes}
+
+    owners = {}
+    unassignable = []
+    no_room = []
+
+    eligible = {
+        name: [(fit, node) for node, fit in node_fits.items() if fit is not False and node in loads]
+        for name, node_fits in fitnesses.items()
+    }
+
+    for name in sorted(eligible, key=lambda name: (len(eligible[name]), -block_loads.get(name, 1), name)):
+        candidates = eligible[name]
+        if not candidates:
+            unassignable.append(name)
+            continue
+
+        load = block_loads.get(name, 1)
+        fits = [(fit, node) for fit, node in candidates
+                if capacities.get(node) is None or loads[node] + load <= capacities[node]]
+        if not fits:
+            no_room.append(name)
+            continue
+
+        best = max(fit for fit, _ in fits)
+        node = min((node for fit, node in fits if fit >= best - tolerance),
+                   key=lambda node: ((loads[node] + load) / weights.get(node, 1), -fitnesses[name][node], node))
+
+        owners[name] = node
+        loads[node] += load
+
+    return Placement(owners, unassignable, no_room)
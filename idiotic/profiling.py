@@ -0,0 +1,189 @@
+"""Accounting for the time blocks and resources spend on the event loop.
+
+Coroutines passed through `Profiler.wrap` are stepped by the profiler, which records, for each
+(name, kind):
+
+* ``wall``: time from the call starting to it finishing, including time spent waiting
+* ``busy``: time the coroutine actually held the event loop
+* ``cpu``: CPU time used by the event loop thread while it held it
+
+``busy`` and ``cpu`` exclude any other profiled coroutine awaited inside, so a block running
+its subscribers inline isn't charged for them. Calls that hold the loop for longer than
+`slow_threshold` seconds in total are kept in `slow_calls`.
+
+Only a `sample` of calls is profiled, 1% by default, since stepping every coroutine costs a
+lot on busy nodes. Each sampled call counts for ``1 / sample`` calls, so the totals estimate
+every call; ``max_busy`` and `slow_calls` only cover the calls sampled. Calls that aren't sampled
+are still wrapped in a coroutine that leaves their name on the stack, so that `running` can tell
+which block or resource is holding the loop, as the watchdog does for every stall.
+"""
+import collections
+import logging
+import random
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Stats:
+    __slots__ = ('calls', 'wall', 'busy', 'cpu', 'max_busy')
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.busy = 0.0
+        self.cpu = 0.0
+        self.max_busy = 0.0
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+class _Profiled:
+    __slots__ = ('profiler', 'name', 'kind', 'coro', 'weight')
+
+    def __init__(self, profiler, name, kind, coro, weight):
+        self.profiler = profiler
+        self.name = name
+        self.kind = kind
+        self.coro = coro
+        self.weight = weight
+
+    def __await__(self):
+        profiler = self.profiler
+        coro = self.coro
+        value = error = None
+        busy = cpu = 0.0
+        started = time.perf_counter()
+
+        try:
+            while True:
+                outer_busy, outer_cpu = profiler._nested
+                profiler._nested = (0.0, 0.0)
+
+                step_start = time.perf_counter()
+                step_cpu = time.thread_time()
+                try:
+                    if error is None:
+                        yielded = coro.send(value)
+                    else:
+                        yielded = coro.throw(error)
+                finally:
+                    step_busy = time.perf_counter() - step_start
+                    step_cpu = time.thread_time() - step_cpu
+                    nested_busy, nested_cpu = profiler._nested
+                    busy += step_busy - nested_busy
+                    cpu += step_cpu - nested_cpu
+                    profiler._nested = (outer_busy + step_busy, outer_cpu + step_cpu)
+
+                try:
+                    value = yield yielded
+                    error = None
+                except GeneratorExit:
+                    coro.close()
+                    raise
+                except BaseException as e:
+                    value = None
+                    error = e
+        except StopIteration as e:
+            return e.value
+        finally:
+            profiler.record(self.name, self.kind, time.perf_counter() - started, busy, cpu, self.weight)
+
+
+async def _named(name, kind, coro):
+    # Awaiting delegates each step straight to `coro`, so this only costs a frame on the stack,
+    # for running() to find
+    return await coro
+
+
+def running(frame):
+    """Returns the name of the innermost block or resource call in the stack of `frame`, from
+    another thread, or None if there is none or profiling is disabled"""
+    while frame is not None:
+        code = frame.f_code
+        if code is _named.__code__:
+            return frame.f_locals.get('name')
+        if code is _Profiled.__await__.__code__:
+            profiled = frame.f_locals.get('self')
+            if profiled is not None:
+                return profiled.name
+        frame = frame.f_back
+
+
+class Profiler:
+    def __init__(self, enabled=True, sample=.01, slow_threshold=.1, slow_log_size=100):
+        #: Whether calls are profiled at all
+        self.enabled = enabled
+
+        #: Fraction of calls to profile, when enabled
+        self.sample = sample
+
+        self.slow_threshold = slow_threshold
+        self.slow_calls = collections.deque(maxlen=slow_log_size)
+
+        #: Maps (name, kind) to Stats
+        self.stats = {}
+
+        self._nested = (0.0, 0.0)
+
+    def configure(self, enabled=None, sample=None, slow_threshold=None, slow_log_size=None):
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if sample is not None:
+            self.sample = float(sample)
+        if slow_threshold is not None:
+            self.slow_threshold = float(slow_threshold)
+        if slow_log_size is not None:
+            self.slow_calls = collections.deque(self.slow_calls, maxlen=int(slow_log_size))
+
+    def reset(self):
+        self.stats = {}
+        self.slow_calls.clear()
+
+    def wrap(self, name, kind, coro):
+        """Returns an awaitable for `coro` that is accounted to `name`. `kind` says what sort of
+        call it is, e.g. 'input', 'run' or 'fitness'."""
+        if not self.enabled:
+            return coro
+
+        if self.sample <= 0 or (self.sample < 1 and random.random() >= self.sample):
+            return _named(name, kind, coro)
+
+        return _Profiled(self, name, kind, coro, 1 / min(self.sample, 1))
+
+    def record(self, name, kind, wall, busy, cpu, weight=1):
+        """Adds a call to the totals, counting it `weight` times"""
+        stats = self.stats.get((name, kind))
+        if stats is None:
+            stats = self.stats[(name, kind)] = Stats()
+
+        stats.calls += weight
+        stats.wall += wall * weight
+        stats.busy += busy * weight
+        stats.cpu += cpu * weight
+        if busy > stats.max_busy:
+            stats.max_busy = busy
+
+        if busy >= self.slow_threshold:
+            log.warning("Slow %s in %s: held the event loop for %.3fs", kind, name, busy)
+            self.slow_calls.append({
+                "time": time.time(), "name": name, "kind": kind, "wall": wall, "busy": busy, "cpu": cpu,
+            })
+
+    def top(self, count=10, key='busy'):
+        """Returns the `count` names with the most cumulative `key`, with their totals and the
+        breakdown by kind of call."""
+        totals = {}
+        for (name, kind), stats in self.stats.items():
+            entry = totals.setdefault(name, dict(Stats().as_dict(), name=name, kinds={}))
+            entry['kinds'][kind] = stats.as_dict()
+            for attr in ('calls', 'wall', 'busy', 'cpu'):
+                entry[attr] += getattr(stats, attr)
+            entry['max_busy'] = max(entry['max_busy'], stats.max_busy)
+
+        return sorted(totals.values(), key=lambda e: e[key], reverse=True)[:count]
+
+
+#: The profiler used by blocks, mailboxes and resources on this node
+PROFILER = Profiler()
@@ -0,0 +1,189 @@
+"""Finds block and resource types by their config keys, importing their modules only when needed.
+
+A type's key is its module and its name in snake case, e.g. ``benchmarks.blocks.emitter``, with
+the ``idiotic.util.blocks.`` or ``idiotic.util.resources.`` prefix left off for the types that
+come with idiotic, e.g. ``zoneminder.zone`` or ``host.node_name``. The name is the class's ``ID``
+if it has one, or else its class name.
+
+The types that come with idiotic are listed in a manifest, ``idiotic/util/manifest.json``, which
+is written by scanning the source without importing anything:
+
+    python -m idiotic.registry
+
+Other packages can declare types through the ``idiotic.blocks`` and ``idiotic.resources`` entry
+points, as ``key = module:Class``. Any other key is looked up by importing the module it names.
+"""
+import ast
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import re
+
+log = logging.getLogger(__name__)
+
+PACKAGE = 'idiotic.util'
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'util', 'manifest.json')
+
+#: The kinds of types, with the class every type of that kind derives from, and the package
+#: holding the ones that come with idiotic
+KINDS = {
+    'blocks': ('Block', PACKAGE + '.blocks'),
+    'resources': ('Resource', PACKAGE + '.resources'),
+}
+
+
+def pascal_to_snake_case(name):
+    s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
+    return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
+
+
+def type_key(module, name):
+    """Returns the config key for a type called `name`, defined in `module`"""
+    key = '.'.join((module, pascal_to_snake_case(name)))
+    for _, package in KINDS.values():
+        if key.startswith(package + '.'):
+            return key[len(package) + 1:]
+    return key
+
+
+def _base_name(node):
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    if isinstance(node, ast.Name):
+        return node.id
+
+
+def scan(package=PACKAGE):
+    """Returns the manifest for every block and resource type defined in the package, from its
+    source. A class is a type if any of its bases is named like the base class of that kind, or
+    like another type found."""
+    spec = importlib.util.find_spec(package)
+    root = os.path.dirname(spec.origin)
+
+    classes = []
+    for directory, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if not filename.endswith('.py'):
+                continue
+
+            path = os.path.join(directory, filename)
+            module = '.'.join([package] + os.path.relpath(path[:-3], root).split(os.sep))
+            if module.endswith('.__init__'):
+                module = module[:-len('.__init__')]
+
+            with open(path) as f:
+                tree = ast.parse(f.read(), path)
+
+            for node in tree.body:
+                if isinstance(node, ast.ClassDef):
+                    name = node.name
+                    for stmt in node.body:
+                        if isinstance(stmt, ast.Assign) and any(getattr(t, 'id', None) == 'ID' for t in stmt.targets) \
+                                and isinstance(stmt.value, ast.Constant):
+                            name = stmt.value.value
+                    classes.append((module, node.name, name, [_base_name(base) for base in node.bases]))
+
+    manifest = {}
+    for kind, (base, _) in KINDS.items():
+        names = {base}
+        found = {}
+        while True:
+            for module, cls, name, bases in classes:
+                if any(b in names for b in bases):
+                    found[type_key(module, name)] = '{}:{}'.format(module, cls)
+            if {value.split(':')[1] for value in found.values()} <= names:
+                break
+            names |= {value.split(':')[1] for value in found.values()}
+        manifest[kind] = dict(sorted(found.items()))
+
+    return manifest
+
+
+def load_manifest(path=MANIFEST_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        log.warning("No manifest at %s, scanning %s for types instead", path, PACKAGE)
+        return scan()
+
+
+def _entry_points(group):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return {}
+
+    try:
+        points = entry_points(group=group)
+    except TypeError:
+        # Before Python 3.10
+        points = entry_points().get(group, ())
+    return {point.name: point.value for point in points}
+
+
+class Registry(dict):
+    """The types of one kind, by key. Types are imported the first time they're looked up, unless
+    they were added directly."""
+
+    _manifest = None
+
+    def __init__(self, kind):
+        super().__init__()
+        self.kind = kind
+        self._declared = None
+
+    def declared(self):
+        """Returns the location of every type listed in the manifest or in entry points, by key"""
+        if self._declared is None:
+            if Registry._manifest is None:
+                Registry._manifest = load_manifest()
+            self._declared = dict(Registry._manifest.get(self.kind, {}))
+            self._declared.update(_entry_points('idiotic.' + self.kind))
+        return self._declared
+
+    def __missing__(self, key):
+        location = self.declared().get(key)
+        if location is not None:
+            module, name = location.split(':')
+            cls = getattr(importlib.import_module(module), name)
+        else:
+            cls = self._find(key)
+
+        log.debug("Loaded %s %s from %s", self.kind[:-1], key, cls.__module__)
+        self[key] = cls
+        return cls
+
+    def _find(self, key):
+        if '.' not in key:
+            raise KeyError(key)
+
+        module_name, name = key.rsplit('.', 1)
+        for candidate in (KINDS[self.kind][1] + '.' + module_name, module_name):
+            try:
+                module = importlib.import_module(candidate)
+            except ImportError as e:
+                # Only carry on if it was the module itself that was missing
+                if e.name is None or not candidate.startswith(e.name):
+                    raise
+                continue
+
+            for value in vars(module).values():
+                if isinstance(value, type) and value.__module__ == module.__name__ and \
+                        pascal_to_snake_case(getattr(value, 'ID', value.__name__)) == name:
+                    return value
+
+        raise KeyError(key)
+
+
+def main():
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump(scan(), f, indent=2)
+        f.write('\n')
+    print("Wrote {}".format(MANIFEST_PATH))
+
+
+if __name__ == '__main__':
+    main()
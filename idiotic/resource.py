@@ -1,4 +1,13 @@
-import collections
+import asyncio
+import collections.abc
+import logging
+import random
+import time
+
+from idiotic import profiling
+from idiotic import registry
+
+log = logging.getLogger(__name__)
 
 
 class MissingResource(Exception):
@@ -6,14 +15,81 @@ class MissingResource(Exception):
 
 
 class Resource:
-    REGISTRY = {}
+    #: Every type of resource, by the key used for it in the config
+    REGISTRY = registry.Registry('resources')
+
+    #: Seconds that a check of whether the resource is available stays fresh for, or None if it
+    #: never changes
+    ttl = 10
+
+    #: The scheduler checking the resource, once it has been interned by one
+    scheduler = None
 
     def __init__(self):
-        self.running = False
+        self._running = asyncio.Event()
+
+        self._description = None
+
+        self._available = None
+        self._checked = None
+        self._refreshing = None
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    @running.setter
+    def running(self, value):
+        if value:
+            self._running.set()
+        else:
+            self._running.clear()
+
+    async def wait_running(self):
+        await self._running.wait()
 
     def describe(self):
         return 'resource:idiotic.Resource/'
 
+    @property
+    def description(self):
+        """The result of describe(), which identifies the resource across the cluster"""
+        if self._description is None:
+            self._description = self.describe()
+        return self._description
+
+    def stale(self):
+        return self._checked is None or (self.ttl is not None and time.monotonic() - self._checked > self.ttl)
+
+    async def refresh(self) -> bool:
+        """Checks whether the resource is available now, and caches the result. Only one check is
+        made at a time, however many callers are waiting for it."""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._refresh())
+        return await asyncio.shield(self._refreshing)
+
+    async def _refresh(self):
+        try:
+            if self.scheduler is None:
+                available = bool(await self.available())
+            else:
+                available = await self.scheduler.check(self)
+        except Exception:
+            log.exception("Checking whether %s is available failed", self.description)
+            available = False
+
+        self._available = available
+        self._checked = time.monotonic()
+        return available
+
+    def cached_available(self):
+        """Returns whether the resource was available when last checked, or None if it hasn't been
+        checked yet. If that was more than `ttl` seconds ago, it is checked again in the
+        background."""
+        if self.stale() and self._available is not None and (self._refreshing is None or self._refreshing.done()):
+            self._refreshing = asyncio.ensure_future(self._refresh())
+        return self._available
+
     async def available(self):
         return bool(await self.fitness())
 
@@ -29,6 +105,152 @@ class Resource:
         self.running = True
 
 
+def changed(old, new, threshold):
+    """Returns whether a fitness has changed from `old` to `new` by enough to be worth telling the
+    cluster about: from available to unavailable or back, or by more than `threshold` of itself"""
+    if old is None or bool(old) != bool(new):
+        return True
+    if isinstance(old, bool) or isinstance(new, bool) or not isinstance(old, (int, float)) \
+            or not isinstance(new, (int, float)):
+        return old != new
+    return abs(new - old) > threshold * abs(old)
+
+
+class Scheduler:
+    """Keeps one instance of each distinct resource on a node, shared by every block that needs it,
+    and checks whether each is available every `ttl` seconds, give or take `jitter` of that, with at
+    most `concurrency` checks at once.
+
+    The fitness of resources that can change is measured again every `fitness_interval` seconds.
+    Both kinds of check give up after `fitness_timeout`, so that a hung check doesn't hold on to its
+    place for good. Numeric fitnesses, such as latencies, are smoothed with an exponentially
+    weighted moving average, giving each new measurement a weight of `smoothing`.
+    Every function in `listeners` is called with the description and fitness of a resource when it
+    has changed by more than `fitness_threshold` since it was last published.
+    """
+
+    def __init__(self, concurrency=8, jitter=.1, fitness_interval=60, fitness_timeout=5, smoothing=.3,
+                 fitness_threshold=.2):
+        #: Every resource on this node, by description
+        self.resources = {}
+
+        self.jitter = jitter
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+        self.fitness_interval = fitness_interval
+        self.fitness_timeout = fitness_timeout
+        self.smoothing = smoothing
+        self.fitness_threshold = fitness_threshold
+
+        #: The smoothed fitness of every resource measured, by description
+        self.fitnesses = {}
+
+        #: The fitness last published for every resource, by description
+        self.published = {}
+
+        self.listeners = []
+
+        self._started = set()
+        self._new = asyncio.Queue()
+
+    def configure(self, concurrency=None, jitter=None, fitness_interval=None, fitness_timeout=None,
+                  smoothing=None, fitness_threshold=None):
+        if concurrency is not None:
+            self.semaphore = asyncio.Semaphore(int(concurrency))
+        if jitter is not None:
+            self.jitter = float(jitter)
+        if fitness_interval is not None:
+            self.fitness_interval = float(fitness_interval)
+        if fitness_timeout is not None:
+            self.fitness_timeout = float(fitness_timeout)
+        if smoothing is not None:
+            self.smoothing = float(smoothing)
+        if fitness_threshold is not None:
+            self.fitness_threshold = float(fitness_threshold)
+
+    async def check(self, res):
+        """Returns whether the resource is available, or False if checking takes longer than
+        `fitness_timeout`"""
+        try:
+            async with self.semaphore:
+                return bool(await asyncio.wait_for(
+                    profiling.PROFILER.wrap(res.description, 'fitness', res.available()), self.fitness_timeout))
+        except asyncio.TimeoutError:
+            log.warning("Checking whether %s is available timed out after %ss", res.description, self.fitness_timeout)
+            return False
+
+    async def measure(self, res):
+        """Measures the fitness of the resource, and returns it smoothed with the ones before"""
+        try:
+            async with self.semaphore:
+                fitness = await asyncio.wait_for(
+                    profiling.PROFILER.wrap(res.description, 'fitness', res.fitness()), self.fitness_timeout)
+        except asyncio.TimeoutError:
+            log.warning("Checking the fitness of %s timed out after %ss", res.description, self.fitness_timeout)
+            fitness = False
+        except Exception:
+            log.exception("Checking the fitness of %s failed", res.description)
+            fitness = False
+
+        previous = self.fitnesses.get(res.description)
+        if fitness and previous and not isinstance(fitness, bool) and not isinstance(previous, bool):
+            fitness = self.smoothing * fitness + (1 - self.smoothing) * previous
+
+        self.fitnesses[res.description] = fitness
+        return fitness
+
+    def publish(self, res, fitness):
+        """Tells the listeners about the fitness, if it has changed enough since it was last
+        published"""
+        if not changed(self.published.get(res.description), fitness, self.fitness_threshold):
+            return
+
+        self.published[res.description] = fitness
+        for listener in self.listeners:
+            listener(res.description, fitness)
+
+    def intern(self, res):
+        """Returns the resource on this node with the same description as `res`, which is `res`
+        itself if there was none before"""
+        existing = self.resources.get(res.description)
+        if existing is not None:
+            return existing
+
+        self.resources[res.description] = res
+        res.scheduler = self
+        self._new.put_nowait(res)
+        return res
+
+    async def start(self, res):
+        """Runs the resource, unless it is running already for another block"""
+        if res.description in self._started:
+            return
+        self._started.add(res.description)
+        await res.run()
+
+    async def _every(self, interval, func, res):
+        # Spread out the first checks of resources found at the same time
+        await asyncio.sleep(random.uniform(0, interval))
+
+        while True:
+            await func(res)
+            await asyncio.sleep(interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    async def _probe(self, res):
+        self.publish(res, await self.measure(res))
+
+    async def run(self):
+        while True:
+            res = await self._new.get()
+            # Resources without a ttl never change, so their fitness doesn't either
+            if res.ttl is not None:
+                asyncio.ensure_future(self._every(res.ttl, lambda res: res.refresh(), res))
+                asyncio.ensure_future(self._every(self.fitness_interval, self._probe, res))
+
+
+Resource.REGISTRY['Resource'] = Resource
+
+
 def create(res_config):
     if len(res_config) != 1:
         raise ValueError("Resource config is malformed; must have only one top-level config")
@@ -43,14 +265,14 @@ def create(res_config):
         # require:
         #   - RequirementType: val
         res = res_cls(conf)
-    elif isinstance(conf, collections.Mapping):
+    elif isinstance(conf, collections.abc.Mapping):
         # Normal named-parameter definition:
         # require:
         #   - RequirementType:
         #     a: 1
         #     b: 2
         res = res_cls(**conf)
-    elif isinstance(conf, collections.Iterable):
+    elif isinstance(conf, collections.abc.Iterable):
         # Ordered parameter definition:
         # require:
         #   - RequirementType:
@@ -14,6 +14,8 @@ log = logging.getLogger(__name__)
 
 
 class HTTP(block.Block):
+    inline_inputs = False
+
     def __init__(self, name, url, method="GET", parameters=None, defaults=None, skip_repeats=False, format_data=True,
                  output=True, data=None, json=False, **options):
         super().__init__(name, **options)
@@ -62,7 +64,8 @@ class HTTP(block.Block):
             setattr(self, name, types.MethodType(setparam, self))
 
         self.inputs = {}
-        self.resources = [http.URLReachable(url_root)]
+        self.resources = []
+        self.require(http.URLReachable(url_root))
 
     async def _setparam(self, name, value):
         if not self.skip_repeats or value != self._param_dict.get(name):
@@ -154,6 +154,8 @@ class NestApi(resource.Resource):
 
 
 class Device(block.Block):
+    inline_inputs = False
+
     @classmethod
     def props(cls):
         return ('serial', 'name', 'name_long', 'device_id', 'online',
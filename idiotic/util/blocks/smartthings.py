@@ -7,6 +7,7 @@ from idiotic.util.resources import http
 import asyncio
 import aiohttp
 import logging
+import urllib.parse
 
 log = logging.getLogger(__name__)
 
@@ -97,6 +98,8 @@ class SmartApp(resource.Resource):
 
 
 class Device(block.Block):
+    inline_inputs = False
+
     def __init__(self, name, id=None, label=None, **config):
         super().__init__(name, **config)
         base_settings = global_config.get("modules", {}).get("smartthings", {})
@@ -118,7 +121,9 @@ class Device(block.Block):
 
         self.smartapp = SmartApp.instance(self.config['oauth_token'], self.config['endpoints_uri'], self.config['location'])
 
-        self.require(http.HostReachable(self.config.get('endpoints_uri')), self.smartapp)
+        endpoints = urllib.parse.urlsplit(self.config['endpoints_uri'])
+        port = endpoints.port or (443 if endpoints.scheme == 'https' else 80)
+        self.require(http.HostReachable(endpoints.hostname, port), self.smartapp)
 
     async def _update(self, data):
         if 'status' in data:
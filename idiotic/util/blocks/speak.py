@@ -8,6 +8,8 @@ log = logging.getLogger(__name__)
 
 
 class Speech(block.Block):
+    inline_inputs = False
+
     def __init__(self, name, text=None, parameters=None, defaults=None, command=None):
         self.name = name
 
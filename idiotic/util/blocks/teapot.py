@@ -9,6 +9,8 @@ log = logging.getLogger(__name__)
 
 
 class Teapot(block.Block):
+    inline_inputs = False
+
     def __init__(self, name, **config):
         super().__init__(name, **config)
         self.name = name
@@ -8,6 +8,8 @@ class WinkDeviceNotFound(Exception):
 
 
 class Device(block.Block):
+    inline_inputs = False
+
     def __init__(self, name, **config):
         super().__init__(name, **config)
         self.config.setdefault('base_url', 'https://winkapi.quirky.com')
@@ -13,6 +13,8 @@ class InvalidCodeError(Exception):
 
 
 class X10(block.Block):
+    inline_inputs = False
+
     def __init__(self, name, **params):
         super().__init__(name, **params)
         defaults = {
@@ -3,6 +3,9 @@ from idiotic import node
 
 
 class NodeName(Resource):
+    # A node never changes its name
+    ttl = None
+
     def __init__(self, name=None, *names):
         super().__init__()
 
@@ -9,44 +9,51 @@ log = logging.getLogger(__name__)
 
 
 class HostReachable(Resource):
-    def __init__(self, host, port=80):
+    ttl = 30
+
+    def __init__(self, host, port=80, timeout=5):
         super().__init__()
         self.host = host
         self.port = port
+        self.timeout = timeout
 
     def describe(self):
         return 'http.HostReachable/' + self.host + ':' + str(self.port)
 
     async def fitness(self):
-        return True
-
         try:
             log.debug("Checking host...")
             start = time.time()
-            reader, writer = await asyncio.open_connection(self.host, self.port)
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
             log.debug("Connection opened!")
             writer.close()
             log.debug("Writer closed")
             return -(time.time() - start) or -1e-6
-        except:
-            log.exception("Connection chck failed for %s:%d", self.host, self.port)
+        except (OSError, asyncio.TimeoutError) as e:
+            log.warning("Connection check failed for %s:%d: %s", self.host, self.port, e)
             return False
 
 
 class URLReachable(Resource):
-    def __init__(self, address):
+    ttl = 30
+
+    def __init__(self, address, timeout=5):
         super().__init__()
         self.address = address
+        self.timeout = timeout
 
     def describe(self):
         return 'http.URLReachable/' + self.address
 
     async def fitness(self):
-        async with aiohttp.ClientSession() as client:
-            start = time.time()
-            async with client.head(self.address) as response:
-                if response.status == 200 or 300 <= response.status <= 399:
-                    # If we somehow get 0 elapsed time here, just use one microsecond
-                    return -(time.time() - start) or -1e-6
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as client:
+                start = time.time()
+                async with client.head(self.address) as response:
+                    if response.status == 200 or 300 <= response.status <= 399:
+                        # If we somehow get 0 elapsed time here, just use one microsecond
+                        return -(time.time() - start) or -1e-6
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning("Request to %s failed: %s", self.address, e)
         return False
 
@@ -3,6 +3,9 @@ import importlib
 
 
 class Module(Resource):
+    # Modules that import once keep importing
+    ttl = None
+
     def __init__(self, name=None, *names):
         super().__init__()
 
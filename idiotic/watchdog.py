@@ -0,0 +1,105 @@
+"""Detects code blocking the event loop, and finds out what it was.
+
+The loop side wakes up every `interval` seconds and measures how late it was scheduled. A
+separate thread watches for the loop falling silent for more than `threshold` seconds; when it
+does, the thread captures the loop thread's stack while it is still stuck, and attributes it to
+the innermost block or resource call in that stack, whether or not the profiler sampled it, and
+to the innermost frame of a block or resource module.
+"""
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from idiotic import profiling
+
+log = logging.getLogger(__name__)
+
+_UTIL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'util')
+
+
+class Watchdog:
+    def __init__(self, interval=.05, threshold=.25, history=50):
+        self.interval = interval
+        self.threshold = threshold
+
+        #: The most recent stalls, newest last
+        self.stalls = collections.deque(maxlen=history)
+
+        #: Histogram to record scheduling lag in, if any
+        self.lag = None
+
+        #: The largest scheduling lag seen so far
+        self.max_lag = 0.0
+
+        self._heartbeat = time.monotonic()
+        self._loop_thread = None
+        self._reported = None
+
+    @staticmethod
+    def culprit(frame):
+        """Returns a description of the innermost block or resource module frame in the stack"""
+        while frame is not None:
+            if frame.f_code.co_filename.startswith(_UTIL_DIR):
+                return "{}:{} in {}".format(os.path.relpath(frame.f_code.co_filename, _UTIL_DIR),
+                                            frame.f_lineno, frame.f_code.co_name)
+            frame = frame.f_back
+
+    def _check(self):
+        heartbeat = self._heartbeat
+        stalled = time.monotonic() - heartbeat
+
+        if stalled < self.threshold or self._reported == heartbeat:
+            return
+
+        self._reported = heartbeat
+
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+
+        stall = {
+            "time": time.time(),
+            "stalled": stalled,
+            "running": profiling.running(frame),
+            "culprit": self.culprit(frame),
+            "stack": traceback.format_stack(frame),
+        }
+        self.stalls.append(stall)
+
+        log.warning("Event loop blocked for %.3fs by %s (at %s)", stalled,
+                    stall['running'] or 'unknown', stall['culprit'] or 'unknown')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Blocked at:\n%s", ''.join(stall['stack']))
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self._check()
+            except Exception:
+                log.exception("In event loop watchdog")
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        self._loop_thread = threading.get_ident()
+        threading.Thread(target=self._watch, name='idiotic-watchdog', daemon=True).start()
+
+        while True:
+            expected = loop.time() + self.interval
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+            lag = max(0.0, loop.time() - expected)
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if self.lag is not None:
+                self.lag.observe(lag)
+
+            if lag >= self.threshold and self.stalls and self._reported == self._heartbeat:
+                # Now we know how long that stall really lasted
+                self.stalls[-1]['stalled'] = lag + self.interval
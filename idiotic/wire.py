@@ -0,0 +1,178 @@
+"""Compact binary encoding for events sent between nodes.
+
+Events are written as length-prefixed frames. The first time a source is sent it is given a
+numeric ID with a DEFINE frame, and every EVENT frame after that refers to the source by ID. The
+IDs are only valid for one Encoder/Decoder pair: one HTTP request, or one stream connection.
+
+Values are tagged by type; anything that isn't None, a bool, int, float or str is sent as JSON.
+
+Stream connections also use HELLO, SYNC and ACK frames: the sender introduces itself with HELLO
+and ends each batch with SYNC, and the receiver answers every SYNC with an ACK carrying the total
+number of events it has received on the connection.
+"""
+import asyncio
+import json
+import struct
+
+#: Sent by a node in requests and replies to say it understands this encoding
+HEADER = 'X-Idiotic-Wire'
+VERSION = '1'
+CONTENT_TYPE = 'application/x-idiotic-wire'
+
+DEFINE = 1
+EVENT = 2
+HELLO = 3
+SYNC = 4
+ACK = 5
+
+FRAME_HEADER = struct.Struct('>I')
+_DEFINE = struct.Struct('>BH')
+_EVENT = struct.Struct('>BHc')
+_INT = struct.Struct('>q')
+_FLOAT = struct.Struct('>d')
+_ACK = struct.Struct('>BQ')
+
+_INT_MIN = -2 ** 63
+_INT_MAX = 2 ** 63 - 1
+
+MAX_SOURCES = 2 ** 16
+
+
+class WireError(Exception):
+    pass
+
+
+def frame(payload):
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def hello(name):
+    return frame(bytes((HELLO,)) + name.encode('utf-8'))
+
+
+def sync():
+    return frame(bytes((SYNC,)))
+
+
+def ack(count):
+    return frame(_ACK.pack(ACK, count))
+
+
+def decode_ack(payload):
+    return _ACK.unpack_from(payload)[1]
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    """Reads one frame from a stream, and returns it without its length prefix"""
+    length, = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    return await reader.readexactly(length)
+
+
+def encode_value(data):
+    kind = type(data)
+    if kind is float:
+        return b'd', _FLOAT.pack(data)
+    elif kind is bool:
+        return (b'T' if data else b'F'), b''
+    elif kind is int and _INT_MIN <= data <= _INT_MAX:
+        return b'i', _INT.pack(data)
+    elif kind is str:
+        return b's', data.encode('utf-8')
+    elif data is None:
+        return b'N', b''
+    else:
+        return b'j', json.dumps(data).encode('utf-8')
+
+
+_DECODERS = {
+    b'N'[0]: lambda data, start, end: None,
+    b'T'[0]: lambda data, start, end: True,
+    b'F'[0]: lambda data, start, end: False,
+    b'i'[0]: lambda data, start, end: _INT.unpack_from(data, start)[0],
+    b'd'[0]: lambda data, start, end: _FLOAT.unpack_from(data, start)[0],
+    b's'[0]: lambda data, start, end: str(data[start:end], 'utf-8'),
+    b'j'[0]: lambda data, start, end: json.loads(str(data[start:end], 'utf-8')),
+}
+
+
+def decode_value(tag, data, start=0, end=None):
+    try:
+        decoder = _DECODERS[tag]
+    except KeyError:
+        raise WireError("Unknown value type {!r}".format(tag))
+    return decoder(data, start, len(data) if end is None else end)
+
+
+class Encoder:
+    def __init__(self):
+        self.sources = {}
+
+    def encode_event(self, event):
+        source = event['source']
+        res = b''
+
+        source_id = self.sources.get(source)
+        if source_id is None:
+            source_id = len(self.sources)
+            if source_id >= MAX_SOURCES:
+                raise WireError("Too many sources")
+
+            self.sources[source] = source_id
+            res += frame(_DEFINE.pack(DEFINE, source_id) + source.encode('utf-8'))
+
+        tag, value = encode_value(event['data'])
+        return res + frame(_EVENT.pack(EVENT, source_id, tag) + value)
+
+    def encode(self, events):
+        return b''.join(self.encode_event(event) for event in events)
+
+
+class Decoder:
+    def __init__(self):
+        self.sources = {}
+
+    def _decode(self, data, start, end):
+        kind = data[start]
+
+        if kind == EVENT:
+            _, source_id, tag = _EVENT.unpack_from(data, start)
+            try:
+                source = self.sources[source_id]
+            except KeyError:
+                raise WireError("Undefined source {}".format(source_id))
+            return {"data": decode_value(tag[0], data, start + _EVENT.size, end), "source": source}
+        elif kind == DEFINE:
+            _, source_id = _DEFINE.unpack_from(data, start)
+            self.sources[source_id] = str(data[start + _DEFINE.size:end], 'utf-8')
+        else:
+            raise WireError("Unknown frame type {}".format(kind))
+
+    def decode_frame(self, payload):
+        """Decodes a single frame, without its length prefix. Returns the event, or None if the
+        frame did not contain one."""
+        return self._decode(payload, 0, len(payload))
+
+    def decode(self, data):
+        events = []
+        pos = 0
+        size = len(data)
+        header = FRAME_HEADER.size
+        unpack = FRAME_HEADER.unpack_from
+
+        while pos < size:
+            if pos + header > size:
+                raise WireError("Truncated frame header")
+
+            length, = unpack(data, pos)
+            pos += header
+
+            if pos + length > size:
+                raise WireError("Truncated frame")
+
+            event = self._decode(data, pos, pos + length)
+            pos += length
+
+            if event is not None:
+                events.append(event)
+
+        return events
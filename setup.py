@@ -15,7 +15,7 @@ if 'bdist_rpm' in sys.argv:
 
 setup(
     name='idiotic',
-    packages=find_packages(exclude=['etc', 'contrib']),
+    packages=find_packages(exclude=['etc', 'contrib', 'benchmarks', 'benchmarks.*', 'tests']),
     version='2.0.0',
     description='Distributed home automation controller',
     long_description="""The idiotic distributed internet of things inhabitance
@@ -42,7 +42,8 @@ setup(
         'Topic :: Home Automation',
     ],
     install_requires=[
-        'pysyncobj>=0.2.1',
+        'pysyncobj>=0.3',
+        'numpy',
         'PyYAML',
         'aiohttp',
         'flask',
@@ -50,6 +51,7 @@ setup(
         'requests',
         'astral',
     ],
+    package_data={'idiotic.util': ['manifest.json']},
     data_files=data_files,
     entry_points={
         'console_scripts': [
@@ -0,0 +1,172 @@
+import asyncio
+import unittest
+
+from idiotic import block
+from idiotic import cluster
+from idiotic import config
+from idiotic import resource
+
+
+class Pinned(resource.Resource):
+    def __init__(self, node):
+        super().__init__()
+        self.node = node
+
+    def describe(self):
+        return 'tests.Pinned/' + self.node
+
+
+def make_cluster(*nodes):
+    conf = config.Config(
+        version=1,
+        cluster={"listen": "127.0.0.1", "port": 28300, "rpc_port": 28301},
+        nodes={nodes[0]: {}},
+    )
+    conf._node_name = nodes[0]
+    clus = cluster.Cluster(conf)
+    # A cluster of one node applies its changes directly, which is all these tests need, while
+    # placing blocks across every node
+    conf.nodes = {name: {} for name in nodes}
+    return clus
+
+
+def make_blocks(clus, **resources):
+    blocks = {name: block.Block(name, resources=res) for name, res in resources.items()}
+    clus.set_blocks(blocks)
+    for blk in blocks.values():
+        for res in blk.resources:
+            for node in clus.config.nodes:
+                clus.state.set_resource_fitness(res.description, node, node == res.node, _doApply=True)
+    return blocks
+
+
+class CompareAndSetTest(unittest.TestCase):
+    def setUp(self):
+        self.state = cluster.SharedState()
+        self.changes = []
+        self.state.listeners.append(lambda kind, changes: self.changes.append((kind, changes)))
+
+    def cas(self, owners, epochs):
+        return self.state.compare_and_set_block_owners(owners, epochs, _doApply=True)
+
+    def test_sets_owner_at_expected_epoch(self):
+        self.assertEqual(self.cas({"a": "n1"}, {"a": 0}), {"a": 1})
+        self.assertEqual(self.cas({"a": "n2"}, {"a": 1}), {"a": 2})
+
+        self.assertEqual(self.state.owners, {"a": "n2"})
+        self.assertEqual(self.state.epochs, {"a": 2})
+        self.assertEqual(self.changes, [('owners', {"a": ("n1", 1)}), ('owners', {"a": ("n2", 2)})])
+
+    def test_stale_epoch_ignored(self):
+        self.cas({"a": "n1"}, {"a": 0})
+
+        self.assertEqual(self.cas({"a": "n2"}, {"a": 0}), {})
+        self.assertEqual(self.cas({"a": "n2"}, {}), {})
+
+        self.assertEqual(self.state.owners, {"a": "n1"})
+        self.assertEqual(self.state.epochs, {"a": 1})
+        self.assertEqual(len(self.changes), 1)
+
+    def test_only_current_blocks_changed(self):
+        self.cas({"a": "n1"}, {"a": 0})
+
+        changed = self.cas({"a": "n2", "b": "n2"}, {"a": 0, "b": 0})
+
+        self.assertEqual(changed, {"b": 1})
+        self.assertEqual(self.state.owners, {"a": "n1", "b": "n2"})
+        self.assertEqual(self.changes[-1], ('owners', {"b": ("n2", 1)}))
+
+    def test_unassign(self):
+        self.cas({"a": "n1"}, {"a": 0})
+
+        self.assertEqual(self.cas({"a": None}, {"a": 1}), {"a": 2})
+        self.assertEqual(self.state.epochs, {"a": 2})
+        self.assertEqual(self.changes[-1], ('owners', {"a": (None, 2)}))
+
+
+class SetBlockOwnersTest(unittest.IsolatedAsyncioTestCase):
+    async def test_uses_epochs_seen_here(self):
+        clus = make_cluster("n1", "n2")
+
+        clus.set_block_owners({"a": "n1"})
+        clus.set_block_owners({"a": "n2"})
+
+        self.assertEqual(clus.block_owner("a"), "n2")
+        self.assertEqual(clus.block_epoch("a"), 2)
+        self.assertEqual(clus.owned, set())
+
+    async def test_out_of_date_owner_never_overwrites(self):
+        clus = make_cluster("n1", "n2")
+        clus.set_block_owners({"a": "n1"})
+        results = []
+
+        # Chosen before the change above was seen
+        clus.set_block_owners({"a": "n2"}, {"a": 0}, done=results.append)
+
+        self.assertEqual(results, [{}])
+        self.assertEqual(clus.block_owner("a"), "n1")
+        self.assertEqual(clus.owned, {"a"})
+
+    async def test_reassign_from_old_epoch(self):
+        clus = make_cluster("n1", "n2")
+        blocks = make_blocks(clus, a=[])
+        clus.set_block_owners({"a": "n1"})
+        clus.set_block_owners({"a": "n2"})
+
+        # As when a block stopped on n1 after it had already been moved to n2
+        clus.reassign_block(blocks["a"], epoch=1, avoid="n2")
+
+        self.assertEqual(clus.block_owner("a"), "n2")
+        self.assertEqual(clus.block_epoch("a"), 2)
+
+    async def test_wait_superseded(self):
+        clus = make_cluster("n1", "n2")
+        clus.set_block_owners({"a": "n1"})
+
+        waiter = asyncio.ensure_future(clus.wait_superseded("a", 1))
+        await asyncio.sleep(0)
+        self.assertFalse(waiter.done())
+
+        clus.set_block_owners({"a": "n2"})
+        await asyncio.wait_for(waiter, 1)
+
+
+class LostNodesTest(unittest.IsolatedAsyncioTestCase):
+    async def test_moves_blocks_off_lost_nodes(self):
+        clus = make_cluster("n1", "n2", "n3")
+        make_blocks(clus, a=[], b=[], pinned=[Pinned("n2")], stays=[])
+        clus.set_block_owners({"a": "n2", "b": "n2", "pinned": "n2", "stays": "n3"})
+
+        clus._apply_change('lost', frozenset({"n2"}))
+        clus.move_from_lost_nodes()
+
+        self.assertIn(clus.block_owner("a"), {"n1", "n3"})
+        self.assertIn(clus.block_owner("b"), {"n1", "n3"})
+        # Nowhere else to go, so it waits for its node to come back
+        self.assertEqual(clus.block_owner("pinned"), "n2")
+        self.assertEqual(clus.block_owner("stays"), "n3")
+        self.assertEqual(clus.block_epoch("stays"), 1)
+
+    async def test_never_assigned_to_lost_nodes(self):
+        clus = make_cluster("n1", "n2")
+        make_blocks(clus, a=[], b=[], c=[], pinned=[Pinned("n2")])
+
+        clus._apply_change('lost', frozenset({"n2"}))
+        unassignable = clus.assign_blocks(list(clus.blocks.values()))
+
+        self.assertEqual([blk.name for blk in unassignable], ["pinned"])
+        self.assertEqual(set(clus.block_owners.values()), {"n1"})
+
+    async def test_nothing_lost(self):
+        clus = make_cluster("n1", "n2")
+        make_blocks(clus, a=[])
+        clus.set_block_owners({"a": "n2"})
+
+        clus.move_from_lost_nodes()
+
+        self.assertEqual(clus.block_owner("a"), "n2")
+        self.assertEqual(clus.block_epoch("a"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
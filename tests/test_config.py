@@ -0,0 +1,24 @@
+import unittest
+
+from idiotic import config
+
+
+class StreamAddressTest(unittest.TestCase):
+    def make_config(self, cluster=None, **nodes):
+        return config.Config(cluster=dict({"rpc_port": 28301}, **(cluster or {})), nodes=nodes)
+
+    def test_default_follows_each_nodes_rpc_port(self):
+        conf = self.make_config(a={"host": "127.0.0.1"}, b={"host": "127.0.0.1", "rpc_port": 28311})
+
+        self.assertEqual(conf.get_stream_address("a"), ("127.0.0.1", 28302))
+        self.assertEqual(conf.get_stream_address("b"), ("127.0.0.1", 28312))
+
+    def test_configured(self):
+        conf = self.make_config({"stream_port": 29000}, a={}, b={"stream_port": 29100})
+
+        self.assertEqual(conf.get_stream_address("a"), ("a", 29000))
+        self.assertEqual(conf.get_stream_address("b"), ("b", 29100))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import random
+import unittest
+
+from idiotic import fitness
+
+
+def per_block_scores(fitnesses, resources, nodes):
+    """How blocks were scored before the fitness matrix, one resource at a time. `fitnesses` maps
+    (resource, node) to fitness, with anything missing counting as unavailable."""
+    if not resources:
+        return {node: 1 for node in nodes}
+
+    node_fitnesses = {node: {} for node in nodes}
+    for resource in resources:
+        resource_fitnesses = {node: fitnesses.get((resource, node), 0) for node in nodes}
+        max_fit = max(resource_fitnesses.values())
+        min_fit = min(resource_fitnesses.values())
+
+        for node, fit in resource_fitnesses.items():
+            if not fit:
+                node_fitnesses[node][resource] = False
+            elif max_fit - min_fit:
+                node_fitnesses[node][resource] = (fit - min_fit) / (max_fit - min_fit)
+            else:
+                node_fitnesses[node][resource] = 1.0
+
+    res = {}
+    for node, res_fits in node_fitnesses.items():
+        if any(fit is False for fit in res_fits.values()):
+            res[node] = False
+        else:
+            res[node] = sum(res_fits.values())
+    return res
+
+
+class FitnessMatrixTest(unittest.TestCase):
+    def test_get_and_checked(self):
+        matrix = fitness.FitnessMatrix()
+        matrix.set("r", "n1", 2.5)
+        matrix.set("r", "n2", False)
+
+        self.assertEqual(matrix.get("r", "n1"), 2.5)
+        self.assertEqual(matrix.get("r", "n2"), 0)
+        self.assertEqual(matrix.get("r", "n3"), 0)
+        self.assertEqual(matrix.get("other", "n1"), 0)
+
+        self.assertTrue(matrix.is_checked("r", "n2"))
+        self.assertFalse(matrix.is_checked("r", "n3"))
+        self.assertFalse(matrix.is_checked("other", "n1"))
+
+        self.assertEqual(dict(matrix.items()), {("r", "n1"): 2.5, ("r", "n2"): 0})
+
+    def test_grows(self):
+        matrix = fitness.FitnessMatrix(resources=1, nodes=1)
+        for r in range(20):
+            for n in range(5):
+                matrix.set("r{}".format(r), "n{}".format(n), r * 10 + n + 1)
+
+        self.assertEqual(matrix.get("r0", "n0"), 1)
+        self.assertEqual(matrix.get("r19", "n4"), 195)
+        self.assertEqual(len(dict(matrix.items())), 100)
+
+    def test_no_resources(self):
+        matrix = fitness.FitnessMatrix()
+
+        self.assertEqual(matrix.scores([[]], ["n1", "n2"]), [{"n1": 1, "n2": 1}])
+
+    def test_unknown_resource(self):
+        matrix = fitness.FitnessMatrix()
+        matrix.set("known", "n1", 1)
+
+        self.assertEqual(matrix.scores([["known", "unknown"]], ["n1", "n2"]), [{"n1": False, "n2": False}])
+
+    def test_rescaled(self):
+        matrix = fitness.FitnessMatrix()
+        matrix.set("r", "n1", 1)
+        matrix.set("r", "n2", 3)
+        matrix.set("r", "n3", 2)
+
+        self.assertEqual(matrix.scores([["r"]], ["n1", "n2", "n3"]), [{"n1": 0, "n2": 1, "n3": 0.5}])
+
+    def test_cache_follows_changes(self):
+        matrix = fitness.FitnessMatrix()
+        matrix.set("r", "n1", 1)
+        matrix.set("r", "n2", 2)
+        self.assertEqual(matrix.scores([["r"]], ["n1", "n2"]), [{"n1": 0, "n2": 1}])
+
+        matrix.set("r", "n2", False)
+        self.assertEqual(matrix.scores([["r"]], ["n1", "n2"]), [{"n1": 1, "n2": False}])
+
+    def test_matches_per_block_scores(self):
+        rng = random.Random(0)
+        nodes = ["n{}".format(i) for i in range(5)]
+        resources = ["r{}".format(i) for i in range(12)]
+
+        for trial in range(50):
+            matrix = fitness.FitnessMatrix(resources=2, nodes=2)
+            fitnesses = {}
+            for resource in resources:
+                for node in nodes:
+                    kind = rng.random()
+                    if kind < .1:
+                        # Never checked on this node
+                        continue
+                    elif kind < .25:
+                        value = False
+                    elif kind < .5:
+                        # A latency, where less negative is better
+                        value = -rng.random()
+                    elif kind < .6:
+                        value = 1.0
+                    else:
+                        value = rng.uniform(0, 10)
+                    fitnesses[(resource, node)] = value
+                    matrix.set(resource, node, value)
+
+            blocks = [rng.sample(resources, rng.randint(0, 4)) for _ in range(20)]
+            # Resources nobody has a fitness for, and resources listed twice
+            blocks.append(["missing"])
+            blocks.append([resources[0], resources[0]])
+
+            scores = matrix.scores(blocks, nodes)
+
+            for block_resources, score in zip(blocks, scores):
+                if "missing" in block_resources:
+                    self.assertEqual(score, {node: False for node in nodes})
+                    continue
+
+                expected = per_block_scores(fitnesses, set(block_resources), nodes)
+                self.assertEqual(set(score), set(expected))
+                for node in nodes:
+                    if expected[node] is False:
+                        self.assertIs(score[node], False, (trial, block_resources, node))
+                    else:
+                        self.assertAlmostEqual(score[node], expected[node], msg=(trial, block_resources, node))
+
+
+if __name__ == "__main__":
+    unittest.main()
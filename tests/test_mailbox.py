@@ -0,0 +1,128 @@
+import asyncio
+import unittest
+
+from idiotic.block import Mailbox
+
+
+class MailboxTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.handled = []
+
+    async def handler(self, data):
+        self.handled.append(data)
+
+    def queued(self, mailbox):
+        return [item[2] for item in mailbox._items]
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            Mailbox("b", overflow="sometimes")
+
+    async def test_block_waits_for_room(self):
+        mailbox = Mailbox("b", size=2, overflow=Mailbox.BLOCK)
+        await mailbox.put("a", self.handler, 1)
+        await mailbox.put("a", self.handler, 2)
+
+        put = asyncio.ensure_future(mailbox.put("a", self.handler, 3))
+        await asyncio.sleep(0)
+        self.assertFalse(put.done())
+
+        mailbox._popleft()
+        await asyncio.wait_for(put, 1)
+
+        self.assertEqual(self.queued(mailbox), [2, 3])
+        self.assertEqual(mailbox.dropped, 0)
+
+    async def test_block_put_nowait_drops_oldest(self):
+        mailbox = Mailbox("b", size=2, overflow=Mailbox.BLOCK)
+        for i in range(3):
+            mailbox.put_nowait("a", self.handler, i)
+
+        self.assertEqual(self.queued(mailbox), [1, 2])
+        self.assertEqual(mailbox.dropped, 1)
+
+    async def test_drop_oldest(self):
+        mailbox = Mailbox("b", size=2, overflow=Mailbox.DROP_OLDEST)
+        for i in range(5):
+            await mailbox.put("a", self.handler, i)
+
+        self.assertEqual(self.queued(mailbox), [3, 4])
+        self.assertEqual(mailbox.dropped, 3)
+
+    async def test_latest(self):
+        mailbox = Mailbox("b", size=2, overflow=Mailbox.LATEST)
+        await mailbox.put("a", self.handler, 1)
+        await mailbox.put("b", self.handler, 2)
+        await mailbox.put("a", self.handler, 3)
+
+        self.assertEqual(self.queued(mailbox), [3, 2])
+        self.assertEqual(mailbox.replaced, 1)
+        self.assertEqual(mailbox.dropped, 0)
+
+        # A new key when full still drops the oldest, and its value can't be replaced any more
+        await mailbox.put("c", self.handler, 4)
+        await mailbox.put("a", self.handler, 5)
+
+        self.assertEqual(self.queued(mailbox), [4, 5])
+        self.assertEqual(mailbox.dropped, 2)
+        self.assertEqual(mailbox.replaced, 1)
+
+    async def test_deliver_inline_when_idle(self):
+        mailbox = Mailbox("b")
+
+        await mailbox.deliver("a", self.handler, 1)
+
+        self.assertEqual(self.handled, [1])
+        self.assertEqual(mailbox.depth, 0)
+
+    async def test_deliver_queued_when_not_inline(self):
+        mailbox = Mailbox("b", inline=False)
+
+        await mailbox.deliver("a", self.handler, 1)
+
+        self.assertEqual(self.handled, [])
+        self.assertEqual(mailbox.depth, 1)
+
+    async def test_block_put_from_handler_never_waits(self):
+        # A block whose output loops back to its own input, handled by the mailbox's task while
+        # it holds the mailbox
+        mailbox = Mailbox("b", size=2, overflow=Mailbox.BLOCK)
+
+        async def handler(data):
+            self.handled.append(data)
+            if data < 3:
+                for _ in range(3):
+                    await mailbox.deliver("a", handler, data + 1)
+
+        async def drained():
+            while mailbox.depth or mailbox._busy.locked():
+                await asyncio.sleep(0)
+
+        await mailbox.put("a", handler, 0)
+        task = asyncio.ensure_future(mailbox.run())
+        try:
+            await asyncio.wait_for(drained(), 1)
+        finally:
+            task.cancel()
+
+        self.assertFalse(mailbox._busy.locked())
+        self.assertGreater(mailbox.dropped, 0)
+
+    async def test_run_in_order(self):
+        mailbox = Mailbox("b", size=10)
+        for i in range(5):
+            await mailbox.put("a", self.handler, i)
+
+        task = asyncio.ensure_future(mailbox.run())
+        try:
+            while mailbox.depth:
+                await asyncio.sleep(0)
+            await asyncio.sleep(0)
+        finally:
+            task.cancel()
+
+        self.assertEqual(self.handled, [0, 1, 2, 3, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import unittest
+
+from aiohttp import test_utils
+from aiohttp import web
+
+import idiotic
+from idiotic import block
+from idiotic import cluster
+from idiotic import config
+from idiotic import wire
+
+
+class Sink(block.Block):
+    async def value(self, data):
+        pass
+
+
+block.Block.REGISTRY['tests.sink'] = Sink
+
+
+def make_config(blocks):
+    conf = config.Config(
+        version=1,
+        cluster={"listen": "127.0.0.1", "port": 28300, "rpc_port": 28301},
+        nodes={"n1": {"host": "127.0.0.1"}},
+        blocks=blocks,
+    )
+    conf._node_name = "n1"
+    return conf
+
+
+class InitializeBlocksTest(unittest.IsolatedAsyncioTestCase):
+    async def test_routes_owned_blocks_when_others_are_unassignable(self):
+        conf = make_config({
+            "src": {},
+            "dst": {"type": "tests.sink", "inputs": {"value": "src"}},
+            "pinned": {"require": [{"host.node_name": "elsewhere"}]},
+        })
+        clus = cluster.Cluster(conf)
+        node = cluster.Node("n1", clus, conf)
+        idiotic.set_node(node)
+
+        # As when joining a running cluster: the owners are known before the blocks exist
+        clus.set_block_owners({"src": "n1", "dst": "n1"})
+
+        await node.initialize_blocks()
+
+        self.assertEqual(clus.owned, {"src", "dst"})
+        self.assertEqual([route[2] for route in node.routes["src"]], ["dst.value"])
+        self.assertIn("pinned", node._unassignable)
+        self.assertIn("assign blocks", node.startup)
+
+
+class BlocksStartedTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        conf = make_config({
+            "src": {},
+            "dst": {"type": "tests.sink", "inputs": {"value": "src"}},
+            "maybe": {"optional": True, "require": [{"host.node_name": "elsewhere"}]},
+        })
+        self.clus = cluster.Cluster(conf)
+        self.node = cluster.Node("n1", self.clus, conf)
+        idiotic.set_node(self.node)
+        await self.node.initialize_blocks()
+
+    def running(self, *names):
+        for name in names:
+            task = self.node._block_tasks[name] = asyncio.get_running_loop().create_future()
+            self.addCleanup(task.cancel)
+
+    async def test_waits_for_owned_blocks_to_run(self):
+        self.assertEqual(self.clus.owned, {"src", "dst"})
+        self.assertFalse(self.node.blocks_started())
+
+        self.running("src")
+        self.assertFalse(self.node.blocks_started())
+
+        # The optional block that can't run anywhere isn't waited for
+        self.running("dst")
+        self.assertTrue(self.node.blocks_started())
+
+    async def test_stopped_block_not_started(self):
+        self.running("src", "dst")
+        self.node._block_tasks["dst"].cancel()
+
+        self.assertFalse(self.node.blocks_started())
+
+    async def test_waits_for_blocks_to_be_assigned(self):
+        self.running("src", "dst")
+        self.clus.set_block_owners({"dst": None})
+
+        self.assertFalse(self.node.blocks_started())
+
+
+class RpcEndpointTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        conf = make_config({})
+        self.node = cluster.Node("n1", cluster.Cluster(conf), conf)
+
+        app = web.Application()
+        app.router.add_route('POST', '/rpc', self.node.rpc_endpoint)
+        app.router.add_route('POST', '/rpc/batch', self.node.rpc_batch_endpoint)
+        self.client = test_utils.TestClient(test_utils.TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    def received(self):
+        events = []
+        while not self.node.events_in.empty():
+            events.append(self.node.events_in.get_nowait()[0])
+        return events
+
+    async def test_json(self):
+        event = {"source": "a.a", "data": 1}
+
+        response = await self.client.post("/rpc", json=event)
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers[wire.HEADER], wire.VERSION)
+        self.assertEqual(self.received(), [event])
+
+    async def test_json_without_content_type(self):
+        # As sent by curl -d, which aiohttp sees as application/octet-stream
+        event = {"source": "a.a", "data": 1}
+
+        response = await self.client.post("/rpc", data=json.dumps(event).encode(), skip_auto_headers=["Content-Type"])
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.received(), [event])
+
+    async def test_batch_with_other_content_type(self):
+        events = [{"source": "a.a", "data": 1}, {"source": "b.b", "data": 2}]
+
+        response = await self.client.post("/rpc/batch", data=json.dumps(events), headers={"Content-Type": "text/plain"})
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.received(), events)
+
+    async def test_not_json(self):
+        for path in ("/rpc", "/rpc/batch"):
+            response = await self.client.post(path, data=b"\x00\xff", headers={"Content-Type": "application/x-other"})
+
+            self.assertEqual(response.status, 415)
+            self.assertEqual(response.headers[wire.HEADER], wire.VERSION)
+        self.assertEqual(self.received(), [])
+
+    async def test_wire(self):
+        events = [{"source": "a.a", "data": 1}, {"source": "a.a", "data": [2]}]
+
+        response = await self.client.post("/rpc/batch", data=wire.Encoder().encode(events),
+                                          headers={"Content-Type": wire.CONTENT_TYPE})
+
+        self.assertEqual(response.status, 204)
+        self.assertEqual(self.received(), events)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,317 @@
+import asyncio
+import time
+import unittest
+
+from aiohttp import test_utils
+from aiohttp import web
+
+from idiotic import peer
+from idiotic import wire
+
+
+def events(count, start=0):
+    return [{"source": "a.a", "data": i} for i in range(start, start + count)]
+
+
+async def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        await asyncio.sleep(.01)
+
+
+class QueueTest(unittest.IsolatedAsyncioTestCase):
+    async def test_flush_on_size(self):
+        p = peer.Peer("n2", None, batch_size=3, batch_delay=10)
+        for event in events(4):
+            p.send(event)
+
+        batch = await asyncio.wait_for(p.next_batch(), 1)
+
+        self.assertEqual([event for _, event in batch], events(3))
+        self.assertEqual(len(p.pending), 1)
+
+    async def test_flush_on_time(self):
+        p = peer.Peer("n2", None, batch_size=3, batch_delay=.05)
+        p.send(events(1)[0])
+
+        start = time.monotonic()
+        batch = await asyncio.wait_for(p.next_batch(), 1)
+
+        self.assertGreaterEqual(time.monotonic() - start, .04)
+        self.assertEqual([event for _, event in batch], events(1))
+
+    async def test_drop_oldest(self):
+        p = peer.Peer("n2", None, max_pending=3)
+        for event in events(5):
+            p.send(event)
+
+        self.assertEqual([event for _, event in p.pending], events(3, start=2))
+        self.assertEqual(p.dropped, 2)
+
+    async def test_drop_newest(self):
+        p = peer.Peer("n2", None, max_pending=3, drop_policy=peer.Peer.DROP_NEWEST)
+        for event in events(5):
+            p.send(event)
+
+        self.assertEqual([event for _, event in p.pending], events(3))
+        self.assertEqual(p.dropped, 2)
+
+    async def test_expired(self):
+        p = peer.Peer("n2", None, ttl=10)
+        p.send(events(1)[0])
+        p.send(events(1, start=1)[0])
+        p.pending[0][0] -= 11
+
+        self.assertEqual([event for _, event in p._take_batch()], events(1, start=1))
+        self.assertEqual(p.expired, 1)
+
+    async def test_coalesce(self):
+        p = peer.Peer("n2", None)
+        p.send({"source": "a.a", "data": 1}, coalesce=True)
+        p.send({"source": "b.b", "data": 2}, coalesce=True)
+        p.send({"source": "a.a", "data": 3}, coalesce=True)
+
+        self.assertEqual([event for _, event in p.pending], [{"source": "a.a", "data": 3}, {"source": "b.b", "data": 2}])
+        self.assertEqual(p.coalesced, 1)
+
+        # Once taken, newer values are queued again
+        p._take_batch()
+        p.send({"source": "a.a", "data": 4}, coalesce=True)
+        self.assertEqual(len(p.pending), 1)
+
+    def test_invalid_drop_policy(self):
+        with self.assertRaises(ValueError):
+            peer.Peer("n2", None, drop_policy="sometimes")
+
+
+class BreakerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_open_and_half_open(self):
+        p = peer.Peer("n2", None, retry_delay=0, breaker_threshold=2, breaker_timeout=.05)
+
+        await p._backoff()
+        self.assertEqual(p.state, peer.Peer.CLOSED)
+
+        # The second failure in a row opens it until breaker_timeout has passed
+        backoff = asyncio.ensure_future(p._backoff())
+        await asyncio.sleep(0)
+        self.assertEqual(p.state, peer.Peer.OPEN)
+        await backoff
+        self.assertEqual(p.state, peer.Peer.HALF_OPEN)
+
+        # A failed try while half open opens it again straight away
+        backoff = asyncio.ensure_future(p._backoff())
+        await asyncio.sleep(0)
+        self.assertEqual(p.state, peer.Peer.OPEN)
+        await backoff
+
+        p.succeeded()
+        self.assertEqual(p.state, peer.Peer.CLOSED)
+        self.assertEqual(p.failures, 0)
+
+
+class HttpPeerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.received = []
+        self.content_types = []
+        self.status = None
+        self.app = web.Application()
+        self.peers = []
+
+    async def start(self, batches=True):
+        async def rpc(request):
+            self.received.append(await request.json())
+            return web.json_response({"Success": True})
+
+        async def rpc_batch(request):
+            self.content_types.append(request.content_type)
+            if self.status is not None:
+                return web.Response(status=self.status)
+
+            if request.content_type == wire.CONTENT_TYPE:
+                self.received.extend(wire.Decoder().decode(await request.read()))
+            else:
+                self.received.extend(await request.json())
+            return web.Response(status=204, headers={wire.HEADER: wire.VERSION})
+
+        self.app.router.add_route('POST', '/rpc', rpc)
+        if batches:
+            self.app.router.add_route('POST', '/rpc/batch', rpc_batch)
+
+        self.client = test_utils.TestClient(test_utils.TestServer(self.app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        for task in self.peers:
+            task.cancel()
+        await asyncio.gather(*self.peers, return_exceptions=True)
+        await self.client.close()
+
+    def run_peer(self, **kwargs):
+        p = peer.Peer("n2", str(self.client.make_url("/rpc/batch")), fallback_url=str(self.client.make_url("/rpc")),
+                      batch_delay=.01, retry_delay=.01, **kwargs)
+        self.peers.append(asyncio.ensure_future(p.run()))
+        return p
+
+    async def test_batches(self):
+        await self.start()
+        p = self.run_peer(batch_size=10)
+
+        for event in events(25):
+            p.send(event)
+        await wait_until(lambda: len(self.received) == 25)
+
+        self.assertEqual(self.received, events(25))
+        self.assertEqual(p.sent, 25)
+        self.assertEqual(len(self.content_types), 3)
+
+    async def test_binary_once_supported(self):
+        await self.start()
+        p = self.run_peer(binary=True)
+
+        p.send(events(1)[0])
+        await wait_until(lambda: len(self.received) == 1)
+        p.send(events(1, start=1)[0])
+        await wait_until(lambda: len(self.received) == 2)
+
+        self.assertEqual(self.content_types, ["application/json", wire.CONTENT_TYPE])
+        self.assertEqual(self.received, events(2))
+
+    async def test_json_when_binary_refused(self):
+        await self.start()
+        p = self.run_peer(binary=True)
+        p._peer_binary = True
+        self.status = 415
+
+        p.send(events(1)[0])
+        await wait_until(lambda: len(self.content_types) == 2)
+        self.status = None
+        await wait_until(lambda: len(self.received) == 1)
+
+        # Retried as JSON straight away
+        self.assertEqual(self.content_types[:2], [wire.CONTENT_TYPE, "application/json"])
+        self.assertEqual(self.received, events(1))
+
+    async def test_fallback_on_404(self):
+        await self.start(batches=False)
+        p = self.run_peer()
+
+        for event in events(3):
+            p.send(event)
+        await wait_until(lambda: len(self.received) == 3)
+
+        self.assertEqual(self.received, events(3))
+        self.assertGreater(p._unbatched_until, time.monotonic())
+        self.assertEqual(p.failures, 0)
+
+    async def test_requeued_after_failure(self):
+        await self.start()
+        self.status = 500
+        p = self.run_peer(breaker_threshold=100)
+
+        for event in events(3):
+            p.send(event)
+        await wait_until(lambda: p.failures >= 2)
+        self.status = None
+        await wait_until(lambda: len(self.received) == 3)
+
+        self.assertEqual(self.received, events(3))
+        self.assertEqual(p.state, peer.Peer.CLOSED)
+
+
+class StreamPeerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        #: Events received on each connection, in order
+        self.connections = []
+
+        #: Whether to acknowledge the events received on each connection, by its index
+        self.acknowledge = lambda index: True
+
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.peers = []
+
+    async def asyncTearDown(self):
+        for task in self.peers:
+            task.cancel()
+        await asyncio.gather(*self.peers, return_exceptions=True)
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        decoder = wire.Decoder()
+        received = []
+        index = len(self.connections)
+        self.connections.append(received)
+
+        try:
+            while True:
+                payload = await wire.read_frame(reader)
+                if payload[0] == wire.SYNC:
+                    if self.acknowledge(index) is None:
+                        # Go away without a word
+                        return
+                    if self.acknowledge(index):
+                        writer.write(wire.ack(len(received)))
+                        await writer.drain()
+                elif payload[0] != wire.HELLO:
+                    event = decoder.decode_frame(payload)
+                    if event is not None:
+                        received.append(event)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def run_peer(self, **kwargs):
+        p = peer.StreamPeer("n2", '127.0.0.1', self.port, "n1", batch_delay=.01, retry_delay=.01, **kwargs)
+        self.peers.append(asyncio.ensure_future(p.run()))
+        return p
+
+    async def test_acknowledged(self):
+        p = self.run_peer(batch_size=10)
+
+        for event in events(25):
+            p.send(event)
+        await wait_until(lambda: not p.pending and not p.unacked)
+
+        self.assertEqual(self.connections, [events(25)])
+
+    async def test_requeued_after_connection_aborted(self):
+        # The first connection is closed on the first SYNC, without acknowledging anything
+        self.acknowledge = lambda index: None if index == 0 else True
+        p = self.run_peer()
+
+        for event in events(5):
+            p.send(event)
+        await wait_until(lambda: len(self.connections) == 2 and not p.pending and not p.unacked)
+
+        self.assertEqual(self.connections, [events(5), events(5)])
+
+    async def test_reconnects_when_not_acknowledged(self):
+        self.acknowledge = lambda index: index > 0
+        p = self.run_peer(ack_timeout=.1)
+
+        for event in events(5):
+            p.send(event)
+        await wait_until(lambda: len(self.connections) == 2 and not p.pending and not p.unacked)
+
+        self.assertEqual(self.connections, [events(5), events(5)])
+
+    async def test_window(self):
+        self.acknowledge = lambda index: False
+        p = self.run_peer(batch_size=2, window=4)
+
+        for event in events(10):
+            p.send(event)
+        await wait_until(lambda: len(p.unacked) == 4)
+        await asyncio.sleep(.05)
+
+        self.assertEqual(len(p.unacked), 4)
+        self.assertEqual(len(p.pending), 6)
+        self.assertFalse(p._window_open.is_set())
+
+
+if __name__ == "__main__":
+    unittest.main()
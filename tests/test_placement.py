@@ -0,0 +1,101 @@
+import unittest
+
+from idiotic import placement
+
+
+class PlaceTest(unittest.TestCase):
+    def test_best_fitness_wins(self):
+        result = placement.place({"b": {"n1": 1, "n2": 3, "n3": 2}}, ["n1", "n2", "n3"])
+
+        self.assertEqual(result.owners, {"b": "n2"})
+
+    def test_never_on_unavailable_node(self):
+        result = placement.place({"b": {"n1": False, "n2": 0}}, ["n1", "n2"])
+
+        self.assertEqual(result.owners, {"b": "n2"})
+
+    def test_unassignable(self):
+        result = placement.place({"b": {"n1": False, "n2": False}}, ["n1", "n2"])
+
+        self.assertEqual(result.owners, {})
+        self.assertEqual(result.unassignable, ["b"])
+        self.assertEqual(result.no_room, [])
+
+    def test_unknown_nodes_ignored(self):
+        result = placement.place({"b": {"gone": 5, "n1": 1}}, ["n1"])
+
+        self.assertEqual(result.owners, {"b": "n1"})
+
+    def test_spread_evenly(self):
+        fitnesses = {"b{}".format(i): {"n1": 1, "n2": 1} for i in range(10)}
+
+        result = placement.place(fitnesses, ["n1", "n2"])
+
+        owners = list(result.owners.values())
+        self.assertEqual(owners.count("n1"), 5)
+        self.assertEqual(owners.count("n2"), 5)
+
+    def test_spread_by_weight(self):
+        fitnesses = {"b{}".format(i): {"n1": 1, "n2": 1} for i in range(12)}
+
+        result = placement.place(fitnesses, ["n1", "n2"], weights={"n1": 1, "n2": 2})
+
+        owners = list(result.owners.values())
+        self.assertEqual(owners.count("n1"), 4)
+        self.assertEqual(owners.count("n2"), 8)
+
+    def test_existing_load_counts(self):
+        fitnesses = {"b{}".format(i): {"n1": 1, "n2": 1} for i in range(4)}
+
+        result = placement.place(fitnesses, ["n1", "n2"], node_loads={"n1": 4})
+
+        self.assertEqual(set(result.owners.values()), {"n2"})
+
+    def test_capacity(self):
+        fitnesses = {"b{}".format(i): {"n1": 2, "n2": 1} for i in range(5)}
+
+        result = placement.place(fitnesses, ["n1", "n2"], capacities={"n1": 2, "n2": None})
+
+        owners = list(result.owners.values())
+        self.assertEqual(owners.count("n1"), 2)
+        self.assertEqual(owners.count("n2"), 3)
+
+    def test_capacity_counts_block_load(self):
+        result = placement.place({"heavy": {"n1": 2, "n2": 1}}, ["n1", "n2"],
+                                 block_loads={"heavy": 3}, capacities={"n1": 2})
+
+        self.assertEqual(result.owners, {"heavy": "n2"})
+
+    def test_no_room(self):
+        fitnesses = {"b{}".format(i): {"n1": 1} for i in range(3)}
+
+        result = placement.place(fitnesses, ["n1"], capacities={"n1": 2})
+
+        self.assertEqual(len(result.owners), 2)
+        self.assertEqual(len(result.no_room), 1)
+        self.assertEqual(result.unassignable, [])
+
+    def test_constrained_blocks_placed_first(self):
+        # "pinned" can only go to n1, which only has room for one block. Placed in name order,
+        # "anywhere" would take that room first.
+        fitnesses = {
+            "anywhere": {"n1": 1, "n2": 1},
+            "pinned": {"n1": 1, "n2": False},
+        }
+
+        result = placement.place(fitnesses, ["n1", "n2"], capacities={"n1": 1, "n2": 1})
+
+        self.assertEqual(result.owners, {"anywhere": "n2", "pinned": "n1"})
+
+    def test_tolerance(self):
+        fitnesses = {"a": {"n1": 1.0, "n2": 0.95}, "b": {"n1": 1.0, "n2": 0.95}}
+
+        strict = placement.place(fitnesses, ["n1", "n2"])
+        tolerant = placement.place(fitnesses, ["n1", "n2"], tolerance=.1)
+
+        self.assertEqual(set(strict.owners.values()), {"n1"})
+        self.assertEqual(sorted(tolerant.owners.values()), ["n1", "n2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import asyncio
+import sys
+import time
+import unittest
+
+from idiotic import profiling
+from idiotic import watchdog
+
+
+class ProfilerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_running_whether_sampled_or_not(self):
+        for sample in (0, 1):
+            profiler = profiling.Profiler(sample=sample)
+            seen = []
+
+            async def inner():
+                seen.append(profiling.running(sys._getframe()))
+
+            async def outer():
+                seen.append(profiling.running(sys._getframe()))
+                await profiler.wrap("inner", "input", inner())
+                seen.append(profiling.running(sys._getframe()))
+
+            await profiler.wrap("outer", "input", outer())
+
+            self.assertEqual(seen, ["outer", "inner", "outer"], sample)
+            self.assertIsNone(profiling.running(sys._getframe()))
+
+    async def test_disabled(self):
+        profiler = profiling.Profiler(enabled=False)
+        seen = []
+
+        async def call():
+            seen.append(profiling.running(sys._getframe()))
+
+        await profiler.wrap("b", "input", call())
+
+        self.assertEqual(seen, [None])
+        self.assertEqual(profiler.stats, {})
+
+    async def test_sampled_totals_scaled(self):
+        profiler = profiling.Profiler(sample=.5)
+
+        async def call():
+            pass
+
+        # Every call is sampled or not at random, so only count the ones that were
+        for _ in range(100):
+            await profiler.wrap("b", "input", call())
+
+        stats = profiler.stats[("b", "input")]
+        self.assertEqual(stats.calls % 2, 0)
+        self.assertGreater(stats.calls, 0)
+
+    async def test_slow_calls(self):
+        profiler = profiling.Profiler(sample=1, slow_threshold=.05)
+
+        async def call(seconds):
+            await asyncio.sleep(0)
+            time.sleep(seconds)
+
+        await profiler.wrap("fast", "input", call(0))
+        await profiler.wrap("slow", "input", call(.06))
+
+        self.assertEqual([call["name"] for call in profiler.slow_calls], ["slow"])
+        self.assertGreaterEqual(profiler.stats[("slow", "input")].max_busy, .05)
+
+
+class WatchdogTest(unittest.IsolatedAsyncioTestCase):
+    async def test_stall_attributed_to_unsampled_call(self):
+        profiler = profiling.Profiler(sample=0)
+        dog = watchdog.Watchdog(interval=.01, threshold=.05)
+        task = asyncio.ensure_future(dog.run())
+
+        async def block_the_loop():
+            time.sleep(.2)
+
+        try:
+            await asyncio.sleep(.05)
+            await profiler.wrap("blocker", "input", block_the_loop())
+            await asyncio.sleep(.05)
+        finally:
+            task.cancel()
+
+        self.assertEqual([stall["running"] for stall in dog.stalls], ["blocker"])
+
+
+if __name__ == "__main__":
+    unittest.main()
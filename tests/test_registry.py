@@ -0,0 +1,106 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from idiotic import registry
+
+
+class KeyTest(unittest.TestCase):
+    def test_snake_case(self):
+        self.assertEqual(registry.pascal_to_snake_case("NodeName"), "node_name")
+        self.assertEqual(registry.pascal_to_snake_case("HTTPRequest"), "http_request")
+        self.assertEqual(registry.pascal_to_snake_case("DHT22"), "dht22")
+
+    def test_type_key(self):
+        self.assertEqual(registry.type_key("idiotic.util.blocks.logic", "NotEqual"), "logic.not_equal")
+        self.assertEqual(registry.type_key("idiotic.util.resources.host", "NodeName"), "host.node_name")
+        self.assertEqual(registry.type_key("benchmarks.blocks", "Emitter"), "benchmarks.blocks.emitter")
+
+
+class ManifestTest(unittest.TestCase):
+    def test_up_to_date(self):
+        # If this fails, run python -m idiotic.registry
+        with open(registry.MANIFEST_PATH) as f:
+            self.assertEqual(registry.scan(), json.load(f))
+
+    def test_subclasses_of_types(self):
+        manifest = registry.load_manifest()
+
+        # NodeName derives from Resource, and AM2302 from DHT, which derives from Block
+        self.assertEqual(manifest["resources"]["host.node_name"], "idiotic.util.resources.host:NodeName")
+        self.assertEqual(manifest["blocks"]["dht.am2302"], "idiotic.util.blocks.dht:AM2302")
+
+
+class RegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.modules = set(sys.modules)
+        self.path = list(sys.path)
+
+    def tearDown(self):
+        sys.path[:] = self.path
+        for name in set(sys.modules) - self.modules:
+            if name.startswith("tmp_registry_"):
+                del sys.modules[name]
+
+    def write_module(self, name, source):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with open(os.path.join(directory.name, name + ".py"), "w") as f:
+            f.write(source)
+        sys.path.insert(0, directory.name)
+
+    def test_declared_type_imported_when_looked_up(self):
+        reg = registry.Registry("blocks")
+
+        self.assertNotIn("logic.not", reg)
+        cls = reg["logic.not"]
+
+        self.assertEqual((cls.__module__, cls.__name__), ("idiotic.util.blocks.logic", "Not"))
+        self.assertIn("logic.not", reg)
+
+    def test_added_directly(self):
+        reg = registry.Registry("blocks")
+        reg["mine"] = object
+
+        self.assertIs(reg["mine"], object)
+
+    def test_found_by_module(self):
+        cls = registry.Registry("blocks")["benchmarks.blocks.emitter"]
+
+        self.assertEqual((cls.__module__, cls.__name__), ("benchmarks.blocks", "Emitter"))
+
+    def test_found_by_id(self):
+        self.write_module("tmp_registry_ids", "class Thing:\n    ID = 'OtherName'\n")
+
+        cls = registry.Registry("blocks")["tmp_registry_ids.other_name"]
+
+        self.assertEqual(cls.__name__, "Thing")
+
+    def test_entry_points(self):
+        with mock.patch.object(registry, "_entry_points", return_value={"plugin.thing": "benchmarks.blocks:Recorder"}):
+            reg = registry.Registry("blocks")
+            cls = reg["plugin.thing"]
+
+        self.assertEqual(cls.__name__, "Recorder")
+
+    def test_unknown(self):
+        reg = registry.Registry("blocks")
+
+        for key in ("nodot", "no_such_module.thing", "logic.no_such_block"):
+            with self.assertRaises(KeyError):
+                reg[key]
+
+    def test_missing_dependency(self):
+        self.write_module("tmp_registry_deps", "import tmp_registry_not_installed\n")
+
+        with self.assertRaises(ImportError) as raised:
+            registry.Registry("blocks")["tmp_registry_deps.thing"]
+
+        self.assertEqual(raised.exception.name, "tmp_registry_not_installed")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+
+from idiotic import wire
+
+
+class EncoderDecoderTest(unittest.TestCase):
+    def round_trip(self, events):
+        return wire.Decoder().decode(wire.Encoder().encode(events))
+
+    def test_values(self):
+        values = [None, True, False, 0, -1, 2 ** 63 - 1, -2 ** 63, 1.5, -0.0, "", "héllo",
+                  2 ** 64, [1, "two", None], {"a": {"b": [1.5]}}]
+        events = [{"source": "block.output", "data": value} for value in values]
+
+        decoded = self.round_trip(events)
+
+        self.assertEqual(decoded, events)
+        for event, original in zip(decoded, events):
+            self.assertIs(type(event["data"]), type(original["data"]))
+
+    def test_sources_defined_once(self):
+        encoder = wire.Encoder()
+        events = [{"source": "a.a", "data": i} for i in range(3)] + [{"source": "b.b", "data": 3}]
+
+        data = encoder.encode(events)
+
+        self.assertEqual(data.count(b"a.a"), 1)
+        self.assertEqual(encoder.sources, {"a.a": 0, "b.b": 1})
+        self.assertEqual(wire.Decoder().decode(data), events)
+
+    def test_sources_persist_across_batches(self):
+        # As on a stream connection, where one encoder and decoder last for every batch
+        encoder = wire.Encoder()
+        decoder = wire.Decoder()
+
+        first = [{"source": "a.a", "data": 1}]
+        second = [{"source": "a.a", "data": 2}, {"source": "b.b", "data": 3}]
+
+        self.assertEqual(decoder.decode(encoder.encode(first)), first)
+        self.assertEqual(decoder.decode(encoder.encode(second)), second)
+
+    def test_decode_frame(self):
+        encoder = wire.Encoder()
+        decoder = wire.Decoder()
+        data = encoder.encode([{"source": "a.a", "data": 1}])
+
+        # The DEFINE frame comes first, and holds no event
+        length, = wire.FRAME_HEADER.unpack_from(data)
+        define = data[wire.FRAME_HEADER.size:wire.FRAME_HEADER.size + length]
+        event = data[wire.FRAME_HEADER.size * 2 + length:]
+
+        self.assertIsNone(decoder.decode_frame(define))
+        self.assertEqual(decoder.decode_frame(event), {"source": "a.a", "data": 1})
+
+    def test_truncated_frame(self):
+        data = wire.Encoder().encode([{"source": "a.a", "data": "value"}])
+
+        with self.assertRaisesRegex(wire.WireError, "Truncated frame$"):
+            wire.Decoder().decode(data[:-1])
+
+    def test_truncated_frame_header(self):
+        data = wire.Encoder().encode([{"source": "a.a", "data": 1}])
+
+        with self.assertRaisesRegex(wire.WireError, "Truncated frame header"):
+            wire.Decoder().decode(data + data[:2])
+
+    def test_undefined_source(self):
+        encoder = wire.Encoder()
+        encoder.encode([{"source": "a.a", "data": 1}])
+
+        # Encoded after the source was defined, so it refers to it by ID alone
+        data = encoder.encode([{"source": "a.a", "data": 2}])
+
+        with self.assertRaisesRegex(wire.WireError, "Undefined source 0"):
+            wire.Decoder().decode(data)
+
+    def test_unknown_frame_type(self):
+        with self.assertRaisesRegex(wire.WireError, "Unknown frame type"):
+            wire.Decoder().decode(wire.frame(bytes((99,))))
+
+    def test_unknown_value_type(self):
+        with self.assertRaisesRegex(wire.WireError, "Unknown value type"):
+            wire.decode_value(b"?"[0], b"")
+
+    def test_ack(self):
+        payload = wire.ack(12345)[wire.FRAME_HEADER.size:]
+
+        self.assertEqual(payload[0], wire.ACK)
+        self.assertEqual(wire.decode_ack(payload), 12345)
+
+
+if __name__ == "__main__":
+    unittest.main()